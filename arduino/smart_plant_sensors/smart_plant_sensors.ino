@@ -35,6 +35,32 @@ LiquidCrystal_I2C lcd(0x27, 16, 2); // I2C address 0x27, 16x2 display
 const long interval = 5000;  // Send data every 5 seconds
 unsigned long previousMillis = 0;
 
+// ========== TELEMETRY FORMAT ==========
+// JSON lines by default; compact binary frames once the Pi sends PROTO_BIN.
+// Frame: 0xA5 0x5A | version | payload length | payload | CRC16-CCITT (little-endian)
+// The CRC (poly 0x1021, init 0xFFFF) covers version, length and payload.
+// ACK:/STATUS: replies stay text lines in both modes.
+#define FRAME_SYNC1 0xA5
+#define FRAME_SYNC2 0x5A
+#define FRAME_VERSION 1
+// temp10 / hum10 when the DHT read failed (NaN); decoded as null, like the JSON line
+#define TEMP10_MISSING ((int16_t)-32768)
+#define HUM10_MISSING ((uint16_t)0xFFFF)
+
+// Payload layout (little-endian, 17 bytes vs ~200 for the JSON line)
+struct __attribute__((packed)) TelemetryPayload {
+  uint32_t millis;
+  uint16_t soil1;
+  uint16_t soil2;
+  uint16_t soil3;
+  uint16_t soilAvg;
+  int16_t temp10;    // Temperature in 0.1 C
+  uint16_t hum10;    // Humidity in 0.1 %
+  uint8_t flags;     // bit0 water, bit1 fan, bit2 heater, bit3 AI button, bit4 watering
+};
+
+bool binaryMode = false;
+
 // User-configurable thresholds (can be updated via serial)
 int soilThreshold = 340;      // Auto-water if any soil > this value (DRY)
 float fanTempThreshold = 28.0;   // Fan ON if temp >= this
@@ -102,7 +128,49 @@ void setup() {
   lcd.clear();
 }
 
+uint16_t crc16Update(uint16_t crc, uint8_t b) {
+  crc ^= (uint16_t)b << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+void sendFrame(float h, float t, int s1, int s2, int s3, int savg, int wl) {
+  TelemetryPayload p;
+  p.millis = millis();
+  p.soil1 = s1;
+  p.soil2 = s2;
+  p.soil3 = s3;
+  p.soilAvg = savg;
+  // Casting NaN to an integer is undefined: send the reserved values instead
+  p.temp10 = isnan(t) ? TEMP10_MISSING : (int16_t)round(t * 10);
+  p.hum10 = isnan(h) ? HUM10_MISSING : (uint16_t)round(h * 10);
+  p.flags = (wl ? 0x01 : 0) | (fanStatus ? 0x02 : 0) | (heaterStatus ? 0x04 : 0)
+          | (aiButtonPressed ? 0x08 : 0) | (wateringTriggered ? 0x10 : 0);
+
+  uint8_t header[2] = {FRAME_VERSION, sizeof(p)};
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < sizeof(header); i++) crc = crc16Update(crc, header[i]);
+  const uint8_t *bytes = (const uint8_t *)&p;
+  for (uint8_t i = 0; i < sizeof(p); i++) crc = crc16Update(crc, bytes[i]);
+
+  Serial.write(FRAME_SYNC1);
+  Serial.write(FRAME_SYNC2);
+  Serial.write(header, sizeof(header));
+  Serial.write(bytes, sizeof(p));
+  Serial.write(crc & 0xFF);
+  Serial.write(crc >> 8);
+}
+
 void sendData(float h, float t, int s1, int s2, int s3, int savg, int wl) {
+  if (binaryMode) {
+    sendFrame(h, t, s1, s2, s3, savg, wl);
+    aiButtonPressed = false;
+    wateringTriggered = false;
+    return;
+  }
+
   StaticJsonDocument<384> doc;
   doc["timestamp"] = millis();
   doc["soil1"] = s1;
@@ -351,6 +419,39 @@ void processSerialCommands() {
       triggerWatering(duration);
     }
     
+    // All settings in one command (one round trip):
+    // SET_ALL:<soil>,<fanTemp>,<heaterTemp>,<autoWater>,<autoFan>,<autoHeater>
+    else if (command.startsWith("SET_ALL:")) {
+      String fields[6];
+      uint8_t count = 0;
+      int start = 8;
+      while (count < 6) {
+        int comma = command.indexOf(',', start);
+        if (comma < 0) {
+          fields[count++] = command.substring(start);
+          break;
+        }
+        fields[count++] = command.substring(start, comma);
+        start = comma + 1;
+      }
+      // Malformed frames get no ACK, so the sender retries
+      if (count == 6) {
+        soilThreshold = fields[0].toInt();
+        fanTempThreshold = fields[1].toFloat();
+        heaterTempThreshold = fields[2].toFloat();
+        autoWaterEnabled = fields[3].toInt() == 1;
+        autoFanEnabled = fields[4].toInt() == 1;
+        autoHeaterEnabled = fields[5].toInt() == 1;
+        Serial.print("ACK:ALL:");
+        Serial.print(soilThreshold); Serial.print(',');
+        Serial.print(fanTempThreshold); Serial.print(',');
+        Serial.print(heaterTempThreshold); Serial.print(',');
+        Serial.print(autoWaterEnabled ? 1 : 0); Serial.print(',');
+        Serial.print(autoFanEnabled ? 1 : 0); Serial.print(',');
+        Serial.println(autoHeaterEnabled ? 1 : 0);
+      }
+    }
+
     // Settings commands
     else if (command.startsWith("SET_SOIL_THRESH:")) {
       soilThreshold = command.substring(16).toInt();
@@ -388,6 +489,15 @@ void processSerialCommands() {
       autoHeaterEnabled = false;
       Serial.println("ACK:AUTO_HEATER:0");
     }
+    // Telemetry format negotiation (sent by the Pi after connecting)
+    else if (command == "PROTO_BIN") {
+      Serial.println("ACK:PROTO:BIN");
+      binaryMode = true;
+    }
+    else if (command == "PROTO_JSON") {
+      binaryMode = false;
+      Serial.println("ACK:PROTO:JSON");
+    }
     // Manual fan test commands
     else if (command == "TEST_FAN_ON") {
       setFan(true);
@@ -0,0 +1,27 @@
+import argparse
+import logging
+import os
+import sys
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.database import DatabaseManager
+from src.features import FeatureStore
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute feature store rows for readings recorded before the feature store (run once after upgrading).")
+    parser.add_argument('--device', action='append', help="Plant to backfill (repeatable; default: every plant)")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager()
+    store = FeatureStore(db_manager)
+    for device_id in args.device or db_manager.get_device_ids():
+        print(f"{device_id}: {store.backfill(device_id)} feature rows")
+    db_manager.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.database import DatabaseManager
+from src.async_database import AsyncDatabaseManager
+
+def ingestion_load(db, stop, rate):
+    """Insert readings from a separate thread, like DataIngestion does."""
+    interval = 1.0 / rate
+    while not stop.is_set():
+        db.insert_sensor_data(300, 310, 320, 310, 22.5, 55.0, 0, 1, 0, 0)
+        time.sleep(interval)
+
+async def handler(db, is_async):
+    """What a status + settings handler does against the database."""
+    if is_async:
+        await db.get_recent_data(limit=1)
+        await db.get_setting('watering_duration', 5)
+        await db.insert_prediction('Healthy', 'benchmark')
+    else:
+        db.get_recent_data(limit=1)
+        db.get_setting('watering_duration', 5)
+        db.insert_prediction('Healthy', 'benchmark')
+
+async def loop_lag(stop, samples):
+    """How late a 1 ms timer fires; any blocking call in the loop shows up here."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append((time.perf_counter() - start - 0.001) * 1000)
+
+async def run(db, is_async, handlers, concurrency):
+    latencies = []
+    lag = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(loop_lag(stop, lag))
+
+    async def one():
+        start = time.perf_counter()
+        await handler(db, is_async)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    for _ in range(handlers // concurrency):
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+    stop.set()
+    await lag_task
+    return latencies, lag
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1] if len(values) > 1 else values[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot handler latency with and without the async database API.")
+    parser.add_argument('--handlers', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8, help="Chats served at the same time")
+    parser.add_argument('--ingest-rate', type=float, default=200, help="Readings per second inserted meanwhile")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        stop = threading.Event()
+        writer = threading.Thread(target=ingestion_load, args=(db, stop, args.ingest_rate), daemon=True)
+        writer.start()
+
+        async def both():
+            adb = AsyncDatabaseManager(db)
+            results = {
+                'sync': await run(db, False, args.handlers, args.concurrency),
+                'async': await run(adb, True, args.handlers, args.concurrency),
+            }
+            await adb.close()
+            return results
+
+        results = asyncio.run(both())
+        stop.set()
+        writer.join()
+        db.close()
+
+    print(f"{'api':>6} {'handler p50 (ms)':>17} {'handler p99 (ms)':>17} {'loop lag p99 (ms)':>18} {'loop lag max (ms)':>18}")
+    for name, (latencies, lag) in results.items():
+        print(f"{name:>6} {pct(latencies, 50):>17.2f} {pct(latencies, 99):>17.2f} {pct(lag, 99):>18.2f} {max(lag):>18.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import config
+from src.database import DatabaseManager
+from src.supervisor import IngestionSupervisor
+from src.persistence import ReadingWriter
+from src.events import ButtonPressed
+from simulate_arduino import add_board_arguments, make_boards
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1] if len(values) > 1 else values[0]
+
+def summary(name, values):
+    if not values:
+        return f"{name:<18} no samples"
+    return (f"{name:<18} n={len(values):<6} p50={pct(values, 50):7.2f} ms  p95={pct(values, 95):7.2f} ms  "
+            f"p99={pct(values, 99):7.2f} ms  max={max(values):7.2f} ms")
+
+def stored_rows(db_path, table='sensor_rollup_minute'):
+    """Readings committed per device (the rollups also count readings the deadband keeps out of sensor_data)."""
+    count = 'sum(samples)' if table.startswith('sensor_rollup') else 'count(*)'
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute(f'SELECT device_id, {count} FROM {table} GROUP BY device_id'))
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingestion throughput and latency against virtual Arduinos.")
+    parser.add_argument('--boards', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--button-every', type=float, default=0.5, help="Seconds between AI button presses per board")
+    parser.add_argument('--command-every', type=float, default=0.5, help="Seconds between commands per board")
+    parser.add_argument('--json', action='store_true', help="Keep the boards on JSON lines (no PROTO_BIN)")
+    parser.add_argument('--slow-storage-ms', type=float, default=0, help="Extra delay per database transaction (slow SD card)")
+    parser.add_argument('--queue-size', type=int, default=config.INGESTION_QUEUE_SIZE)
+    parser.add_argument('--deadband', action='store_true', help="Store changed readings only (DB_DEADBAND)")
+    add_board_arguments(parser)
+    parser.set_defaults(rate=50)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    config.SERIAL_BINARY_FRAMES = not args.json
+    config.DB_DEADBAND_ENABLED = args.deadband
+    # Boards are up before the readers connect; no need to wait for a reset
+    config.SERIAL_RECONNECT_MIN_SECONDS = 0.1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = DatabaseManager(db_path)
+        if args.slow_storage_ms:
+            insert_sensor_batches = db.insert_sensor_batches
+
+            def slow_insert(*args_, **kwargs):
+                time.sleep(args.slow_storage_ms / 1000)
+                insert_sensor_batches(*args_, **kwargs)
+            db.insert_sensor_batches = slow_insert
+        supervisor = IngestionSupervisor(db, discover=False)
+        supervisor.writer = ReadingWriter(db, maxsize=args.queue_size)
+        boards = [board.start() for board in make_boards(args, args.boards)]
+
+        button_ms, command_ms, ack_ms = [], [], []
+        pressed_at = {}
+        for i, board in enumerate(boards):
+            supervisor.add_device(f"virtual-{i}", board.port)
+
+        def on_button(event):
+            start = pressed_at.pop(event.device_id, None)
+            if start is not None:
+                button_ms.append((time.monotonic() - start) * 1000)
+        supervisor.events.subscribe(ButtonPressed, on_button, inline=True)
+
+        supervisor.start()
+        # Let every reader connect and negotiate the telemetry format
+        time.sleep(1.5)
+        start_rows = stored_rows(db_path)
+        supervisor.stats()
+
+        sent_commands = {}
+        next_button = next_command = time.monotonic()
+        started = time.monotonic()
+        sequence = 0
+        while time.monotonic() - started < args.seconds:
+            now = time.monotonic()
+            if now >= next_button:
+                for i, board in enumerate(boards):
+                    pressed_at[f"virtual-{i}"] = time.monotonic()
+                    board.press_ai_button()
+                next_button = now + args.button_every
+            if now >= next_command:
+                for i, board in enumerate(boards):
+                    sequence += 1
+                    # Unique value so the board side can be matched to the send time
+                    command = f"SET_SOIL_THRESH:{sequence}"
+                    sent_commands[command] = sent = time.monotonic()
+                    future = supervisor.get_ingestor(f"virtual-{i}").commands.send(command)
+                    future.add_done_callback(
+                        lambda f, sent=sent: f.exception() is None and ack_ms.append((time.monotonic() - sent) * 1000)
+                    )
+                next_command = now + args.command_every
+            time.sleep(0.005)
+        elapsed = time.monotonic() - started
+        ingest_stats = supervisor.stats()
+        writer_stats = supervisor.writer.stats()
+
+        for board in boards:
+            board.stop()
+        # A lagging writer shifts the window, so delivery is counted since boot
+        sent_total = [board.stats['readings_sent'] for board in boards]
+        # The readers now retry the vanished ports; that is expected here
+        logging.getLogger('src.ingestion').setLevel(logging.CRITICAL)
+
+        # How long until everything received is committed
+        drain_start = time.monotonic()
+        previous = None
+        while True:
+            rows = stored_rows(db_path)
+            if rows == previous:
+                break
+            previous = rows
+            time.sleep(0.1)
+        drain_seconds = time.monotonic() - drain_start
+        # Flushes the write buffer, if enabled
+        supervisor.stop()
+        rows = stored_rows(db_path)
+
+        for board in boards:
+            for received_at, command in board.command_log:
+                if command in sent_commands:
+                    command_ms.append((received_at - sent_commands.pop(command)) * 1000)
+
+        print(f"{args.boards} boards x {args.rate:g} readings/s for {elapsed:.1f} s, "
+              f"{'JSON lines' if args.json else 'binary frames'}, faults: "
+              f"{ {k: v for k, v in boards[0].faults.items() if v} or 'none'}")
+        total_sent = total_stored = window_stored = 0
+        for i, board in enumerate(boards):
+            device_id = f"virtual-{i}"
+            stored = rows.get(device_id, 0)
+            total_sent += sent_total[i]
+            total_stored += stored
+            window_stored += stored - start_rows.get(device_id, 0)
+            s = ingest_stats[device_id]
+            print(f"  {device_id}: sent {sent_total[i]}, stored {stored}, {s['bytes_per_sec']:.0f} B/s, "
+                  f"corrupted frames {s['frames_corrupted']}, board faults "
+                  f"{ {k: v for k, v in board.stats.items() if k in ('dropped', 'corrupted', 'truncated', 'garbage', 'disconnects') and v} }")
+        print(f"Throughput: {window_stored / elapsed:.1f} readings/s stored "
+              f"({100 * total_stored / max(total_sent, 1):.1f} % of sent), drain {drain_seconds * 1000:.0f} ms")
+        if args.deadband:
+            raw = sum(stored_rows(db_path, 'sensor_data').values())
+            print(f"Deadband: {raw} of {total_stored} readings kept in sensor_data "
+                  f"({total_stored / max(raw, 1):.1f}x fewer rows)")
+        print(f"Writer: max queue {writer_stats['max_depth']}, {writer_stats['batches']} transactions, "
+              f"{writer_stats['dropped']} dropped, max lag {writer_stats['max_lag_ms']:.1f} ms")
+        print(summary('Button -> handler', button_ms))
+        print(summary('Command -> board', command_ms))
+        print(summary('Command -> ACK', ack_ms))
+
+if __name__ == "__main__":
+    main()
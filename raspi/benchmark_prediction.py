@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import config
+from src.explainability import ExplainabilityModule
+from src.features import FeatureStore
+from src.prediction import Predictor
+from src.preprocessing import DataPreprocessor
+from benchmark_preprocessing import synthetic_chunk
+
+def percentile_ms(samples, q):
+    return np.percentile(samples, q) * 1000
+
+def timed(func, calls):
+    samples = []
+    for _ in range(calls):
+        began = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - began)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time one prediction: the one-row DataFrame path against the NumPy path Predictor uses.")
+    parser.add_argument('--days', type=float, default=7, help="Synthetic history the model is trained on")
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+
+    # History through the feature store, then a model fitted as ModelTrainer fits it
+    store = FeatureStore()
+    readings = synthetic_chunk(np.random.default_rng(1), 0, int(args.days * 86400 / config.SENSOR_INTERVAL_SECONDS))
+    stored = [row for row in (store.update(config.DEFAULT_DEVICE_ID, reading) for reading in readings.tolist())
+              if row is not None]
+    preprocessor = DataPreprocessor()
+    X, y = preprocessor.prepare_dataset(np.array(stored))
+    model = RandomForestClassifier(n_estimators=50, max_depth=5).fit(X, y)
+
+    config.MODEL_PATH = os.path.join(tempfile.mkdtemp(), config.MODEL_FILENAME)
+    joblib.dump(model, config.MODEL_PATH)
+    explainer = ExplainabilityModule()
+    predictor = Predictor(preprocessor, explainer, store)
+    features = store.latest(config.DEFAULT_DEVICE_ID)[1]
+
+    def dataframe_path():
+        row = preprocessor.prepare_single_prediction(features)
+        label = "Stress (Needs Water)" if model.predict(row)[0] == 1 else "Healthy"
+        return label, explainer.explain_decision(model, row, label)
+
+    def numpy_path():
+        return predictor.predict(None)
+
+    # Same answers over the whole history
+    disagree = sum(model.predict(X.iloc[i:i + 1])[0]
+                   != predictor._predict_row(preprocessor.build_single_features(X.iloc[i], predictor._row))
+                   for i in range(0, len(X), max(1, len(X) // 500)))
+    assert dataframe_path() == numpy_path()
+
+    print(f"Model: {model.n_estimators} trees, {len(X)} training rows of {X.shape[1]} features")
+    for name, func in (("DataFrame + model.predict", dataframe_path), ("NumPy fast path", numpy_path)):
+        func()
+        samples = timed(func, args.calls)
+        print(f"{name:26} p50={percentile_ms(samples, 50):7.3f} ms  p95={percentile_ms(samples, 95):7.3f} ms  "
+              f"max={max(samples) * 1000:7.3f} ms")
+    build = timed(lambda: preprocessor.build_single_features(features, predictor._row), args.calls)
+    print(f"{'  of which feature build':26} p50={percentile_ms(build, 50):7.3f} ms")
+    print(f"Disagreements on sampled history rows: {disagree}")
+    print(f"Readings arrive every {config.SENSOR_INTERVAL_SECONDS} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import config
+from src.database import READING_COLUMN_NAMES
+from src.features import FeatureState
+from src.preprocessing import DataPreprocessor, FEATURE_COLUMNS
+
+READING_INTERVAL_SECONDS = config.SENSOR_INTERVAL_SECONDS
+
+def synthetic_chunk(rng, start_row, rows):
+    """`rows` readings in READING_COLUMNS order, 5 seconds apart."""
+    index = start_row + np.arange(rows)
+    timestamps = 1.7e9 + index * READING_INTERVAL_SECONDS
+    day = np.sin(timestamps % 86400 / 86400 * 2 * np.pi)
+    # Dries out over a week, then watered
+    soil = 250 + (index % 120960) / 120960 * 250
+    data = np.empty((rows, len(READING_COLUMN_NAMES)))
+    data[:, 0] = timestamps
+    for i in (1, 2, 3):
+        data[:, i] = np.round(soil + rng.normal(0, 3, rows))
+    data[:, 4] = np.median(data[:, 1:4], axis=1)
+    data[:, 5] = np.round(23 + 5 * day + rng.normal(0, 0.1, rows), 1)
+    data[:, 6] = np.round(55 - 10 * day + rng.normal(0, 0.5, rows), 1)
+    data[:, 7] = 0
+    data[:, 8] = 1
+    data[:, 9] = data[:, 5] > 28
+    data[:, 10] = data[:, 5] < 20
+    data[:, 11] = 0
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the feature store on synthetic 5-second history: per-reading updates, then the "
+                    "training pass over the stored feature rows.")
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--chunk-size', type=int, default=config.TRAINING_CHUNK_SIZE,
+                        help="Feature rows per prepare_dataset call, as the trainer streams them")
+    args = parser.parse_args()
+
+    total = int(args.days * 86400 / READING_INTERVAL_SECONDS)
+    rng = np.random.default_rng(1)
+    state = FeatureState()
+    preprocessor = DataPreprocessor()
+
+    # Live path: every reading goes through FeatureState.update, one row per FEATURE_INTERVAL_SECONDS is kept
+    updating = 0.0
+    stored = []
+    saved = None
+    for start in range(0, total, 100000):
+        rows = synthetic_chunk(rng, start, min(100000, total - start)).tolist()
+        began = time.perf_counter()
+        for row in rows:
+            features = state.update(row)
+            if features is not None and (saved is None or row[0] - saved >= config.FEATURE_INTERVAL_SECONDS):
+                saved = row[0]
+                stored.append((saved,) + features)
+        updating += time.perf_counter() - began
+
+    # Training path: the stored rows, chunk by chunk
+    history = np.array(stored, dtype=np.float64)
+    began = time.perf_counter()
+    samples = 0
+    for start in range(0, len(history), args.chunk_size):
+        X, y = preprocessor.prepare_dataset(history[start:start + args.chunk_size])
+        samples += len(X)
+    training = time.perf_counter() - began
+
+    print(f"{total} readings ({args.days:g} days at {READING_INTERVAL_SECONDS} s), {len(stored)} feature rows stored")
+    print(f"FeatureState.update: {updating / total * 1e6:.1f} us per reading, {total / updating:,.0f} readings/s")
+    print(f"prepare_dataset over the stored rows: {training:.3f} s, {samples} samples "
+          f"({len(FEATURE_COLUMNS)} features each)")
+
+if __name__ == "__main__":
+    main()
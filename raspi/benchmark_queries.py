@@ -0,0 +1,73 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.database import DatabaseManager
+
+READING_INTERVAL_SECONDS = 5
+INSERT_BATCH = 50000
+
+def fill(db, start_row, end_row, start_ts):
+    """Append synthetic 5-second readings until the table holds end_row rows."""
+    row = start_row
+    while row < end_row:
+        batch_end = min(end_row, row + INSERT_BATCH)
+        db.insert_sensor_data_many([
+            (start_ts + i * READING_INTERVAL_SECONDS,
+             random.randint(250, 600), random.randint(250, 600), random.randint(250, 600), random.randint(250, 600),
+             round(random.uniform(15, 32), 1), round(random.uniform(30, 80), 1), 0, 1, 0, 0, 0)
+            for i in range(row, batch_end)
+        ])
+        row = batch_end
+
+def time_call(fn, repeats):
+    """Median latency of fn() in microseconds."""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure sensor_data query latency as the table grows.")
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help="Comma-separated row counts (e.g. add 10000000 for the full run)")
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--no-index', action='store_true',
+                        help="Drop every sensor_data index to compare with full table scans")
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        if args.no_index:
+            conn = db._get_connection()
+            # Whatever the current schema version created (automatic indexes have no sql)
+            indexes = [name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'sensor_data' AND sql IS NOT NULL")]
+            for name in indexes:
+                conn.execute(f'DROP INDEX {name}')
+            print(f"Dropped indexes: {', '.join(indexes)}")
+
+        start_ts = time.time() - sizes[-1] * READING_INTERVAL_SECONDS
+        rows = 0
+        print(f"{'rows':>10} {'latest (us)':>12} {'recent 20 (us)':>15} {'recent 1000 (us)':>17}")
+        for size in sizes:
+            fill(db, rows, size, start_ts)
+            rows = size
+            latest = time_call(db.get_latest_reading, args.repeats)
+            recent = time_call(lambda: db.get_recent_data(limit=20), args.repeats)
+            recent_large = time_call(lambda: db.get_recent_data(limit=1000), max(1, args.repeats // 10))
+            print(f"{rows:>10} {latest:>12.1f} {recent:>15.1f} {recent_large:>17.1f}")
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import logging
+import os
+import sys
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import config
+from src.database import DatabaseManager
+from src.features import FeatureStore
+from src.legacy_import import import_legacy_database
+from src.snapshot import ColumnarSnapshot
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolidate older Smart Plant databases into the current one.")
+    parser.add_argument('sources', nargs='*', help="Legacy .db files (default: LEGACY_DB_NAMES from config)")
+    parser.add_argument('--batch-size', type=int, default=config.LEGACY_IMPORT_BATCH_SIZE)
+    parser.add_argument('--device', default=config.DEFAULT_DEVICE_ID, help="Plant the imported rows belong to")
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(config.DB_PATH)
+    sources = args.sources or [os.path.join(base_dir, name) for name in config.LEGACY_DB_NAMES]
+
+    db_manager = DatabaseManager()
+    print(f"Target: {db_manager.db_path} (schema version {db_manager.schema_version})")
+    for path in sources:
+        if not os.path.exists(path):
+            print(f"Skipping {path}: not found")
+            continue
+        imported = import_legacy_database(db_manager, path, batch_size=args.batch_size, device_id=args.device)
+        print(f"{os.path.basename(path)}: {imported or 'nothing new'}")
+
+    # Keep the history in the training snapshot before retention prunes old raw rows
+    if config.SNAPSHOT_ENABLED:
+        ColumnarSnapshot(device_id=args.device).export_incremental(db_manager)
+    # Imported readings predate the stored features: give them features to train on
+    FeatureStore(db_manager).backfill(args.device)
+    db_manager.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,95 +2,132 @@ import time
 import threading
 import schedule
 import logging
+import logging.handlers
+import queue
 import sys
 from src.database import DatabaseManager
-from src.ingestion import DataIngestion
+from src.supervisor import IngestionSupervisor
+from src.events import ReadingReceived, FeaturesUpdated, ButtonPressed, WateringTriggered, COALESCE, DROP_NEWEST
 from src.preprocessing import DataPreprocessor
 from src.training import ModelTrainer
-from src.prediction import Predictor
-from src.prediction import Predictor
+from src.devices import PlantDevice
+from src.prediction import Predictor, LabelDebouncer
 from src.explainability import ExplainabilityModule
 from src.bot import SmartPlantBot
 from src.automation import AutomationController
 from src.voice import VoiceModule
+from src.snapshot import export_snapshots
 from src import config
 import asyncio
 
 # Setup logging NEW
+# Records are queued and written to stdout by a listener thread,
+# so the serial reader and writer never wait on console I/O
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, console_handler)
+log_listener.start()
 logging.basicConfig(
-    stream=sys.stdout,
     level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
 logger = logging.getLogger("SystemLoop")
 
-def run_training_job(trainer):
+def run_training_job(trainer, predictor):
     try:
-        trainer.train_model()
+        if trainer.train_model():
+            # Serve the new model from the next prediction on
+            predictor.load_model()
     except Exception as e:
         logger.error(f"Training job failed: {e}")
 
-def run_prediction_job(db_manager, predictor, voice_module=None, bot=None):
+def run_retention_job(db_manager):
+    try:
+        if config.SNAPSHOT_ENABLED:
+            # Archive raw rows before retention deletes them; on failure nothing is pruned
+            export_snapshots(db_manager)
+        db_manager.run_retention()
+    except Exception as e:
+        logger.error(f"Retention job failed: {e}")
+
+def run_prediction_job(db_manager, devices, predictor, voice_module=None, bot=None):
+    for i, plant in enumerate(devices.values()):
+        # The voice speaks for the first plant
+        predict_plant(db_manager, plant, predictor, voice_module if i == 0 else None, bot)
+
+def predict_plant(db_manager, plant, predictor, voice_module=None, bot=None):
     try:
         # Get recent data
-        recent_data = db_manager.get_recent_data(limit=20)
-        prediction, explanation = predictor.predict(recent_data)
+        recent_data = plant.readings.get_recent_data(limit=20)
+        if not recent_data:
+            return
+        prediction, explanation = predictor.predict(recent_data, device_id=plant.device_id)
         
         if prediction:
-            logger.info(f"PREDICTION: {prediction}")
-            logger.info(f"EXPLANATION: {explanation}")
-            db_manager.insert_prediction(prediction, explanation)
-            
-            if "Stress" in prediction:
-                logger.warning("!!! PLANT STRESS DETECTED - RECOMMEND WATERING !!!")
-                if bot:
-                    alert_msg = f"O'simlikda stress aniqlandi! 🌿\nBashorat: {prediction}\nTahlil: {explanation}"
-                    bot.send_alert_sync(alert_msg)
+            record_prediction(db_manager, plant, prediction, explanation, bot)
 
         # Update voice cache if sensor data is available
         if voice_module and recent_data:
-            latest = recent_data[-1] 
-            # Use keys from sqlite3.Row for safety
-            sensor_dict = {
-                'soil_avg': latest['soil_moisture_avg'],
-                'temp': latest['temperature'],
-                'hum': latest['humidity'],
-                'water_level': latest['water_level'],
-                'fan_status': latest['fan_status'],
-                'heater_status': latest['heater_status']
-            }
             # Refresh cache in background
-            asyncio.run(voice_module.refresh_status_cache(sensor_dict))
+            asyncio.run(voice_module.refresh_status_cache(sensor_dict(recent_data[-1])))
 
     except Exception as e:
         logger.error(f"Prediction job failed: {e}")
 
+def record_prediction(db_manager, plant, prediction, explanation, bot=None):
+    logger.info(f"PREDICTION ({plant.device_id}): {prediction}")
+    logger.info(f"EXPLANATION: {explanation}")
+    db_manager.insert_prediction(prediction, explanation, device_id=plant.device_id)
+    
+    if "Stress" in prediction:
+        logger.warning(f"!!! PLANT STRESS DETECTED ({plant.device_id}) - RECOMMEND WATERING !!!")
+        if bot:
+            alert_msg = f"O'simlikda stress aniqlandi! 🌿\nO'simlik: {plant.device_id}\nBashorat: {prediction}\nTahlil: {explanation}"
+            bot.send_alert_sync(alert_msg)
+
+def predict_on_reading(db_manager, plant, predictor, debouncer, bot, event):
+    """
+    FeaturesUpdated subscriber: predict from the plant's live features as each
+    reading is folded into them (ReadingReceived comes before that). Only a
+    label change the debouncer confirms is stored and alerted, so a stress is
+    reported within a minute or so instead of up to PREDICTION_INTERVAL_SECONDS
+    later; the scheduled job still records the label at its interval.
+    """
+    try:
+        if predictor.model is None:
+            # The rule-based fallback flips at a fixed threshold; leave it to the scheduled job
+            return
+        prediction, explanation = predictor.predict([event.reading], device_id=plant.device_id)
+        if prediction and debouncer.update(plant.device_id, prediction):
+            record_prediction(db_manager, plant, prediction, explanation, bot)
+    except Exception as e:
+        logger.error(f"Prediction on reading failed ({plant.device_id}): {e}")
+
 def scheduler_loop():
     """Background thread for scheduled tasks."""
     while True:
         schedule.run_pending()
         time.sleep(1)
 
-def handle_button_press(voice_module, db_manager):
-    """Callback for button press to trigger AI voice status report."""
+def sensor_dict(reading):
+    """The sensor values the voice module reports on."""
+    # Use keys from sqlite3.Row for safety
+    return {
+        'soil_avg': reading['soil_moisture_avg'],
+        'temp': reading['temperature'],
+        'hum': reading['humidity'],
+        'water_level': reading['water_level'],
+        'fan_status': reading['fan_status'],
+        'heater_status': reading['heater_status']
+    }
+
+def handle_button_press(voice_module, event):
+    """ButtonPressed subscriber: AI voice status report from the reading sent with the press."""
     try:
-        logger.info("Button press callback triggered. Fetching status...")
-        # Get absolute freshest sensor data
-        latest = db_manager.get_latest_reading()
-        if latest:
-            sensor_dict = {
-                'soil_avg': latest['soil_moisture_avg'],
-                'temp': latest['temperature'],
-                'hum': latest['humidity'],
-                'water_level': latest['water_level'],
-                'fan_status': latest['fan_status'],
-                'heater_status': latest['heater_status']
-            }
-            
-            # Start instant voice report in a separate thread to NOT block ingestion
-            threading.Thread(target=lambda: voice_module.say_status_instant(sensor_dict), daemon=True).start()
-        else:
-            logger.warning("No sensor data available for voice report.")
+        logger.info(f"Button press on {event.device_id}. Reporting status...")
+        # Runs on the subscription's own thread, so ingestion is never blocked
+        voice_module.say_status_instant(sensor_dict(event.reading))
     except Exception as e:
         logger.error(f"Error handling button press: {e}")
 
@@ -113,36 +150,59 @@ def main():
     preprocessor = DataPreprocessor()
     trainer = ModelTrainer(db_manager, preprocessor)
     explainer = ExplainabilityModule()
-    # Predictor loads model, so might be None initially if no model exists
-    predictor = Predictor(preprocessor, explainer) 
-    ingestor = DataIngestion(db_manager)
     voice = VoiceModule()
-    
-    # Set callbacks for buttons
-    # Direct event handlers with threads for zero-latency response
-    ingestor.on_button_pressed_callback = lambda: handle_button_press(voice, db_manager)
-    ingestor.on_watering_triggered_callback = lambda: threading.Thread(
-        target=lambda: voice.play_audio_sync(voice.watering_audio), 
-        daemon=True
-    ).start()
-    
-    # Initialize automation controller
-    automation = AutomationController(db_manager, ingestor)
-    
-    # Initialize bot with automation controller and predictor
-    bot = SmartPlantBot(db_manager, ingestor, automation, predictor)
 
-    # Start Data Ingestion in a separate thread
-    ingestion_thread = threading.Thread(target=ingestor.start_listening)
-    ingestion_thread.daemon = True
-    ingestion_thread.start()
+    # One asyncio loop reads every Arduino; each plant gets its own ring buffer and automation loop
+    supervisor = IngestionSupervisor(db_manager)
+    # Predictor loads model, so might be None initially if no model exists.
+    # It reads the features the writer keeps for every plant.
+    predictor = Predictor(preprocessor, explainer, supervisor.writer.features)
+    devices = {}
+
+    # Button presses from any plant; presses while one is still being handled are dropped
+    supervisor.events.subscribe(ButtonPressed, lambda event: handle_button_press(voice, event),
+                                maxsize=1, policy=DROP_NEWEST, name="voice button")
+    supervisor.events.subscribe(WateringTriggered, lambda event: voice.play_audio_sync(voice.watering_audio),
+                                maxsize=1, policy=DROP_NEWEST, name="voice watering")
+
+    def add_plant(ingestor):
+        """Wire one board's reader to its automation controller."""
+        recent_readings = ingestor.recent_readings
+        # Initialize automation controller
+        automation = AutomationController(db_manager, ingestor, recent_readings)
+        plant = PlantDevice(ingestor.device_id, ingestor, recent_readings, automation)
+        devices[ingestor.device_id] = plant
+        return plant
+
+    # Per-reading labels of every plant, reported only once a change holds
+    debouncer = LabelDebouncer()
 
-    # Start Automation Controller
-    automation.start()
+    def start_plant(plant):
+        # Also syncs the settings to the Arduino each time it connects
+        plant.automation.start()
+        if config.PREDICT_ON_READING:
+            # Predictions take milliseconds; a backlog behind a slow alert is collapsed into the newest reading
+            supervisor.events.subscribe(
+                FeaturesUpdated,
+                lambda event: predict_on_reading(db_manager, plant, predictor, debouncer, bot, event),
+                device_id=plant.device_id, policy=COALESCE, name=f"prediction {plant.device_id}")
+
+    for device_id, port in config.DEVICES.items():
+        add_plant(supervisor.add_device(device_id, port))
+    # Boards found by discovery are set up the same way
+    supervisor.on_device_added = lambda ingestor: start_plant(add_plant(ingestor))
+
+    # The voice cache follows the first plant
+    voice_device = next(iter(devices))
     
-    # Sync initial settings to Arduino after connection
-    time.sleep(3)  # Wait for Arduino to be ready
-    automation.sync_settings_to_arduino()
+    # Initialize bot with the plants and predictor
+    bot = SmartPlantBot(db_manager, devices, predictor)
+
+    # Automation first, so it sees the first connection of each board
+    for plant in list(devices.values()):
+        start_plant(plant)
+    # Start Data Ingestion for every board in a separate thread
+    supervisor.start()
 
     # Pre-generate static sounds and then play welcome in separate threads
     def setup_voice():
@@ -151,39 +211,27 @@ def main():
     
     threading.Thread(target=setup_voice, daemon=True).start()
     
-    # Continuous background loop to keep the voice report fresh and accurate
-    def voice_maintenance_loop():
-        # Short sleep at start to let sensors settle
-        time.sleep(2)
-        while True:
-            try:
-                latest = db_manager.get_latest_reading()
-                if latest:
-                    sensor_dict = {
-                        'soil_avg': latest['soil_moisture_avg'], 
-                        'temp': latest['temperature'], 
-                        'hum': latest['humidity'],
-                        'water_level': latest['water_level'], 
-                        'fan_status': latest['fan_status'], 
-                        'heater_status': latest['heater_status']
-                    }
-                    # This will internally decide whether to use AI, Fallback, or Skip
-                    # based on time and sensor changes (±0.5°C, ±5% Hum)
-                    asyncio.run(voice.refresh_status_cache(sensor_dict))
-            except Exception as e:
-                logger.error(f"Error in voice maintenance loop: {e}")
-            
-            # Check every 30 seconds for significant changes
-            time.sleep(30)
-            
-    threading.Thread(target=voice_maintenance_loop, daemon=True).start()
+    # Keep the voice report fresh and accurate as readings arrive
+    def refresh_voice_cache(event):
+        # This will internally decide whether to use AI, Fallback, or Skip
+        # based on time and sensor changes (±0.5°C, ±5% Hum)
+        asyncio.run(voice.refresh_status_cache(sensor_dict(event.reading)))
+
+    # A slow refresh (AI call) only ever leaves the newest reading waiting
+    supervisor.events.subscribe(ReadingReceived, refresh_voice_cache, device_id=voice_device,
+                                policy=COALESCE, name="voice cache")
 
     # Schedule Jobs
     # Schedule training once a day
-    schedule.every(config.TRAINING_INTERVAL_MINUTES).minutes.do(run_training_job, trainer)
+    schedule.every(config.TRAINING_INTERVAL_MINUTES).minutes.do(run_training_job, trainer, predictor)
     
     # Schedule prediction every N minutes (also refreshes voice cache)
-    schedule.every(config.PREDICTION_INTERVAL_SECONDS).seconds.do(run_prediction_job, db_manager, predictor, voice, bot)
+    schedule.every(config.PREDICTION_INTERVAL_SECONDS).seconds.do(run_prediction_job, db_manager, devices, predictor, voice, bot)
+
+    # Archive, then prune expired data in its own thread; steps are short so ingestion keeps running
+    schedule.every(config.RETENTION_INTERVAL_MINUTES).minutes.do(
+        lambda: threading.Thread(target=run_retention_job, args=(db_manager,), daemon=True).start()
+    )
 
     # Start Scheduler in a separate thread
     scheduler_thread = threading.Thread(target=scheduler_loop)
@@ -198,9 +246,12 @@ def main():
     except KeyboardInterrupt:
         logger.info("Stopping system...")
     finally:
-        automation.stop()
-        ingestor.stop()
+        for plant in list(devices.values()):
+            plant.automation.stop()
+        supervisor.stop()
+        db_manager.close()
         logger.info("System stopped.")
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
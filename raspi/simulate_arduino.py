@@ -0,0 +1,75 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.simulator import VirtualArduino, SyntheticPlant, ReplaySource
+
+def add_fault_arguments(parser):
+    parser.add_argument('--drop', type=float, default=0, help="Probability a reading is never sent")
+    parser.add_argument('--corrupt', type=float, default=0, help="Probability a bit in a reading is flipped")
+    parser.add_argument('--truncate', type=float, default=0, help="Probability a reading is cut short")
+    parser.add_argument('--garbage', type=float, default=0, help="Probability of line noise before a reading")
+    parser.add_argument('--sensor-fail', type=float, default=0, help="Probability of a failed DHT read")
+    parser.add_argument('--command-loss', type=float, default=0, help="Probability an incoming command is lost")
+    parser.add_argument('--disconnect-every', type=float, default=0, help="Unplug and replug every N seconds")
+
+def faults_from_args(args):
+    return {
+        'drop': args.drop, 'corrupt': args.corrupt, 'truncate': args.truncate, 'garbage': args.garbage,
+        'sensor_fail': args.sensor_fail, 'command_loss': args.command_loss,
+        'disconnect_every': args.disconnect_every,
+    }
+
+def make_boards(args, count):
+    """Build (not start) `count` virtual boards from the command line options."""
+    boards = []
+    for i in range(count):
+        if args.replay:
+            source = ReplaySource(args.replay, device_id=args.replay_device, speed=args.speed, loop=True)
+        else:
+            source = SyntheticPlant(seed=args.seed + i, speed=args.speed)
+        port = os.path.join(args.link_dir, f"ttyVIRT{i}") if args.link_dir else None
+        boards.append(VirtualArduino(source, port=port, faults=faults_from_args(args), seed=args.seed + i,
+                                     rate=args.rate))
+    return boards
+
+def add_board_arguments(parser):
+    parser.add_argument('--replay', help="Replay sensor_data from this database instead of synthetic plants")
+    parser.add_argument('--replay-device', help="Only replay this device_id")
+    parser.add_argument('--speed', type=float, default=1.0, help="Time acceleration (1 = real time)")
+    parser.add_argument('--rate', type=float, help="Fixed readings per second per board")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--link-dir', help="Create the ttyVIRT<n> port links here")
+    add_fault_arguments(parser)
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual Arduinos on pseudo-terminals, speaking the smart_plant_sensors protocol.")
+    parser.add_argument('--boards', type=int, default=1)
+    add_board_arguments(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    boards = [board.start() for board in make_boards(args, args.boards)]
+    for board in boards:
+        print(f"Virtual Arduino listening on {board.port}")
+    print("Point config.DEVICES (or SERIAL_PORT) at these ports. Ctrl-C to stop.")
+
+    try:
+        while not all(board.finished.is_set() for board in boards):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for board in boards:
+            board.stop()
+            print(f"{board.port}: {board.stats}")
+
+if __name__ == "__main__":
+    main()
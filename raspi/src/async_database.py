@@ -0,0 +1,106 @@
+import asyncio
+import time
+import logging
+import aiosqlite
+from . import config
+from .database import (
+    CONNECTION_PRAGMAS, LATEST_READINGS_SQL, ALL_READINGS_SQL,
+    INSERT_PREDICTION_SQL, UPSERT_SETTING_SQL, ALL_SETTINGS_SQL, GLOBAL_SETTINGS
+)
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabaseManager:
+    """
+    asyncio counterpart of DatabaseManager, used by the Telegram bot.
+    Queries run on aiosqlite's worker thread, so a slow SD-card write never
+    stalls the event loop. The schema, the settings cache and its listeners
+    belong to the wrapped DatabaseManager, so both views stay consistent.
+    Readings are only read here: they are written by ReadingWriter, the one
+    path that applies the deadband and feature store.
+    """
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.db_path = db_manager.db_path
+        self._conn = None
+        self._conn_lock = asyncio.Lock()
+
+    async def _get_connection(self):
+        """Open the shared aiosqlite connection on first use."""
+        if self._conn is not None:
+            return self._conn
+        async with self._conn_lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(
+                    self.db_path,
+                    timeout=config.DB_BUSY_TIMEOUT_SECONDS,
+                    cached_statements=config.DB_STATEMENT_CACHE_SIZE
+                )
+                conn.row_factory = aiosqlite.Row
+                for pragma in CONNECTION_PRAGMAS:
+                    await conn.execute(pragma)
+                self._conn = conn
+        return self._conn
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def insert_prediction(self, prediction, explanation, device_id=config.DEFAULT_DEVICE_ID):
+        """Log a prediction."""
+        conn = await self._get_connection()
+        await conn.execute(INSERT_PREDICTION_SQL, (device_id, time.time(), prediction, explanation))
+        await conn.commit()
+
+    async def get_recent_data(self, limit=1000, device_id=config.DEFAULT_DEVICE_ID):
+        """Get a device's recent sensor readings, oldest first."""
+        conn = await self._get_connection()
+        async with conn.execute(LATEST_READINGS_SQL, (device_id, limit)) as cursor:
+            data = await cursor.fetchall()
+        return list(reversed(data))
+
+    async def get_latest_reading(self, device_id=config.DEFAULT_DEVICE_ID):
+        """Get a device's absolute latest reading."""
+        conn = await self._get_connection()
+        async with conn.execute(LATEST_READINGS_SQL, (device_id, 1)) as cursor:
+            return await cursor.fetchone()
+
+    async def get_all_data(self):
+        """Get all sensor readings (every device) as plain tuples."""
+        conn = await self._get_connection()
+        async with conn.execute(ALL_READINGS_SQL) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+    async def get_history(self, start_time, end_time=None, step=None, device_id=config.DEFAULT_DEVICE_ID):
+        """Same tier selection and row shape as DatabaseManager.get_history."""
+        sql, params = self.db_manager._history_query(start_time, end_time, step, device_id)
+        conn = await self._get_connection()
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    async def _ensure_settings_loaded(self):
+        if not self.db_manager.settings_loaded():
+            conn = await self._get_connection()
+            async with conn.execute(ALL_SETTINGS_SQL) as cursor:
+                self.db_manager._prime_settings(await cursor.fetchall())
+
+    async def get_setting(self, setting_name, default=None, device_id=None):
+        """Get a setting value (served from the shared cache)."""
+        await self._ensure_settings_loaded()
+        return self.db_manager.get_setting(setting_name, default, device_id)
+
+    async def get_all_settings(self, device_id=None):
+        """Get all settings as a dictionary (global values overlaid with the device's own)."""
+        await self._ensure_settings_loaded()
+        return self.db_manager.get_all_settings(device_id)
+
+    async def update_setting(self, setting_name, setting_value, device_id=None):
+        """Update or insert a setting; listeners run off the event loop."""
+        setting_value = str(setting_value)
+        conn = await self._get_connection()
+        await conn.execute(UPSERT_SETTING_SQL, (device_id or GLOBAL_SETTINGS, setting_name, setting_value, time.time()))
+        await conn.commit()
+        if self.db_manager._store_setting(setting_name, setting_value, device_id):
+            # Listeners may do blocking work (e.g. the Arduino settings sync)
+            await asyncio.to_thread(self.db_manager._notify_settings_listeners, setting_name, setting_value, device_id)
@@ -1,46 +1,67 @@
 import logging
 import time
-import threading
 from . import config
+from .events import ReadingReceived, ConnectionChanged, COALESCE
+from .validation import SOIL_UNAVAILABLE
 
 logger = logging.getLogger(__name__)
 
+# Settings mirrored on the Arduino; a change to any of them triggers a sync
+ARDUINO_SETTINGS = (
+    'soil_threshold', 'fan_temp_threshold', 'heater_temp_threshold',
+    'auto_water_enabled', 'auto_fan_enabled', 'auto_heater_enabled'
+)
+
+# No new auto-watering for this long after one
+WATERING_COOLDOWN_SECONDS = 60
+
 class AutomationController:
     """Handles automated actions based on sensor data and user settings."""
     
-    def __init__(self, db_manager, ingestor):
+    def __init__(self, db_manager, ingestor, recent_readings=None):
         self.db_manager = db_manager
         self.ingestor = ingestor
+        # One controller per plant; settings are read with this device's overrides
+        self.device_id = ingestor.device_id
+        # Latest readings come from the in-memory ring buffer when one is given
+        self.readings = recent_readings if recent_readings is not None else db_manager
         self.running = False
-        self.check_interval = 30  # Check every 30 seconds
+        self._subscriptions = []
+        self._last_watering = None
         
     def start(self):
-        """Start the automation loop in a separate thread."""
+        """React to this plant's readings as they arrive."""
         self.running = True
-        automation_thread = threading.Thread(target=self._automation_loop)
-        automation_thread.daemon = True
-        automation_thread.start()
-        logger.info("Automation controller started")
+        events = self.ingestor.events
+        self._subscriptions = [
+            # Only the newest reading matters; a backlog is collapsed into it
+            events.subscribe(ReadingReceived, self._on_reading, device_id=self.device_id,
+                             policy=COALESCE, name=f"automation {self.device_id}"),
+            # The Arduino resets to its built-in defaults whenever the port is opened
+            events.subscribe(ConnectionChanged, self._on_connection, device_id=self.device_id,
+                             policy=COALESCE, name=f"settings sync {self.device_id}"),
+        ]
+        # Push settings to the Arduino only when one it uses actually changes
+        self.db_manager.subscribe_settings(self._on_setting_changed)
+        logger.info(f"Automation controller started ({self.device_id})")
         
     def stop(self):
-        """Stop the automation loop."""
+        """Stop reacting to readings."""
         self.running = False
+        for subscription in self._subscriptions:
+            self.ingestor.events.unsubscribe(subscription)
+        self._subscriptions = []
+        # A stopped controller (e.g. its board unplugged) must not be kept alive by the settings cache
+        self.db_manager.unsubscribe_settings(self._on_setting_changed)
         logger.info("Automation controller stopped")
-        
-    def _automation_loop(self):
-        """Main automation loop that runs periodically."""
-        while self.running:
-            try:
-                self._check_and_act()
-            except Exception as e:
-                logger.error(f"Error in automation loop: {e}")
-            
-            time.sleep(self.check_interval)
+
+    def _on_reading(self, event):
+        self._check_and_act(event.reading)
     
-    def _check_and_act(self):
+    def _check_and_act(self, latest=None):
         """Check sensor data and execute automated actions based on settings."""
-        # Get latest sensor data
-        latest = self.db_manager.get_latest_reading()
+        if latest is None:
+            latest = self.readings.get_latest_reading()
         if not latest:
             return
         
@@ -51,27 +72,51 @@ class AutomationController:
         water_level = latest['water_level']
         
         # Get user settings
-        settings = self.db_manager.get_all_settings()
+        settings = self.db_manager.get_all_settings(self.device_id)
         
         # Auto-watering logic
         if settings.get('auto_water_enabled') == '1' and water_level == 1:
             soil_threshold = int(settings.get('soil_threshold', 340))
             
+            # Wait after a watering to avoid rapid re-triggering
+            if self._last_watering is not None and time.monotonic() - self._last_watering < WATERING_COOLDOWN_SECONDS:
+                return
+
+            # Every soil probe is faulty: the average means nothing
+            if (latest['quality_flags'] or 0) & SOIL_UNAVAILABLE:
+                return
+
             # Check if average soil moisture is ABOVE threshold (DRY)
             if soil_avg > soil_threshold:
-                logger.info(f"Auto-watering triggered: Average soil moisture ({soil_avg}) above threshold ({soil_threshold}) - DRY")
+                logger.info(f"Auto-watering triggered ({self.device_id}): Average soil moisture ({soil_avg}) above threshold ({soil_threshold}) - DRY")
                 duration = int(settings.get('watering_duration', 5))
                 self.ingestor.write_command(f"W{duration}")
-                
-                # Wait to avoid rapid re-triggering
-                time.sleep(60)  # Wait 1 minute
+                self._last_watering = time.monotonic()
         
         # Note: Fan and heater control is handled by Arduino firmware directly
         # The Arduino makes real-time decisions based on temperature
         # We just sync settings to Arduino when user changes them
         
+    def _on_setting_changed(self, setting_name, setting_value, device_id):
+        # Global changes reach every plant; a plant's own change only its Arduino
+        if setting_name in ARDUINO_SETTINGS and device_id in (None, self.device_id):
+            logger.info(f"Setting {setting_name} changed to {setting_value}, syncing Arduino ({self.device_id})")
+            self.sync_settings_to_arduino()
+
+    def _on_connection(self, event):
+        if event.connected:
+            self.sync_settings_to_arduino()
+
     def sync_settings_to_arduino(self):
-        """Send current settings to Arduino."""
-        settings = self.db_manager.get_all_settings()
-        self.ingestor.send_settings_to_arduino(settings)
-        logger.info("Settings synchronized to Arduino")
+        """Send current settings to Arduino. Returns a Future resolving to True once acknowledged."""
+        settings = self.db_manager.get_all_settings(self.device_id)
+        future = self.ingestor.send_settings_to_arduino(settings)
+        future.add_done_callback(self._on_synced)
+        return future
+
+    def _on_synced(self, future):
+        error = future.exception()
+        if error is None:
+            logger.info(f"Settings synchronized to Arduino ({self.device_id})")
+        else:
+            logger.error(f"Settings sync to Arduino failed ({self.device_id}): {error}")
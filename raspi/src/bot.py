@@ -3,18 +3,69 @@ import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, CallbackQueryHandler
 from . import config
+from .async_database import AsyncDatabaseManager
+from .commands import CommandTimeout
+from .validation import SOIL_OUT_OF_RANGE, SOIL_STUCK, SOIL_SPIKE, probe_flag
 
 logger = logging.getLogger(__name__)
 
 class SmartPlantBot:
-    def __init__(self, db_manager, ingestor, automation_controller=None, predictor=None):
+    def __init__(self, db_manager, devices, predictor=None):
         self.db_manager = db_manager
-        self.ingestor = ingestor
-        self.automation_controller = automation_controller
+        # Non-blocking view of the same database for use inside handlers
+        self.db = AsyncDatabaseManager(db_manager)
+        # device_id -> PlantDevice; each chat works on one plant at a time (/osimlik)
+        self.devices = devices
         self.predictor = predictor
         self.application = None
         self.loop = None
 
+    def _plant(self, context):
+        """The plant selected in this chat (the first one until /osimlik picks another)."""
+        device_id = context.chat_data.get('device_id')
+        if device_id not in self.devices:
+            device_id = next(iter(self.devices))
+        return self.devices[device_id]
+
+    async def _recent_data(self, context, limit):
+        """The selected plant's recent readings from its ring buffer, or the database without one."""
+        plant = self._plant(context)
+        if plant.readings is not None:
+            return plant.readings.get_recent_data(limit=limit)
+        return await self.db.get_recent_data(limit=limit, device_id=plant.device_id)
+
+    async def _send_command(self, context, command):
+        """Send a command to the selected plant's Arduino; True once it is acknowledged."""
+        try:
+            await asyncio.wrap_future(self._plant(context).ingestor.commands.send(command))
+            return True
+        except (CommandTimeout, ConnectionError) as e:
+            logger.warning(f"Command {command} failed: {e}")
+            return False
+
+    async def select_plant(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Choose which plant the other commands act on."""
+        if context.args:
+            device_id = context.args[0]
+            if device_id in self.devices:
+                context.chat_data['device_id'] = device_id
+                text = f"\U0001F331 Tanlangan o'simlik: {device_id}"
+            else:
+                text = f"\u26A0 Bunday o'simlik yo'q: {device_id}"
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+            return
+
+        current = self._plant(context).device_id
+        keyboard = [
+            [InlineKeyboardButton(("\u2705 " if device_id == current else "") + device_id, callback_data=f'select_plant:{device_id}')]
+            for device_id in self.devices
+        ]
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"\U0001F331 Tanlangan o'simlik: {current}\n\nBoshqasini tanlang:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start command with button menu."""
         keyboard = [
@@ -26,9 +77,9 @@ class SmartPlantBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Save Chat ID as admin if not already set
-        current_admin = self.db_manager.get_setting('admin_chat_id', '')
+        current_admin = await self.db.get_setting('admin_chat_id', '')
         if not current_admin:
-            self.db_manager.update_setting('admin_chat_id', update.effective_chat.id)
+            await self.db.update_setting('admin_chat_id', update.effective_chat.id)
             logger.info(f"Admin chat ID set to {update.effective_chat.id}")
         
         await context.bot.send_message(
@@ -45,7 +96,8 @@ class SmartPlantBot:
             "/start - Botni ishga tushirish\n"
             "/holat - O'simlik holatini ko'rish\n"
             "/suv - Sug'orish\n"
-            "/sozlamalar - Sozlamalarni ko'rish\n\n"
+            "/sozlamalar - Sozlamalarni ko'rish\n"
+            "/osimlik <nom> - O'simlikni tanlash\n\n"
             "*Chegara sozlash:*\n"
             "/tuproq_chegara <qiymat> (yoki /tuproqchegara)\n"
             "/fan_harorat <qiymat> (yoki /fanharorat)\n"
@@ -72,11 +124,11 @@ class SmartPlantBot:
     async def status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Display detailed plant status in Uzbek."""
         try:
-            data = self.db_manager.get_recent_data(limit=1)
+            data = await self._recent_data(context, 1)
             
             if data:
                 latest = data[0]
-                # Unpack: timestamp, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status
+                # Unpack: timestamp, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status, quality_flags
                 timestamp = latest[0]
                 soil1 = latest[1]
                 soil2 = latest[2]
@@ -88,6 +140,7 @@ class SmartPlantBot:
                 water_level = latest[8]
                 fan_status = latest[9]
                 heater_status = latest[10]
+                quality_flags = latest[11] or 0
                 
                 # Format timestamp
                 import datetime
@@ -105,9 +158,15 @@ class SmartPlantBot:
                     else:
                         return "Juda quruq \U0001F534"
                 
-                soil1_status = interpret_soil(soil1)
-                soil2_status = interpret_soil(soil2)
-                soil3_status = interpret_soil(soil3)
+                def probe_status(probe, value):
+                    # Left out of the average by validation
+                    if quality_flags & probe_flag(SOIL_OUT_OF_RANGE | SOIL_STUCK | SOIL_SPIKE, probe):
+                        return "Nosoz sensor \u26A0"
+                    return interpret_soil(value)
+                
+                soil1_status = probe_status(1, soil1)
+                soil2_status = probe_status(2, soil2)
+                soil3_status = probe_status(3, soil3)
                 
                 # Temperature advice
                 if temp < 15:
@@ -119,6 +178,8 @@ class SmartPlantBot:
                 
                 # Build status message
                 status_msg = f"\U0001F33F *O'simlik Holati* \U0001F33F\n\n"
+                if len(self.devices) > 1:
+                    status_msg += f"\U0001F331 *O'simlik:* {self._plant(context).device_id}\n"
                 status_msg += f"\U0001F552 *Vaqt:* {time_str}\n\n"
                 
                 status_msg += f"\U0001F4A7 *Tuproq namligi:*\n"
@@ -170,15 +231,15 @@ class SmartPlantBot:
         """Manual watering command."""
         try:
             # Check water level and water plant
-            data = self.db_manager.get_recent_data(limit=1)
+            data = await self._recent_data(context, 1)
             if data:
                 latest = data[0]
                 water_level = latest[8]
                 
                 if water_level == 1:
-                    duration = int(self.db_manager.get_setting('watering_duration', 5))
+                    duration = int(await self.db.get_setting('watering_duration', 5, self._plant(context).device_id))
                     command = f"W{duration}"
-                    if self.ingestor.write_command(command):
+                    if await self._send_command(context, command):
                         await context.bot.send_message(
                             chat_id=update.effective_chat.id,
                             text=f"\U0001F4A7 Sug'orilmoqda... ({duration} soniya)\n\u2705 Tayyor!"
@@ -208,9 +269,12 @@ class SmartPlantBot:
     async def show_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Display current settings."""
         try:
-            settings = self.db_manager.get_all_settings()
+            device_id = self._plant(context).device_id
+            settings = await self.db.get_all_settings(device_id)
             
             msg = "\u2699\ufe0f *Joriy Sozlamalar* \u2699\ufe0f\n\n"
+            if len(self.devices) > 1:
+                msg += f"\U0001F331 *O'simlik:* {device_id}\n\n"
             
             # Thresholds
             msg += f"\U0001F4CA *Chegaralar:*\n"
@@ -266,11 +330,7 @@ class SmartPlantBot:
             if context.args:
                 value = int(context.args[0])
                 if 100 <= value <= 1023:
-                    self.db_manager.update_setting('soil_threshold', value)
-                    
-                    # Sync to Arduino
-                    if self.automation_controller:
-                        self.automation_controller.sync_settings_to_arduino()
+                    await self.db.update_setting('soil_threshold', value, self._plant(context).device_id)
                     
                     await context.bot.send_message(
                         chat_id=update.effective_chat.id,
@@ -282,7 +342,7 @@ class SmartPlantBot:
                         text="\u26A0 Qiymat 100 dan 1023 gacha bo'lishi kerak."
                     )
             else:
-                current = self.db_manager.get_setting('soil_threshold', 340)
+                current = await self.db.get_setting('soil_threshold', 340, self._plant(context).device_id)
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text=f"ℹ️ Joriy chegara: {current}\n\nO'zgartirish uchun: /tuproq_chegara 340"
@@ -299,10 +359,7 @@ class SmartPlantBot:
             if context.args:
                 value = float(context.args[0])
                 if 20 <= value <= 50:
-                    self.db_manager.update_setting('fan_temp_threshold', value)
-                    
-                    if self.automation_controller:
-                        self.automation_controller.sync_settings_to_arduino()
+                    await self.db.update_setting('fan_temp_threshold', value, self._plant(context).device_id)
                     
                     await context.bot.send_message(
                         chat_id=update.effective_chat.id,
@@ -314,7 +371,7 @@ class SmartPlantBot:
                         text="\u26A0 Harorat 20°C dan 50°C gacha bo'lishi kerak."
                     )
             else:
-                current = self.db_manager.get_setting('fan_temp_threshold', 28.0)
+                current = await self.db.get_setting('fan_temp_threshold', 28.0, self._plant(context).device_id)
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text=f"ℹ️ Joriy chegara: {current}°C\n\nO'zgartirish: /fan_harorat 30"
@@ -331,10 +388,7 @@ class SmartPlantBot:
             if context.args:
                 value = float(context.args[0])
                 if 5 <= value <= 25:
-                    self.db_manager.update_setting('heater_temp_threshold', value)
-                    
-                    if self.automation_controller:
-                        self.automation_controller.sync_settings_to_arduino()
+                    await self.db.update_setting('heater_temp_threshold', value, self._plant(context).device_id)
                     
                     await context.bot.send_message(
                         chat_id=update.effective_chat.id,
@@ -346,7 +400,7 @@ class SmartPlantBot:
                         text="\u26A0 Harorat 5°C dan 25°C gacha bo'lishi kerak."
                     )
             else:
-                current = self.db_manager.get_setting('heater_temp_threshold', 20.0)
+                current = await self.db.get_setting('heater_temp_threshold', 20.0, self._plant(context).device_id)
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text=f"ℹ️ Joriy chegara: {current}°C\n\nO'zgartirish: /isitgich_harorat 20"
@@ -363,22 +417,19 @@ class SmartPlantBot:
             if context.args:
                 state = context.args[0].lower()
                 if state in ['on', 'yoniq', '1']:
-                    self.db_manager.update_setting(f'auto_{mode}_enabled', '1')
+                    await self.db.update_setting(f'auto_{mode}_enabled', '1', self._plant(context).device_id)
                     msg = f"\u2705 Avtomatik {mode} yoqildi."
                 elif state in ['off', 'ochiq', '0']:
-                    self.db_manager.update_setting(f'auto_{mode}_enabled', '0')
+                    await self.db.update_setting(f'auto_{mode}_enabled', '0', self._plant(context).device_id)
                     msg = f"\u26d4 Avtomatik {mode} o'chirildi."
                 else:
                     msg = "\u26A0 Faqat 'on' yoki 'off' ishlating."
                     await context.bot.send_message(chat_id=update.effective_chat.id, text=msg)
                     return
                 
-                if self.automation_controller:
-                    self.automation_controller.sync_settings_to_arduino()
-                
                 await context.bot.send_message(chat_id=update.effective_chat.id, text=msg)
             else:
-                current = self.db_manager.get_setting(f'auto_{mode}_enabled', '1')
+                current = await self.db.get_setting(f'auto_{mode}_enabled', '1', self._plant(context).device_id)
                 status = "Yoniq \u2705" if current == '1' else "O'chiq \u26d4"
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
@@ -404,15 +455,15 @@ class SmartPlantBot:
             
         elif query.data == 'water_plant':
             # Check water level and water plant
-            data = self.db_manager.get_recent_data(limit=1)
+            data = await self._recent_data(context, 1)
             if data:
                 latest = data[0]
                 water_level = latest[8]
                 
                 if water_level == 1:
-                    duration = int(self.db_manager.get_setting('watering_duration', 5))
+                    duration = int(await self.db.get_setting('watering_duration', 5, self._plant(context).device_id))
                     command = f"W{duration}"
-                    if self.ingestor.write_command(command):
+                    if await self._send_command(context, command):
                         await query.edit_message_text(
                             text=f"\U0001F4A7 Sug'orilmoqda... ({duration} soniya)\n\u2705 Tayyor!"
                         )
@@ -438,14 +489,17 @@ class SmartPlantBot:
             fake_update._effective_chat = query.message.chat
             await self.start(fake_update, context)
             
+        elif query.data.startswith('select_plant:'):
+            device_id = query.data.split(':', 1)[1]
+            if device_id in self.devices:
+                context.chat_data['device_id'] = device_id
+            await query.edit_message_text(text=f"\U0001F331 Tanlangan o'simlik: {self._plant(context).device_id}")
+
         elif query.data.startswith('toggle_auto_'):
             mode = query.data.replace('toggle_auto_', '')
-            current = self.db_manager.get_setting(f'auto_{mode}_enabled', '1')
+            current = await self.db.get_setting(f'auto_{mode}_enabled', '1', self._plant(context).device_id)
             new_value = '0' if current == '1' else '1'
-            self.db_manager.update_setting(f'auto_{mode}_enabled', new_value)
-            
-            if self.automation_controller:
-                self.automation_controller.sync_settings_to_arduino()
+            await self.db.update_setting(f'auto_{mode}_enabled', new_value, self._plant(context).device_id)
             
             # Refresh settings display
             fake_update = Update(update.update_id, message=query.message)
@@ -458,10 +512,14 @@ class SmartPlantBot:
             if context.args:
                 state = context.args[0].lower()
                 if state in ['on', '1', 'yoq']:
-                    self.ingestor.write_command("TEST_FAN_ON")
+                    if not await self._send_command(context, "TEST_FAN_ON"):
+                        await context.bot.send_message(chat_id=update.effective_chat.id, text="\u26A0 Arduino javob bermadi.")
+                        return
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="\U0001F300 Fan yoqildi (TEST rejim).")
                 elif state in ['off', '0', 'och']:
-                    self.ingestor.write_command("TEST_FAN_OFF")
+                    if not await self._send_command(context, "TEST_FAN_OFF"):
+                        await context.bot.send_message(chat_id=update.effective_chat.id, text="\u26A0 Arduino javob bermadi.")
+                        return
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="\U0001F300 Fan o'chirildi (TEST rejim).")
                 else:
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="⚠️ Ishlatish: /fannotest on/off")
@@ -476,10 +534,14 @@ class SmartPlantBot:
             if context.args:
                 state = context.args[0].lower()
                 if state in ['on', '1', 'yoq']:
-                    self.ingestor.write_command("TEST_HEATER_ON")
+                    if not await self._send_command(context, "TEST_HEATER_ON"):
+                        await context.bot.send_message(chat_id=update.effective_chat.id, text="\u26A0 Arduino javob bermadi.")
+                        return
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="\U0001F525 Isitgich yoqildi (TEST rejim).")
                 elif state in ['off', '0', 'och']:
-                    self.ingestor.write_command("TEST_HEATER_OFF")
+                    if not await self._send_command(context, "TEST_HEATER_OFF"):
+                        await context.bot.send_message(chat_id=update.effective_chat.id, text="\u26A0 Arduino javob bermadi.")
+                        return
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="\U0001F525 Isitgich o'chirildi (TEST rejim).")
                 else:
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="⚠️ Ishlatish: /heatertest on/off")
@@ -491,7 +553,7 @@ class SmartPlantBot:
     async def debug_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show raw sensor data for troubleshooting."""
         try:
-            data = self.db_manager.get_recent_data(limit=1)
+            data = await self._recent_data(context, 1)
             if not data:
                 await context.bot.send_message(chat_id=update.effective_chat.id, text="⚠️ Ma'lumot yo'q.")
                 return
@@ -525,10 +587,10 @@ class SmartPlantBot:
             await context.bot.send_message(chat_id=update.effective_chat.id, text="⏳ Tahlil qilinmoqda...")
             
             # Fetch recent data for context
-            recent_data = self.db_manager.get_recent_data(limit=20)
+            recent_data = await self._recent_data(context, 20)
             
             # Run prediction
-            prediction, explanation = self.predictor.predict(recent_data)
+            prediction, explanation = self.predictor.predict(recent_data, device_id=self._plant(context).device_id)
             
             if prediction:
                 status_icon = "🌿" if "Healthy" in prediction else "🥀"
@@ -551,7 +613,7 @@ class SmartPlantBot:
     async def send_alert(self, text):
         """Send a proactive alert to the admin chat ID."""
         try:
-            admin_id = self.db_manager.get_setting('admin_chat_id')
+            admin_id = await self.db.get_setting('admin_chat_id')
             if admin_id and self.application:
                 await self.application.bot.send_message(
                     chat_id=admin_id,
@@ -588,6 +650,7 @@ class SmartPlantBot:
         self.application.add_handler(CommandHandler('heatertest', self.heatertest))
         self.application.add_handler(CommandHandler('debug', self.debug_command))
         self.application.add_handler(CommandHandler(['bashorat', 'predict'], self.predict_command))
+        self.application.add_handler(CommandHandler(['osimlik', 'plant'], self.select_plant))
         
         # Settings commands (with aliases)
         self.application.add_handler(CommandHandler(['tuproq_chegara', 'tuproqchegara'], self.set_soil_threshold))
@@ -625,6 +688,7 @@ class SmartPlantBot:
             await self.application.updater.stop()
             await self.application.stop()
             await self.application.shutdown()
+            await self.db.close()
 
     def run(self):
         """Standard entry point."""
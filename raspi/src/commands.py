@@ -0,0 +1,225 @@
+import collections
+import concurrent.futures
+import logging
+from . import config
+from .events import CommandAcked, ConnectionChanged
+
+logger = logging.getLogger(__name__)
+
+# Command prefix -> the ACK:<name>: line smart_plant_sensors.ino answers with
+ACK_NAMES = (
+    ('SET_ALL:', 'ALL'),
+    ('SET_SOIL_THRESH:', 'SOIL_THRESH'),
+    ('SET_FAN_TEMP:', 'FAN_TEMP'),
+    ('SET_HEATER_TEMP:', 'HEATER_TEMP'),
+    ('AUTO_WATER_', 'AUTO_WATER'),
+    ('AUTO_FAN_', 'AUTO_FAN'),
+    ('AUTO_HEATER_', 'AUTO_HEATER'),
+    ('PROTO_', 'PROTO'),
+    ('TEST_FAN_', 'FAN_TEST'),
+    ('TEST_HEATER_', 'HEATER_TEST'),
+)
+
+class CommandTimeout(Exception):
+    """The Arduino did not acknowledge a command after every retry."""
+
+def ack_name(command):
+    """ACK name expected for a command, or None (W<n> is not acknowledged)."""
+    for prefix, name in ACK_NAMES:
+        if command.startswith(prefix):
+            return name
+    return None
+
+def ack_value_matches(command, value):
+    """Whether an ACK value echoes what the command set; a late ACK for an earlier command does not."""
+    if command.endswith('_ON'):
+        return value == '1'
+    if command.endswith('_OFF'):
+        return value == '0'
+    if command.startswith('PROTO_'):
+        return value == command[6:]
+    sent = command.partition(':')[2].split(',')
+    echoed = value.split(',')
+    try:
+        # The firmware prints floats with two decimals
+        return len(sent) == len(echoed) and all(abs(float(a) - float(b)) < 0.01 for a, b in zip(sent, echoed))
+    except ValueError:
+        return False
+
+def settings_commands(settings):
+    """The single commands that mirror the settings on firmware without SET_ALL."""
+    return [
+        f"SET_SOIL_THRESH:{settings.get('soil_threshold', 340)}",
+        f"SET_FAN_TEMP:{settings.get('fan_temp_threshold', 28.0)}",
+        f"SET_HEATER_TEMP:{settings.get('heater_temp_threshold', 20.0)}",
+        "AUTO_WATER_ON" if settings.get('auto_water_enabled') == '1' else "AUTO_WATER_OFF",
+        "AUTO_FAN_ON" if settings.get('auto_fan_enabled') == '1' else "AUTO_FAN_OFF",
+        "AUTO_HEATER_ON" if settings.get('auto_heater_enabled') == '1' else "AUTO_HEATER_OFF",
+    ]
+
+def set_all_command(settings):
+    """SET_ALL:<soil>,<fan temp>,<heater temp>,<auto water>,<auto fan>,<auto heater>"""
+    flags = [1 if settings.get(name) == '1' else 0
+             for name in ('auto_water_enabled', 'auto_fan_enabled', 'auto_heater_enabled')]
+    values = [settings.get('soil_threshold', 340), settings.get('fan_temp_threshold', 28.0),
+              settings.get('heater_temp_threshold', 20.0)] + flags
+    return "SET_ALL:" + ",".join(str(v) for v in values)
+
+class CommandRequest:
+    def __init__(self, command, ack, timeout, retries):
+        self.command = command
+        self.ack = ack
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.timer = None
+        self.future = concurrent.futures.Future()
+
+class CommandChannel:
+    """
+    Outgoing command queue for one Arduino.
+
+    Commands go out one at a time, in order. Each waits for its ACK:<name>:
+    line, matched by name, with a timeout and retries; the firmware handles
+    commands in order, so only one is ever in flight. send() returns a
+    concurrent.futures.Future (asyncio.wrap_future() makes it awaitable) that
+    resolves to the ACK value, or True for commands without an ACK, and
+    raises CommandTimeout or ConnectionError on failure.
+
+    All queue state lives on the reader's event loop.
+    """
+    def __init__(self, ingestor):
+        self.ingestor = ingestor
+        self._queue = collections.deque()
+        self._in_flight = None
+        # Unknown until the first SET_ALL on this connection; older firmware ignores it
+        self.set_all_supported = None
+        self.stats = {'sent': 0, 'acked': 0, 'retries': 0, 'timeouts': 0}
+        ingestor.events.subscribe(CommandAcked, self._on_ack, device_id=ingestor.device_id, inline=True)
+        ingestor.events.subscribe(ConnectionChanged, self._on_connection, device_id=ingestor.device_id, inline=True)
+
+    def send(self, command, timeout=config.COMMAND_ACK_TIMEOUT_SECONDS, retries=config.COMMAND_RETRIES):
+        """Queue a command (safe from any thread). Returns a Future with the ACK value."""
+        request = CommandRequest(command, ack_name(command), timeout, retries)
+        loop = self.ingestor.loop
+        if loop is None or loop.is_closed() or not self.ingestor.connected:
+            request.future.set_exception(ConnectionError(f"Serial connection to {self.ingestor.port} not open"))
+            return request.future
+        try:
+            loop.call_soon_threadsafe(self._enqueue, request)
+        except RuntimeError:
+            request.future.set_exception(ConnectionError(f"Reader for {self.ingestor.port} stopped"))
+        return request.future
+
+    def sync_settings(self, settings):
+        """
+        Push the Arduino-side settings in one SET_ALL round trip, or as single
+        commands on firmware without it. Returns a Future resolving to True.
+        """
+        result = concurrent.futures.Future()
+        if self.set_all_supported is False:
+            self._send_each(settings_commands(settings), result)
+            return result
+
+        def done(future):
+            error = future.exception()
+            if error is None:
+                self.set_all_supported = True
+                result.set_result(True)
+            elif isinstance(error, CommandTimeout) and self.set_all_supported is None:
+                logger.info(f"Arduino on {self.ingestor.port} does not answer SET_ALL; syncing settings one by one")
+                self.set_all_supported = False
+                self._send_each(settings_commands(settings), result)
+            else:
+                result.set_exception(error)
+
+        self.send(set_all_command(settings)).add_done_callback(done)
+        return result
+
+    def _send_each(self, commands, result):
+        futures = [self.send(command) for command in commands]
+
+        def done(_):
+            if not all(f.done() for f in futures) or result.done():
+                return
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                result.set_exception(errors[0])
+            else:
+                result.set_result(True)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    # ---------- event loop side ----------
+
+    def _enqueue(self, request):
+        self._queue.append(request)
+        self._pump()
+
+    def _pump(self):
+        while self._in_flight is None and self._queue:
+            request = self._queue.popleft()
+            if request.future.cancelled():
+                continue
+            self._transmit(request)
+
+    def _transmit(self, request):
+        request.attempts += 1
+        if not self.ingestor.write_command(request.command):
+            if self._in_flight is request:
+                self._in_flight = None
+            self._fail(request, ConnectionError(f"Serial connection to {self.ingestor.port} not open"))
+            return
+        self.stats['sent'] += 1
+        if request.ack is None:
+            if not request.future.done():
+                request.future.set_result(True)
+            return
+        self._in_flight = request
+        request.timer = self.ingestor.loop.call_later(request.timeout, self._on_timeout, request)
+
+    def _on_timeout(self, request):
+        if request is not self._in_flight:
+            return
+        if request.attempts <= request.retries and not request.future.cancelled():
+            self.stats['retries'] += 1
+            logger.warning(f"No ACK for {request.command} from {self.ingestor.port}, retrying ({request.attempts}/{request.retries})")
+            self._transmit(request)
+            self._pump()
+            return
+        self._in_flight = None
+        self.stats['timeouts'] += 1
+        self._fail(request, CommandTimeout(f"No ACK for {request.command} after {request.attempts} attempts"))
+        self._pump()
+
+    def _on_ack(self, event):
+        request = self._in_flight
+        if request is None or event.name != request.ack or not ack_value_matches(request.command, event.value):
+            # A late ACK for a retried command, or a reply to a command sent outside the channel
+            logger.debug(f"Unmatched ACK from {self.ingestor.port}: {event.name}:{event.value}")
+            return
+        request.timer.cancel()
+        self._in_flight = None
+        self.stats['acked'] += 1
+        if not request.future.done():
+            request.future.set_result(event.value)
+        self._pump()
+
+    def _on_connection(self, event):
+        # A (re)connected Arduino has just reset: it may run different firmware
+        self.set_all_supported = None
+        if event.connected:
+            return
+        pending = list(self._queue)
+        self._queue.clear()
+        if self._in_flight is not None:
+            self._in_flight.timer.cancel()
+            pending.insert(0, self._in_flight)
+            self._in_flight = None
+        for request in pending:
+            self._fail(request, ConnectionError(f"Serial connection to {self.ingestor.port} lost"))
+
+    def _fail(self, request, error):
+        if not request.future.done():
+            request.future.set_exception(error)
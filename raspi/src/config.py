@@ -10,19 +10,114 @@ load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"))
 # SERIAL_PORT = '/dev/ttyUSB0'  # Default for Raspberry Pi, might need adjustment
 SERIAL_PORT = 'COM6'  # Windows port (not used on Raspberry Pi)
 BAUD_RATE = 9600
+SERIAL_BINARY_FRAMES = True # Ask the Arduino for binary telemetry frames (JSON lines are still understood)
+SERIAL_PROTOCOL_RETRY_SECONDS = 10 # Re-send PROTO_BIN while JSON keeps arriving (the Arduino resets on connect)
+SERIAL_PROTOCOL_MAX_ATTEMPTS = 3 # Then assume older firmware and stay on JSON
+
+# Plants: one Arduino per plant, device_id -> serial port.
+# Readings, predictions and per-plant settings are stored under the device id.
+DEFAULT_DEVICE_ID = 'default' # The original single plant (owns all data recorded before devices existed)
+DEVICES = {DEFAULT_DEVICE_ID: SERIAL_PORT}
+SERIAL_DISCOVERY_ENABLED = False # Also adopt Arduinos plugged in that are not listed in DEVICES
+SERIAL_DISCOVERY_INTERVAL_SECONDS = 10
+SERIAL_DISCOVERY_USB_VIDS = (0x2341, 0x2A03, 0x1A86, 0x0403, 0x10C4) # Arduino, Arduino.org, CH340, FTDI, CP210x
+INGESTION_STATS_INTERVAL_SECONDS = 300 # How often per-port throughput is logged
+
+# Ingestion pipeline: serial readers publish on the event bus and hand readings to the writer thread
+EVENT_QUEUE_SIZE = 100 # Per-subscriber event queue (EventBus); the policy decides what a full queue drops
+INGESTION_QUEUE_SIZE = 10000 # Readings waiting for the database; beyond this new readings are dropped (not stored)
+INGESTION_WRITE_BATCH = 500 # Most readings committed in one transaction by the writer thread
+INGESTION_STOP_WRITE_ATTEMPTS = 3 # Failed writes of a batch while stopping before it is counted as dropped
 
 # Database Configuration
 DB_NAME = 'plant_data_v3.db'
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), DB_NAME)
+DB_BUSY_TIMEOUT_SECONDS = 5.0 # How long a connection waits on a locked database before failing
+DB_CACHE_SIZE_KB = 4096 # SQLite page cache per connection
+DB_STATEMENT_CACHE_SIZE = 128 # Prepared statements kept per connection
+
+# Older database files consolidated by import_legacy.py
+LEGACY_DB_NAMES = ['plant_data.db', 'plant_data_v2.db', 'sensor_data.db']
+LEGACY_IMPORT_BATCH_SIZE = 50000 # Rows per import transaction
+
+# Group-commit buffering of sensor inserts (one transaction per batch instead of per reading).
+# Readers only see buffered readings after a flush, so keep the window short.
+DB_WRITE_BUFFER_ENABLED = False
+DB_WRITE_BUFFER_SIZE = 60 # Flush once this many readings are waiting
+DB_WRITE_BUFFER_MAX_DELAY_SECONDS = 30 # Durability window: max age of an unflushed reading
+
+# Deadband: a reading is stored only when a value moves beyond its tolerance (vs. the last stored
+# reading) or the heartbeat has elapsed. Skipped readings still count in the rollups; read raw
+# history back as a regular series with DatabaseManager.get_step_series().
+# Off by default: get_recent_data() and iter_data_chunks() then return sparse rows, not a 5 s series.
+DB_DEADBAND_ENABLED = False
+DB_DEADBAND = { # Tolerance per column; columns not listed are stored on any change
+    'soil_moisture_1': 8, 'soil_moisture_2': 8, 'soil_moisture_3': 8, 'soil_moisture_avg': 5, # ADC counts
+    'temperature': 0.3, # °C (DHT22 resolution is 0.1)
+    'humidity': 1.5, # %
+    'light_intensity': 10,
+}
+DB_DEADBAND_HEARTBEAT_SECONDS = 300 # Store a reading at least this often, changed or not
+SENSOR_INTERVAL_SECONDS = 5 # How often the Arduino sends a reading (smart_plant_sensors.ino)
+
+# History queries pick the coarsest rollup (minute/hour/day) giving at least this many points
+HISTORY_TARGET_POINTS = 500
+
+# Retention (None = keep forever). Hour and day rollups are always kept.
+RAW_RETENTION_DAYS = 30 # Raw 5-second readings
+MINUTE_ROLLUP_RETENTION_DAYS = 365
+PREDICTION_RETENTION_DAYS = 90
+FEATURE_RETENTION_DAYS = None # Feature store rows: the training history, kept past raw retention
+RETENTION_INTERVAL_MINUTES = 60 # How often the retention job runs
+RETENTION_MAX_STEP_MS = 5 # Target duration of each delete / vacuum step
+RETENTION_STEP_PAUSE_SECONDS = 0.02 # Pause between steps so ingestion can take the write lock
 
 # Model Configuration
 MODEL_FILENAME = 'plant_model.joblib'
 MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), MODEL_FILENAME)
 
 # System Loop Configuration
-DATA_READ_INTERVAL_SECONDS = 0.1 # Serial read timeout or loop delay
+COMMAND_ACK_TIMEOUT_SECONDS = 1.0 # Resend a command not acknowledged within this time
+COMMAND_RETRIES = 3 # Resends before the command fails (covers the reset after connecting)
+SERIAL_RECONNECT_MIN_SECONDS = 0.5 # First retry after a failed or lost serial connection
+SERIAL_RECONNECT_MAX_SECONDS = 30 # Retry delay doubles up to this
+SERIAL_MAX_LINE_BYTES = 4096 # Partial lines longer than this are dropped (noise, wrong baud rate)
 TRAINING_INTERVAL_MINUTES = 60 * 24 # Train once a day
 PREDICTION_INTERVAL_SECONDS = 60 * 5 # Predict every 5 minutes
+PREDICT_ON_READING = True # Also predict as each reading arrives; a confirmed label change is stored and alerted
+PREDICTION_CHANGE_CONFIRMATIONS = 6 # Per-reading labels in a row (30 s of readings) before a change counts
+PREDICTION_CHANGE_HOLD_SECONDS = 60 * 10 # And at least this long after the plant's last reported change
+
+# Training data streaming (keeps nightly training memory bounded)
+TRAINING_CHUNK_SIZE = 10000 # Rows fetched from SQLite per chunk
+TRAINING_MAX_SAMPLES = 200000 # Uniform random sample of history used to fit the model
+
+# Incremental training: each run adds trees fitted on the feature rows stored since the last one
+TRAINING_TREES = 50 # Trees in a full retrain
+TRAINING_INCREMENTAL_TREES = 10 # Trees added per incremental run
+TRAINING_MAX_TREES = 200 # Beyond this the oldest trees are dropped
+TRAINING_MIN_NEW_SAMPLES = 50 # Fewer new rows: keep the model and wait for more
+
+# Columnar training snapshot: sensor_data exported incrementally into memory-mapped column files
+SNAPSHOT_ENABLED = True
+SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+
+# Feature store (src/features.py): model features kept up to date as readings arrive
+FEATURE_INTERVAL_SECONDS = 60 # One feature row per device stored this often
+FEATURE_WATERING_DROP_COUNTS = 40 # Soil this far below its 5-minute mean counts as a watering
+FEATURE_WATERING_CAP_HOURS = 24 * 7 # hours_since_watering never exceeds this (also: none seen yet)
+
+# In-memory buffer of the newest readings served to the automation, voice, predictor and bot
+RING_BUFFER_CAPACITY = 720 # One hour of 5-second readings
+
+# Soil probe validation (src/validation.py); values are 10-bit ADC counts
+SOIL_PROBE_MIN = 5 # At or below: shorted probe
+SOIL_PROBE_MAX = 1018 # At or above: disconnected probe
+SOIL_STUCK_READINGS = 120 # Identical values in a row before a probe counts as stuck (10 minutes)
+SOIL_VALIDATION_WINDOW = 60 # Readings averaged (EWMA span) into each probe's level and noise
+SOIL_SPIKE_SIGMAS = 6 # Disagreement with the other probes, in noise deviations, that makes a spike
+SOIL_SPIKE_MIN_COUNTS = 40 # Smaller disagreements are never spikes
+SOIL_SPIKE_ACCEPT_READINGS = 12 # A spike lasting this long is taken as the probe's new level
 
 # Thresholds (logic based if no model)
 MOISTURE_THRESHOLD_LOW = 340 # Example analog value, needs calibration
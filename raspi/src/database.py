@@ -1,190 +1,907 @@
 import sqlite3
+import threading
 import time
+import logging
+import numpy as np
 from . import config
 
+logger = logging.getLogger(__name__)
+
+# Column list shared by every reading query so the statement text stays identical
+# and sqlite3's per-connection statement cache can reuse the prepared statement.
+READING_COLUMNS = (
+    'timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg, '
+    'temperature, humidity, light_intensity, water_level, fan_status, heater_status, quality_flags'
+)
+
+INSERT_READING_SQL = '''
+    INSERT INTO sensor_data
+    (device_id, timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg,
+     temperature, humidity, light_intensity, water_level, fan_status, heater_status, quality_flags)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+READING_COLUMN_NAMES = tuple(c.strip() for c in READING_COLUMNS.split(','))
+
+LATEST_READINGS_SQL = f'''
+    SELECT {READING_COLUMNS}
+    FROM sensor_data
+    WHERE device_id = ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+# Horizons of the feature store's rolling features (src/features.py). Each one
+# adds columns to the features table, so changing them needs a migration.
+FEATURE_HORIZONS_MINUTES = (5, 30, 120)
+
+def _feature_columns():
+    columns = ['soil_moisture', 'temperature', 'humidity']
+    for minutes in FEATURE_HORIZONS_MINUTES:
+        columns += [f'soil_ema_{minutes}m', f'soil_mean_{minutes}m', f'soil_std_{minutes}m', f'soil_slope_{minutes}m',
+                    f'temperature_ema_{minutes}m', f'humidity_ema_{minutes}m']
+    return tuple(columns + ['hours_since_watering', 'day_sin', 'day_cos'])
+
+# Model inputs kept by the feature store, in stored order (after device_id, timestamp)
+FEATURE_COLUMNS = _feature_columns()
+
+INSERT_FEATURES_SQL = f'''
+    INSERT INTO features (device_id, timestamp, {', '.join(FEATURE_COLUMNS)})
+    VALUES ({', '.join('?' for _ in range(2 + len(FEATURE_COLUMNS)))})
+'''
+
+ALL_READINGS_SQL = f'''
+    SELECT {READING_COLUMNS}
+    FROM sensor_data
+    ORDER BY timestamp ASC
+'''
+
+INSERT_PREDICTION_SQL = '''
+    INSERT INTO predictions (device_id, timestamp, prediction, explanation)
+    VALUES (?, ?, ?, ?)
+'''
+
+UPSERT_SETTING_SQL = '''
+    INSERT OR REPLACE INTO user_settings (device_id, setting_name, setting_value, last_updated)
+    VALUES (?, ?, ?, ?)
+'''
+
+ALL_SETTINGS_SQL = 'SELECT device_id, setting_name, setting_value FROM user_settings'
+
+# device_id of the settings shared by every plant; a plant's own rows override them
+GLOBAL_SETTINGS = ''
+
+# Applied to every new connection, sync or async
+CONNECTION_PRAGMAS = (
+    # WAL lets the bot, automation and predictor read while ingestion writes.
+    'PRAGMA journal_mode=WAL',
+    # In WAL mode NORMAL is still corruption-safe and avoids an fsync per commit.
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    f'PRAGMA cache_size=-{int(config.DB_CACHE_SIZE_KB)}',
+)
+
+# Sensor columns summarised (min / max / mean) in the rollup tables: every
+# reading column after the timestamp except quality_flags, which comes last
+ROLLUP_COLUMNS = (
+    'soil_moisture_1', 'soil_moisture_2', 'soil_moisture_3', 'soil_moisture_avg',
+    'temperature', 'humidity', 'light_intensity', 'water_level', 'fan_status', 'heater_status'
+)
+
+# Rollup tiers, finest first: (table, bucket width in seconds).
+# Buckets are UTC-aligned and kept per device.
+ROLLUP_RESOLUTIONS = (
+    ('sensor_rollup_minute', 60),
+    ('sensor_rollup_hour', 60 * 60),
+    ('sensor_rollup_day', 60 * 60 * 24),
+)
+
+def _rollup_upsert_sql(table):
+    """Merge one pre-aggregated bucket into a rollup table."""
+    value_cols = ', '.join(f'{c}_min, {c}_max, {c}_sum, {c}_count' for c in ROLLUP_COLUMNS)
+    placeholders = ', '.join('?' for _ in range(3 + 4 * len(ROLLUP_COLUMNS)))
+    updates = ',\n        '.join(
+        f'{c}_min = min(coalesce({c}_min, excluded.{c}_min), coalesce(excluded.{c}_min, {c}_min)), '
+        f'{c}_max = max(coalesce({c}_max, excluded.{c}_max), coalesce(excluded.{c}_max, {c}_max)), '
+        f'{c}_sum = coalesce({c}_sum, 0) + coalesce(excluded.{c}_sum, 0), '
+        f'{c}_count = coalesce({c}_count, 0) + excluded.{c}_count'
+        for c in ROLLUP_COLUMNS
+    )
+    return f'''
+        INSERT INTO {table} (device_id, bucket, samples, {value_cols})
+        VALUES ({placeholders})
+        ON CONFLICT(device_id, bucket) DO UPDATE SET
+        samples = samples + excluded.samples,
+        {updates}
+    '''
+
+ROLLUP_UPSERT_SQL = {table: _rollup_upsert_sql(table) for table, _ in ROLLUP_RESOLUTIONS}
+
+def rollup_batches(rows, device_id):
+    """
+    Pre-aggregate one device's inserted readings per bucket for every rollup tier.
+    Per column: min, max, sum and the number of non-NULL values the mean
+    divides by (a failed DHT read is NULL, not 0). Returns (upsert statement,
+    parameter rows) pairs to run with executemany in the same transaction as
+    the raw insert.
+    """
+    batches = []
+    for table, width in ROLLUP_RESOLUTIONS:
+        buckets = {}
+        for row in rows:
+            bucket = int(row[0] // width) * width
+            stats = buckets.get(bucket)
+            if stats is None:
+                stats = buckets[bucket] = [0] + [None, None, None, 0] * len(ROLLUP_COLUMNS)
+            stats[0] += 1
+            for i, value in enumerate(row[1:1 + len(ROLLUP_COLUMNS)]):
+                if value is None:
+                    continue
+                j = 1 + 4 * i
+                if stats[j] is None:
+                    stats[j] = stats[j + 1] = stats[j + 2] = value
+                else:
+                    if value < stats[j]:
+                        stats[j] = value
+                    if value > stats[j + 1]:
+                        stats[j + 1] = value
+                    stats[j + 2] += value
+                stats[j + 3] += 1
+        batches.append((ROLLUP_UPSERT_SQL[table], [[device_id, bucket] + stats for bucket, stats in buckets.items()]))
+    return batches
+
+def write_readings(conn, device_id, rows, unstored=(), features=()):
+    """
+    Insert one device's readings and fold them into the rollups (caller owns the transaction).
+    unstored: readings the deadband kept out of sensor_data; they only count in the rollups.
+    features: feature store rows (timestamp, FEATURE_COLUMNS...) stored with them.
+    """
+    if rows:
+        conn.executemany(INSERT_READING_SQL, [(device_id,) + tuple(row) for row in rows])
+    if rows or unstored:
+        for sql, params in rollup_batches(list(rows) + list(unstored), device_id):
+            conn.executemany(sql, params)
+    if features:
+        conn.executemany(INSERT_FEATURES_SQL, [(device_id,) + tuple(row) for row in features])
+
+def step_series(data, times, max_gap=None):
+    """
+    Sample change-only readings as a step function: each time in `times`
+    takes the newest row at or before it.
+    data: float64 array (rows, 1 + columns), timestamp first and ascending.
+    max_gap: times further than this after the row they would hold get NaN
+    (the board was offline, not unchanged).
+    Returns a (len(times), columns) array.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.full((len(times), data.shape[1] - 1), np.nan)
+    if len(data) == 0:
+        return values
+    index = np.searchsorted(data[:, 0], times, side='right') - 1
+    valid = index >= 0
+    if max_gap is not None:
+        valid &= times - data[np.maximum(index, 0), 0] <= max_gap
+    values[valid] = data[index[valid], 1:]
+    return values
+
+def backfill_rollup(cursor, table, width):
+    """Build a new (empty) rollup table from the raw readings already stored (value counts: migration 8)."""
+    if cursor.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+        return
+    if not cursor.execute('SELECT 1 FROM sensor_data LIMIT 1').fetchone():
+        return
+    value_cols = ', '.join(f'{c}_min, {c}_max, {c}_sum' for c in ROLLUP_COLUMNS)
+    aggregates = ', '.join(f'min({c}), max({c}), total({c})' for c in ROLLUP_COLUMNS)
+    cursor.execute(f'''
+        INSERT INTO {table} (device_id, bucket, samples, {value_cols})
+        SELECT device_id, CAST(timestamp / {width} AS INTEGER) * {width}, count(*), {aggregates}
+        FROM sensor_data
+        GROUP BY 1, 2
+    ''')
+    logger.info(f"Backfilled {table} with {cursor.rowcount} buckets")
+
+# History rows share one shape whatever tier they come from:
+# timestamp, samples, <column> (mean), <column>_min, <column>_max.
+# A rollup mean is over the bucket's non-NULL values (NULL when there were none).
+_RAW_HISTORY_SQL = f'''
+    SELECT timestamp, 1 AS samples,
+           {', '.join(f'{c}, {c} AS {c}_min, {c} AS {c}_max' for c in ROLLUP_COLUMNS)}
+    FROM sensor_data
+    WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp ASC
+'''
+
+_ROLLUP_HISTORY_SQL = {
+    table: f'''
+        SELECT bucket AS timestamp, samples,
+               {', '.join(f'{c}_sum / {c}_count AS {c}, {c}_min, {c}_max' for c in ROLLUP_COLUMNS)}
+        FROM {table}
+        WHERE device_id = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket ASC
+    '''
+    for table, _ in ROLLUP_RESOLUTIONS
+}
+
+# Batched deletes used by the retention job: (table, time column) -> statement
+_PRUNE_SQL = {
+    table: f'''
+        DELETE FROM {table} WHERE {key} IN (
+            SELECT {key} FROM {table} WHERE {column} < ? ORDER BY {column} LIMIT ?
+        )
+    '''
+    for table, key, column in (
+        ('sensor_data', 'id', 'timestamp'),
+        ('sensor_rollup_minute', 'rowid', 'bucket'),
+        ('predictions', 'id', 'timestamp'),
+        ('features', 'id', 'timestamp'),
+    )
+}
+
 class DatabaseManager:
     def __init__(self, db_path=config.DB_PATH):
         self.db_path = db_path
+        # One long-lived connection per thread; SQLite connections must not be
+        # shared between threads that use them concurrently.
+        self._local = threading.local()
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._retention_lock = threading.Lock()
+        # Write-through cache of user_settings, loaded on first read
+        self._settings = None
+        self._settings_lock = threading.Lock()
+        self._settings_listeners = []
         self._init_db()
 
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+        """Return the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=config.DB_BUSY_TIMEOUT_SECONDS,
+            cached_statements=config.DB_STATEMENT_CACHE_SIZE,
+            # Only the owning thread uses it; close() may run from another thread.
+            check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
+        self._apply_pragmas(conn)
+        self._local.conn = conn
+
+        current = threading.current_thread()
+        with self._connections_lock:
+            self._prune_dead_connections()
+            self._connections[current] = conn
+        logger.debug(f"Opened database connection for thread {current.name}")
         return conn
 
+    def _apply_pragmas(self, conn):
+        """Tune a fresh connection for many readers and a single frequent writer."""
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+
+    def _prune_dead_connections(self):
+        """Close connections left behind by threads that have exited."""
+        for thread in [t for t in self._connections if not t.is_alive()]:
+            try:
+                self._connections.pop(thread).close()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to close stale connection: {e}")
+
+    def close(self):
+        """Close every pooled connection (call on shutdown)."""
+        with self._connections_lock:
+            for conn in self._connections.values():
+                try:
+                    conn.execute('PRAGMA optimize')
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.warning(f"Failed to close database connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
     def _init_db(self):
-        """Initialize the database tables if they don't exist."""
+        """Bring the schema up to date and seed default settings."""
+        # Imported here because the migrations use this module's schema constants
+        from .migrations import apply_migrations
+
         conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        # Sensor data table with 3 soil sensors
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp REAL,
-                soil_moisture_1 INTEGER,
-                soil_moisture_2 INTEGER,
-                soil_moisture_3 INTEGER,
-                soil_moisture_avg INTEGER,
-                temperature REAL,
-                humidity REAL,
-                light_intensity INTEGER,
-                water_level INTEGER,
-                fan_status INTEGER,
-                heater_status INTEGER
-            )
-        ''')
-        
-        # Predictions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS predictions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp REAL,
-                prediction TEXT,
-                explanation TEXT
-            )
-        ''')
-        
-        # Settings table for user preferences
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                setting_name TEXT UNIQUE,
-                setting_value TEXT,
-                last_updated REAL
-            )
-        ''')
-        
-        # Insert default settings if not exists
-        default_settings = {
-            'auto_water_enabled': '1',
-            'auto_fan_enabled': '1',
-            'auto_heater_enabled': '1',
-            'soil_threshold': '340',
-            'fan_temp_threshold': '28.0',
-            'heater_temp_threshold': '20.0',
-            'watering_duration': '5',
-            'admin_chat_id': ''
-        }
-        
-        for name, value in default_settings.items():
+        self._ensure_incremental_vacuum(conn)
+        self.schema_version = apply_migrations(conn)
+
+        with conn:
+            cursor = conn.cursor()
+
+            # Insert default settings if not exists
+            default_settings = {
+                'auto_water_enabled': '1',
+                'auto_fan_enabled': '1',
+                'auto_heater_enabled': '1',
+                'soil_threshold': '340',
+                'fan_temp_threshold': '28.0',
+                'heater_temp_threshold': '20.0',
+                'watering_duration': '5',
+                'admin_chat_id': ''
+            }
+
+            for name, value in default_settings.items():
+                cursor.execute('''
+                    INSERT OR IGNORE INTO user_settings (setting_name, setting_value, last_updated)
+                    VALUES (?, ?, ?)
+                ''', (name, value, time.time()))
+
+            # Migration: Ensure thresholds match user's latest requirements
+            cursor.execute('''
+                UPDATE user_settings
+                SET setting_value = '340'
+                WHERE setting_name = 'soil_threshold' AND (setting_value = '500' OR setting_value = '250' OR setting_value = '300')
+            ''')
+
             cursor.execute('''
-                INSERT OR IGNORE INTO user_settings (setting_name, setting_value, last_updated)
-                VALUES (?, ?, ?)
-            ''', (name, value, time.time()))
-            
-        # Migration: Ensure thresholds match user's latest requirements
-        cursor.execute('''
-            UPDATE user_settings 
-            SET setting_value = '340' 
-            WHERE setting_name = 'soil_threshold' AND (setting_value = '500' OR setting_value = '250' OR setting_value = '300')
-        ''')
-        
-        cursor.execute('''
-            UPDATE user_settings 
-            SET setting_value = '20.0' 
-            WHERE setting_name = 'heater_temp_threshold' AND setting_value = '18.0'
-        ''')
-        
-        conn.commit()
-        conn.close()
-
-    def insert_sensor_data(self, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status):
+                UPDATE user_settings
+                SET setting_value = '20.0'
+                WHERE setting_name = 'heater_temp_threshold' AND setting_value = '18.0'
+            ''')
+
+        for device_id, port in config.DEVICES.items():
+            self.register_device(device_id, port)
+
+    def _ensure_incremental_vacuum(self, conn):
+        """Use incremental auto-vacuum so the retention job can return space in small steps."""
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        if conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone():
+            logger.info("Enabling incremental auto-vacuum (one-time VACUUM, may take a while)...")
+        # The mode only takes effect after a rebuild; instant on a new file, done once otherwise
+        conn.execute('VACUUM')
+
+    def register_device(self, device_id, port=None):
+        """Record a plant / Arduino (idempotent; updates the port)."""
+        conn = self._get_connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO devices (device_id, port, created_at) VALUES (?, ?, ?)
+                ON CONFLICT(device_id) DO UPDATE SET port = coalesce(excluded.port, port)
+            ''', (device_id, port, time.time()))
+
+    def get_device_ids(self):
+        """Ids of every known device, oldest first."""
+        conn = self._get_connection()
+        return [row[0] for row in conn.execute('SELECT device_id FROM devices ORDER BY created_at, device_id')]
+
+    def insert_sensor_data(self, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status,
+                           timestamp=None, device_id=config.DEFAULT_DEVICE_ID, quality_flags=None):
         """Insert a new reading with 3 soil sensors."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        timestamp = time.time()
-        cursor.execute('''
-            INSERT INTO sensor_data 
-            (timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg, 
-             temperature, humidity, light_intensity, water_level, fan_status, heater_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (timestamp, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status))
-        conn.commit()
-        conn.close()
-
-    def insert_prediction(self, prediction, explanation):
+        if timestamp is None:
+            timestamp = time.time()
+        self.insert_sensor_data_many([
+            (timestamp, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status,
+             quality_flags)
+        ], device_id=device_id)
+
+    def insert_sensor_data_many(self, rows, device_id=config.DEFAULT_DEVICE_ID):
+        """Insert many readings from one device in a single transaction.
+        rows: tuples in READING_COLUMNS order (timestamp first).
+        """
+        self.insert_sensor_batches({device_id: rows})
+
+    def insert_sensor_batches(self, batches, unstored=None, features=None):
+        """Insert readings from several devices in a single transaction.
+        batches: {device_id: rows}, rows as for insert_sensor_data_many.
+        unstored: {device_id: rows} counted in the rollups only (deadband).
+        features: {device_id: feature store rows} stored alongside.
+        """
+        unstored = unstored or {}
+        features = features or {}
+        devices = [device_id for device_id in {**batches, **unstored, **features}
+                   if batches.get(device_id) or unstored.get(device_id) or features.get(device_id)]
+        if not devices:
+            return
+        conn = self._get_connection()
+        with conn:
+            for device_id in devices:
+                # Rollup tiers and features are updated in the same transaction
+                write_readings(conn, device_id, batches.get(device_id, ()), unstored.get(device_id, ()),
+                               features.get(device_id, ()))
+
+    def insert_features(self, rows, device_id=config.DEFAULT_DEVICE_ID):
+        """Store one device's feature rows (timestamp, FEATURE_COLUMNS...) in a single transaction."""
+        self.insert_sensor_batches({}, features={device_id: rows})
+
+    def insert_prediction(self, prediction, explanation, device_id=config.DEFAULT_DEVICE_ID):
         """Log a prediction."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        conn = self._get_connection()
         timestamp = time.time()
-        cursor.execute('''
-            INSERT INTO predictions (timestamp, prediction, explanation)
-            VALUES (?, ?, ?)
-        ''', (timestamp, prediction, explanation))
-        conn.commit()
-        conn.close()
-
-    def get_recent_data(self, limit=1000):
-        """Get recent sensor readings as a list of dictionaries/Rows."""
+        with conn:
+            conn.execute(INSERT_PREDICTION_SQL, (device_id, timestamp, prediction, explanation))
+
+    def get_recent_data(self, limit=1000, device_id=config.DEFAULT_DEVICE_ID):
+        """Get a device's recent sensor readings as a list of dictionaries/Rows."""
         conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute(f'''
-            SELECT timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg,
-                   temperature, humidity, light_intensity, water_level, fan_status, heater_status
-            FROM sensor_data 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
-        data = cursor.fetchall()
-        conn.close()
+        data = conn.execute(LATEST_READINGS_SQL, (device_id, limit)).fetchall()
         # Return in ascending order for trainer/predictor
         return list(reversed(data))
 
-    def get_latest_reading(self):
-        """Get the absolute latest reading."""
+    def get_latest_reading(self, device_id=config.DEFAULT_DEVICE_ID):
+        """Get a device's absolute latest reading."""
         conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg,
-                   temperature, humidity, light_intensity, water_level, fan_status, heater_status
-            FROM sensor_data 
-            ORDER BY timestamp DESC 
-            LIMIT 1
-        ''')
-        result = cursor.fetchone()
-        conn.close()
-        return result
+        return conn.execute(LATEST_READINGS_SQL, (device_id, 1)).fetchone()
 
     def get_all_data(self):
-        """Get all sensor readings."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg,
-                   temperature, humidity, light_intensity, water_level, fan_status, heater_status
-            FROM sensor_data 
-            ORDER BY timestamp ASC
-        ''')
-        data = cursor.fetchall()
-        conn.close()
-        return data
-
-    def get_setting(self, setting_name, default=None):
-        """Get a setting value."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT setting_value FROM user_settings WHERE setting_name = ?', (setting_name,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else default
-
-    def update_setting(self, setting_name, setting_value):
-        """Update or insert a setting."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_settings (setting_name, setting_value, last_updated)
-            VALUES (?, ?, ?)
-        ''', (setting_name, str(setting_value), time.time()))
-        conn.commit()
-        conn.close()
-
-    def get_all_settings(self):
-        """Get all settings as a dictionary."""
-        conn = sqlite3.connect(self.db_path)
+        """Get all sensor readings (every device)."""
+        conn = self._get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT setting_name, setting_value FROM user_settings')
-        settings = {row[0]: row[1] for row in cursor.fetchall()}
-        conn.close()
+        # Plain tuples, as the preprocessor expects
+        cursor.row_factory = None
+        cursor.execute(ALL_READINGS_SQL)
+        return cursor.fetchall()
+
+    def iter_data_chunks(self, chunk_size=config.TRAINING_CHUNK_SIZE, start_time=None, end_time=None,
+                         columns=None, as_numpy=False, after_id=None, until_id=None, device_id=None):
+        """
+        Stream sensor readings in timestamp order, chunk_size rows at a time.
+        device_id: only this device's readings (default: every device).
+        start_time / end_time: optional range (end exclusive).
+        columns: subset of READING_COLUMN_NAMES (default: all, in that order).
+        as_numpy: yield float64 arrays of shape (rows, columns) instead of lists of tuples.
+        after_id / until_id: optional row id range (after exclusive, until inclusive);
+        when given, rows come in insertion (id) order, for incremental exports.
+        """
+        columns = tuple(columns) if columns else READING_COLUMN_NAMES
+        unknown = set(columns) - set(READING_COLUMN_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown sensor columns: {sorted(unknown)}")
+
+        conditions = []
+        params = []
+        if device_id is not None:
+            conditions.append('device_id = ?')
+            params.append(device_id)
+        if start_time is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            conditions.append('timestamp < ?')
+            params.append(end_time)
+        if after_id is not None:
+            conditions.append('id > ?')
+            params.append(after_id)
+        if until_id is not None:
+            conditions.append('id <= ?')
+            params.append(until_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'id' if after_id is not None or until_id is not None else 'timestamp'
+
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = None
+        cursor.arraysize = chunk_size
+        try:
+            cursor.execute(f'''
+                SELECT {', '.join(columns)}
+                FROM sensor_data
+                {where}
+                ORDER BY {order} ASC
+            ''', params)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                yield np.array(rows, dtype=np.float64) if as_numpy else rows
+        finally:
+            cursor.close()
+
+    def get_step_series(self, start_time, end_time=None, interval=config.SENSOR_INTERVAL_SECONDS, columns=None,
+                        device_id=config.DEFAULT_DEVICE_ID,
+                        max_gap=config.DB_DEADBAND_HEARTBEAT_SECONDS + config.SENSOR_INTERVAL_SECONDS):
+        """
+        A device's readings on a regular grid, rebuilt from the change-only
+        sensor_data (see DB_DEADBAND): one point every `interval` seconds from
+        start_time to end_time, each value held from the newest stored row
+        before it. Points more than max_gap after the last stored row are NaN.
+        Returns a float64 array (points, 1 + columns), timestamp first, as
+        iter_data_chunks(as_numpy=True) yields.
+        """
+        if end_time is None:
+            end_time = time.time()
+        columns = tuple(c for c in (columns or READING_COLUMN_NAMES) if c != 'timestamp')
+        unknown = set(columns) - set(READING_COLUMN_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown sensor columns: {sorted(unknown)}")
+        selected = ', '.join(('timestamp',) + columns)
+
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = None
+        try:
+            # The row whose values still hold at start_time, then everything in range
+            seed = cursor.execute(f'''
+                SELECT {selected} FROM sensor_data
+                WHERE device_id = ? AND timestamp < ?
+                ORDER BY timestamp DESC LIMIT 1
+            ''', (device_id, start_time)).fetchall()
+            rows = cursor.execute(f'''
+                SELECT {selected} FROM sensor_data
+                WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp ASC
+            ''', (device_id, start_time, end_time)).fetchall()
+        finally:
+            cursor.close()
+
+        data = np.array(seed + rows, dtype=np.float64).reshape(-1, 1 + len(columns))
+        times = np.arange(start_time, end_time, interval, dtype=np.float64)
+        return np.column_stack([times, step_series(data, times, max_gap)])
+
+    def iter_feature_chunks(self, chunk_size=config.TRAINING_CHUNK_SIZE, device_id=None, after_id=None,
+                            until_id=None):
+        """
+        Stream stored feature rows in timestamp order as float64 arrays of
+        shape (rows, 1 + len(FEATURE_COLUMNS)), timestamp first.
+        device_id: only this device's rows (default: every device).
+        after_id / until_id: optional row id range (after exclusive, until inclusive);
+        when given, rows come in insertion (id) order, for incremental training.
+        """
+        conditions = []
+        params = []
+        if device_id is not None:
+            conditions.append('device_id = ?')
+            params.append(device_id)
+        if after_id is not None:
+            conditions.append('id > ?')
+            params.append(after_id)
+        if until_id is not None:
+            conditions.append('id <= ?')
+            params.append(until_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'id' if after_id is not None or until_id is not None else 'timestamp'
+        cursor = self._get_connection().cursor()
+        cursor.row_factory = None
+        cursor.arraysize = chunk_size
+        try:
+            cursor.execute(f'''
+                SELECT timestamp, {', '.join(FEATURE_COLUMNS)}
+                FROM features
+                {where}
+                ORDER BY {order} ASC
+            ''', params)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                yield np.array(rows, dtype=np.float64)
+        finally:
+            cursor.close()
+
+    def get_latest_features(self, device_id=config.DEFAULT_DEVICE_ID):
+        """A device's newest stored feature row (timestamp, FEATURE_COLUMNS...), or None."""
+        conn = self._get_connection()
+        return conn.execute(f'''
+            SELECT timestamp, {', '.join(FEATURE_COLUMNS)} FROM features
+            WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1
+        ''', (device_id,)).fetchone()
+
+    def get_time_range(self, table='sensor_data', device_id=config.DEFAULT_DEVICE_ID):
+        """(oldest, newest) timestamp of a device's rows in sensor_data or features; (None, None) when empty."""
+        if table not in ('sensor_data', 'features'):
+            raise ValueError(f"No per-reading timestamps in {table}")
+        conn = self._get_connection()
+        return tuple(conn.execute(f'SELECT min(timestamp), max(timestamp) FROM {table} WHERE device_id = ?',
+                                  (device_id,)).fetchone())
+
+    def get_max_row_id(self):
+        """Id of the newest sensor_data row (0 when empty)."""
+        conn = self._get_connection()
+        return conn.execute('SELECT coalesce(max(id), 0) FROM sensor_data').fetchone()[0]
+
+    def get_max_feature_id(self):
+        """Id of the newest features row (0 when empty): the training watermark."""
+        conn = self._get_connection()
+        return conn.execute('SELECT coalesce(max(id), 0) FROM features').fetchone()[0]
+
+    def get_history(self, start_time, end_time=None, step=None, device_id=config.DEFAULT_DEVICE_ID):
+        """
+        A device's sensor history between start_time and end_time (epoch seconds).
+        Served from the coarsest tier whose buckets are no wider than step seconds
+        (default: the span split into HISTORY_TARGET_POINTS), falling back to raw rows.
+        Each row: timestamp, samples, <column> (mean), <column>_min, <column>_max.
+        """
+        sql, params = self._history_query(start_time, end_time, step, device_id)
+        return self._get_connection().execute(sql, params).fetchall()
+
+    def _history_query(self, start_time, end_time, step, device_id):
+        """Pick the tier for get_history and return (sql, params)."""
+        now = time.time()
+        if end_time is None:
+            end_time = now
+        if step is None:
+            step = (end_time - start_time) / config.HISTORY_TARGET_POINTS
+
+        # Raw rows and minute buckets expire, so only tiers reaching back to
+        # start_time are candidates; hour and day buckets are always kept.
+        cutoffs = self._retention_cutoffs(now)
+        tiers = [(table, width) for table, width in (('sensor_data', 0),) + ROLLUP_RESOLUTIONS
+                 if cutoffs.get(table) is None or start_time >= cutoffs[table]]
+        suitable = [tier for tier in tiers if tier[1] <= step]
+        table, width = suitable[-1] if suitable else tiers[0]
+
+        if table == 'sensor_data':
+            return _RAW_HISTORY_SQL, (device_id, start_time, end_time)
+        # Include the bucket that contains start_time
+        first_bucket = int(start_time // width) * width
+        return _ROLLUP_HISTORY_SQL[table], (device_id, first_bucket, end_time)
+
+    def _retention_cutoffs(self, now):
+        """Oldest timestamp kept per pruned table (None = keep forever)."""
+        def cutoff(days):
+            return None if days is None else now - days * 24 * 60 * 60
+        return {
+            'sensor_data': cutoff(config.RAW_RETENTION_DAYS),
+            'sensor_rollup_minute': cutoff(config.MINUTE_ROLLUP_RETENTION_DAYS),
+            'predictions': cutoff(config.PREDICTION_RETENTION_DAYS),
+            'features': cutoff(config.FEATURE_RETENTION_DAYS),
+        }
+
+    def run_retention(self):
+        """
+        Delete data past its retention window and reclaim the freed pages.
+        Work is split into short transactions sized to RETENTION_MAX_STEP_MS with
+        a pause between them, so ingestion never waits long for the write lock.
+        Returns the number of rows deleted per table.
+        """
+        if not self._retention_lock.acquire(blocking=False):
+            logger.info("Retention job already running, skipping.")
+            return {}
+        try:
+            deleted = {}
+            for table, cutoff in self._retention_cutoffs(time.time()).items():
+                if cutoff is not None:
+                    deleted[table] = self._prune_table(table, cutoff)
+            freed = self._incremental_vacuum()
+            logger.info(f"Retention finished: deleted {deleted}, reclaimed {freed} pages")
+            return deleted
+        finally:
+            self._retention_lock.release()
+
+    def _prune_table(self, table, cutoff):
+        """Delete rows older than cutoff in adaptive, time-bounded batches."""
+        conn = self._get_connection()
+        budget = config.RETENTION_MAX_STEP_MS / 1000
+        batch = 500
+        total = 0
+        while True:
+            start = time.perf_counter()
+            with conn:
+                count = conn.execute(_PRUNE_SQL[table], (cutoff, batch)).rowcount
+            elapsed = time.perf_counter() - start
+            total += count
+            if count < batch:
+                return total
+
+            # Keep each step close to the time budget
+            if elapsed > budget:
+                batch = max(50, batch // 2)
+            elif elapsed < budget / 2:
+                batch = min(50000, batch * 2)
+            time.sleep(config.RETENTION_STEP_PAUSE_SECONDS)
+
+    def _incremental_vacuum(self):
+        """Return free pages to the filesystem a few at a time."""
+        conn = self._get_connection()
+        budget = config.RETENTION_MAX_STEP_MS / 1000
+        pages = 64
+        freed = 0
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        while free > 0:
+            start = time.perf_counter()
+            # executescript steps the pragma to completion; execute() frees a single page
+            conn.executescript(f'PRAGMA incremental_vacuum({pages});')
+            elapsed = time.perf_counter() - start
+
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                # Not in incremental mode; nothing more can be reclaimed
+                break
+            freed += free - remaining
+            free = remaining
+
+            if elapsed > budget:
+                pages = max(8, pages // 2)
+            elif elapsed < budget / 2:
+                pages = min(4096, pages * 2)
+            time.sleep(config.RETENTION_STEP_PAUSE_SECONDS)
+        return freed
+
+    def _cached_settings(self):
+        """The settings cache ({device_id: {name: value}}), loading user_settings on first use."""
+        settings = self._settings
+        if settings is None:
+            with self._settings_lock:
+                if self._settings is None:
+                    self._settings = self._settings_from_rows(self._get_connection().execute(ALL_SETTINGS_SQL))
+                settings = self._settings
+        return settings
+
+    @staticmethod
+    def _settings_from_rows(rows):
+        settings = {GLOBAL_SETTINGS: {}}
+        for device_id, name, value in rows:
+            settings.setdefault(device_id, {})[name] = value
         return settings
+
+    def get_setting(self, setting_name, default=None, device_id=None):
+        """Get a setting value (served from memory). A device's own value wins over the global one."""
+        settings = self._cached_settings()
+        if device_id is not None and setting_name in settings.get(device_id, {}):
+            return settings[device_id][setting_name]
+        return settings[GLOBAL_SETTINGS].get(setting_name, default)
+
+    def update_setting(self, setting_name, setting_value, device_id=None):
+        """Update or insert a setting (for one device, or globally when device_id is None);
+        listeners are told only if the value changed."""
+        setting_value = str(setting_value)
+        conn = self._get_connection()
+        with conn:
+            conn.execute(UPSERT_SETTING_SQL, (device_id or GLOBAL_SETTINGS, setting_name, setting_value, time.time()))
+        changed = self._store_setting(setting_name, setting_value, device_id)
+        if changed:
+            self._notify_settings_listeners(setting_name, setting_value, device_id)
+
+    def get_all_settings(self, device_id=None):
+        """Get all settings as a dictionary: the global values, overlaid with the device's own."""
+        settings = self._cached_settings()
+        merged = dict(settings[GLOBAL_SETTINGS])
+        if device_id is not None:
+            merged.update(settings.get(device_id, {}))
+        return merged
+
+    def subscribe_settings(self, callback):
+        """Register callback(setting_name, new_value, device_id), called after a setting changes.
+        device_id is None for a global change."""
+        self._settings_listeners.append(callback)
+
+    def unsubscribe_settings(self, callback):
+        if callback in self._settings_listeners:
+            self._settings_listeners.remove(callback)
+
+    def _store_setting(self, setting_name, setting_value, device_id=None):
+        """Put a written value in the cache. Returns True if it differs from before."""
+        scope = device_id or GLOBAL_SETTINGS
+        with self._settings_lock:
+            if self._settings is None:
+                # Nothing cached yet; the next read loads the new value from the table
+                return True
+            changed = self._settings.get(scope, {}).get(setting_name) != setting_value
+            # Copy-on-write so readers never see a dict being mutated
+            settings = dict(self._settings)
+            settings[scope] = dict(settings.get(scope, {}))
+            settings[scope][setting_name] = setting_value
+            self._settings = settings
+            return changed
+
+    def _prime_settings(self, rows):
+        """Fill an empty cache from (device_id, name, value) rows read elsewhere (e.g. asynchronously)."""
+        with self._settings_lock:
+            if self._settings is None:
+                self._settings = self._settings_from_rows(rows)
+
+    def settings_loaded(self):
+        return self._settings is not None
+
+    def _notify_settings_listeners(self, setting_name, setting_value, device_id=None):
+        for callback in list(self._settings_listeners):
+            try:
+                callback(setting_name, setting_value, device_id)
+            except Exception as e:
+                logger.error(f"Settings listener failed for {setting_name}: {e}")
+
+class SensorWriteBuffer:
+    """
+    Group-commit writer for sensor readings.
+    Readings are kept in memory and written with one executemany transaction
+    when the buffer is full or the oldest reading reaches the durability window.
+    Exposes the same insert_sensor_data() signature as DatabaseManager and
+    can be shared by several devices; each flush is still one transaction.
+    """
+    def __init__(self, db_manager, max_rows=config.DB_WRITE_BUFFER_SIZE,
+                 max_delay=config.DB_WRITE_BUFFER_MAX_DELAY_SECONDS):
+        self.db_manager = db_manager
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows = []
+        # Feature store rows, written with the readings
+        self._features = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.running = False
+
+    def start(self):
+        """Start the background flusher that enforces the durability window."""
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write out everything still buffered."""
+        self.running = False
+        self._wakeup.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.max_delay)
+        self.flush()
+
+    def insert_sensor_data(self, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status,
+                           timestamp=None, device_id=config.DEFAULT_DEVICE_ID, quality_flags=None, stored=True):
+        """Buffer a reading; the arrival time is captured now, not at flush.
+        stored=False: count it in the rollups only (dropped by the deadband)."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append((device_id, stored, (timestamp, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level,
+                                                   fan_status, heater_status, quality_flags)))
+            full = len(self._rows) >= self.max_rows
+        if full:
+            # Let the flusher do the I/O so the serial loop never waits on the SD card
+            self._wakeup.set()
+            if not self.running:
+                self.flush()
+
+    def insert_features(self, row, device_id=config.DEFAULT_DEVICE_ID):
+        """Buffer a feature store row; it goes out with the next flush."""
+        with self._lock:
+            self._features.append((device_id, row))
+
+    def pending(self):
+        """Number of readings not yet written."""
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self):
+        """Write all buffered readings in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                feature_rows, self._features = self._features, []
+                self._oldest = None
+            if not rows and not feature_rows:
+                return 0
+            batches = {}
+            unstored = {}
+            features = {}
+            for device_id, stored, row in rows:
+                (batches if stored else unstored).setdefault(device_id, []).append(row)
+            for device_id, row in feature_rows:
+                features.setdefault(device_id, []).append(row)
+            try:
+                self.db_manager.insert_sensor_batches(batches, unstored, features)
+                logger.debug(f"Flushed {len(rows)} buffered readings")
+                return len(rows)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to flush {len(rows)} readings, will retry: {e}")
+                with self._lock:
+                    self._rows = rows + self._rows
+                    self._features = feature_rows + self._features
+                    self._oldest = time.monotonic()
+                return 0
+
+    def _flush_loop(self):
+        while self.running:
+            with self._lock:
+                oldest = self._oldest
+                full = len(self._rows) >= self.max_rows
+            if oldest is None:
+                timeout = self.max_delay
+            else:
+                timeout = max(0.0, oldest + self.max_delay - time.monotonic())
+
+            if full or (oldest is not None and timeout == 0.0):
+                self.flush()
+                continue
+
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
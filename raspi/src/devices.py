@@ -0,0 +1,8 @@
+class PlantDevice:
+    """Everything attached to one plant: its Arduino link, newest readings and automation."""
+    def __init__(self, device_id, ingestor, readings, automation=None):
+        self.device_id = device_id
+        self.ingestor = ingestor
+        # ReadingRingBuffer (or anything with get_latest_reading / get_recent_data)
+        self.readings = readings
+        self.automation = automation
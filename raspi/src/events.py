@@ -0,0 +1,249 @@
+import asyncio
+import collections
+import threading
+import time
+import logging
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# What a full subscriber queue does with the next event
+DROP_OLDEST = 'drop_oldest'   # Make room by discarding the oldest queued event
+DROP_NEWEST = 'drop_newest'   # Discard the incoming event
+COALESCE = 'coalesce'         # Keep only the newest event per (type, device); never fills up
+
+class Event:
+    """Base class of everything published on the EventBus."""
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        fields = ', '.join(f"{k}={v!r}" for k, v in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+class ReadingReceived(Event):
+    """A sensor reading arrived. `reading` has the sensor_data column keys."""
+    def __init__(self, device_id, reading):
+        super().__init__(device_id)
+        self.reading = reading
+
+class FeaturesUpdated(Event):
+    """
+    The FeatureStore folded in a device's newest reading (on the writer thread,
+    after ReadingReceived). `reading` is that reading and `features` the live
+    FEATURE_COLUMNS values it produced, what FeatureStore.latest() now returns.
+    """
+    def __init__(self, device_id, reading, features):
+        super().__init__(device_id)
+        self.reading = reading
+        self.features = features
+
+class ButtonPressed(Event):
+    """The AI (voice report) button was pressed; `reading` came with it."""
+    def __init__(self, device_id, reading):
+        super().__init__(device_id)
+        self.reading = reading
+
+class WateringTriggered(Event):
+    """The manual watering button was pressed; `reading` came with it."""
+    def __init__(self, device_id, reading):
+        super().__init__(device_id)
+        self.reading = reading
+
+class CommandAcked(Event):
+    """ACK:<name>:<value> from the Arduino, e.g. name 'SOIL_THRESH', value '340'."""
+    def __init__(self, device_id, name, value):
+        super().__init__(device_id)
+        self.name = name
+        self.value = value
+
+class DeviceStatus(Event):
+    """STATUS:<status> from the Arduino, e.g. 'FAN_ON'."""
+    def __init__(self, device_id, status):
+        super().__init__(device_id)
+        self.status = status
+
+class ConnectionChanged(Event):
+    """The serial link to a board came up or went down."""
+    def __init__(self, device_id, port, connected):
+        super().__init__(device_id)
+        self.port = port
+        self.connected = connected
+
+class Subscription:
+    """
+    One subscriber: its filter, bounded queue and delivery worker.
+    Inline subscribers run in the publisher's thread and have no queue.
+    """
+    def __init__(self, bus, event_types, callback, device_id=None, maxsize=config.EVENT_QUEUE_SIZE,
+                 policy=DROP_OLDEST, loop=None, inline=False, name=None):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, COALESCE):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.bus = bus
+        self.event_types = event_types
+        self.callback = callback
+        self.device_id = device_id
+        self.maxsize = maxsize
+        self.policy = policy
+        self.loop = loop
+        self.inline = inline
+        self.name = name or getattr(callback, '__qualname__', repr(callback))
+        self.delivered = 0
+        self.dropped = 0
+        self.active = True
+
+        self._queue = collections.OrderedDict() if policy == COALESCE else collections.deque()
+        self._cond = threading.Condition()
+        self._async_wakeup = None
+        self._async_scheduled = False
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._drain_async(), loop)
+        elif not inline:
+            threading.Thread(target=self._drain_thread, daemon=True, name=f"events {self.name}").start()
+
+    def matches(self, event):
+        return isinstance(event, self.event_types) and (self.device_id is None or event.device_id == self.device_id)
+
+    def offer(self, event):
+        """Queue (or, inline, deliver) one event without blocking the publisher."""
+        if self.inline:
+            self._deliver(event)
+            return
+        with self._cond:
+            if not self.active:
+                return
+            if self.policy == COALESCE:
+                key = (type(event), event.device_id)
+                if key in self._queue:
+                    self.dropped += 1
+                    del self._queue[key]
+                self._queue[key] = event
+            else:
+                if len(self._queue) >= self.maxsize:
+                    self.dropped += 1
+                    if self.policy == DROP_NEWEST:
+                        return
+                    self._queue.popleft()
+                self._queue.append(event)
+            if self.loop is None:
+                self._cond.notify()
+                return
+            wake = not self._async_scheduled
+            self._async_scheduled = True
+        if wake:
+            try:
+                self.loop.call_soon_threadsafe(self._wake_async)
+            except RuntimeError:
+                # Subscriber's loop is closed
+                self.active = False
+
+    def close(self):
+        with self._cond:
+            self.active = False
+            self._queue.clear()
+            self._cond.notify()
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._wake_async)
+            except RuntimeError:
+                pass
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _pop(self):
+        if self.policy == COALESCE:
+            return self._queue.popitem(last=False)[1]
+        return self._queue.popleft()
+
+    def _deliver(self, event):
+        try:
+            self.callback(event)
+            self.delivered += 1
+        except Exception as e:
+            logger.error(f"Event subscriber {self.name} failed on {type(event).__name__}: {e}")
+
+    def _drain_thread(self):
+        while True:
+            with self._cond:
+                while self.active and not self._queue:
+                    self._cond.wait()
+                if not self.active:
+                    return
+                event = self._pop()
+            self._deliver(event)
+
+    def _wake_async(self):
+        if self._async_wakeup is not None:
+            self._async_wakeup.set()
+
+    async def _drain_async(self):
+        self._async_wakeup = asyncio.Event()
+        self._async_wakeup.set()
+        while self.active:
+            await self._async_wakeup.wait()
+            self._async_wakeup.clear()
+            with self._cond:
+                self._async_scheduled = False
+            while True:
+                with self._cond:
+                    if not self.active or not self._queue:
+                        break
+                    event = self._pop()
+                try:
+                    result = self.callback(event)
+                    if asyncio.iscoroutine(result):
+                        await result
+                    self.delivered += 1
+                except Exception as e:
+                    logger.error(f"Event subscriber {self.name} failed on {type(event).__name__}: {e}")
+
+class EventBus:
+    """
+    In-process publish/subscribe for readings and device events.
+
+    publish() never blocks: each subscriber has its own bounded queue,
+    drained by its own thread (or, with `loop`, a task on that asyncio loop;
+    the callback may be a coroutine function). When a subscriber falls behind,
+    its policy decides what is lost, so one slow consumer cannot stall the
+    serial reader or the others. `inline=True` runs the callback in the
+    publisher's thread, for handlers that only hand work off.
+    """
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, event_types, callback, device_id=None, maxsize=config.EVENT_QUEUE_SIZE,
+                  policy=DROP_OLDEST, loop=None, inline=False, name=None):
+        """Subscribe to an Event class (or tuple of classes), optionally for one device. Returns the Subscription."""
+        if not isinstance(event_types, tuple):
+            event_types = (event_types,)
+        subscription = Subscription(self, event_types, callback, device_id, maxsize, policy, loop, inline, name)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def publish(self, event):
+        self.published += 1
+        # Copy-on-write list: publishing takes no lock
+        for subscription in self._subscriptions:
+            if subscription.matches(event):
+                subscription.offer(event)
+
+    def stats(self):
+        """Delivered / dropped / queued counts per subscriber."""
+        report = {}
+        for s in self._subscriptions:
+            name = s.name
+            if name in report:
+                name = f"{name} #{sum(1 for n in report if n.startswith(s.name))}"
+            report[name] = {'delivered': s.delivered, 'dropped': s.dropped, 'pending': s.pending()}
+        return report
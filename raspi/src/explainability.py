@@ -2,41 +2,47 @@ import numpy as np
 
 class ExplainabilityModule:
     def __init__(self):
-        pass
+        # (model, features by importance): sklearn recomputes feature_importances_ on every access
+        self._ranking = (None, None)
 
-    def explain_decision(self, model, feature_row, decision_label):
+    def explain_decision(self, model, feature_row, decision_label, feature_names=None):
         """
         Provide a text explanation for why a Model made a decision.
         Uses Feature Importance from Random Forest.
+        feature_row: one-row DataFrame, or a (1, features) array with feature_names.
         """
-        # Get feature importances
-        if not hasattr(model, 'feature_importances_'):
-            return "Model does not support feature importance explanation."
+        # Get feature importances, sorted (once per model)
+        ranked_model, indices = self._ranking
+        if ranked_model is not model:
+            importances = getattr(model, 'feature_importances_', None)
+            if importances is None:
+                return "Model does not support feature importance explanation."
+            indices = np.argsort(importances)[::-1]
+            self._ranking = (model, indices)
 
-        importances = model.feature_importances_
-        feature_names = feature_row.columns
-        
-        # Sort features by importance
-        indices = np.argsort(importances)[::-1]
+        if feature_names is None:
+            feature_names = feature_row.columns
         
         top_feature_idx = indices[0]
         top_feature_name = feature_names[top_feature_idx]
-        top_feature_val = feature_row.iloc[0][top_feature_name]
+        top_feature_val = np.asarray(feature_row)[0, top_feature_idx]
         
         # Simple rule-based string generation based on top factor
         explanation = f"Decision '{decision_label}' was primarily influenced by {top_feature_name} ({top_feature_val:.2f})."
         
-        if top_feature_name == 'soil_moisture':
+        if top_feature_name == 'soil_moisture' or top_feature_name.startswith(('soil_ema', 'soil_mean')):
             if decision_label.startswith("Stress") and top_feature_val < 500: 
                  explanation += " Soil moisture is critically low."
-        elif top_feature_name == 'soil_slope':
+        elif top_feature_name.startswith('soil_slope'):
              explanation += " Rapid change in soil moisture detected."
+        elif top_feature_name == 'hours_since_watering':
+             explanation += f" Last watering was {top_feature_val:.1f} hours ago."
         elif top_feature_name == 'light_intensity':
              if top_feature_val > 600:
                 explanation += " High light intensity causing faster evaporation."
              else:
                 explanation += " Low light conditions affecting plant cycle."
-        elif top_feature_name == 'avg_temp':
+        elif top_feature_name == 'temperature':
              explanation += f" Temperature ({top_feature_val:.1f}C) is a key factor."
              
         return explanation
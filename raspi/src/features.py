@@ -0,0 +1,270 @@
+import collections
+import logging
+import math
+import sqlite3
+import time
+from . import config
+from .database import READING_COLUMN_NAMES, FEATURE_COLUMNS, FEATURE_HORIZONS_MINUTES
+from .validation import SOIL_UNAVAILABLE
+
+logger = logging.getLogger(__name__)
+
+# Positions in a reading row (READING_COLUMNS order)
+_COL = {name: i for i, name in enumerate(READING_COLUMN_NAMES)}
+_TIMESTAMP = _COL['timestamp']
+_SOIL = _COL['soil_moisture_avg']
+_TEMP = _COL['temperature']
+_HUM = _COL['humidity']
+_FLAGS = _COL['quality_flags']
+
+def _missing(value):
+    # None from the serial link, NaN from a step series gap
+    return value is None or value != value
+
+class RollingWindow:
+    """
+    The values of the last `seconds` seconds with running sums, so adding a
+    value and reading the mean, standard deviation or least-squares slope
+    are O(1) (amortised: each value is evicted once). The sums are rebuilt
+    from the window each time it has turned over, so float error cannot
+    pile up and time offsets stay small.
+    """
+    __slots__ = ('seconds', '_items', '_base', '_evicted', 'n', '_x', '_xx', '_t', '_tt', '_tx')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._items = collections.deque()
+        self._base = 0.0
+        self._evicted = 0
+        self.n = 0
+        self._x = self._xx = self._t = self._tt = self._tx = 0.0
+
+    def add(self, t, x):
+        if not self._items:
+            self._base = t
+        self._items.append((t, x))
+        self._accumulate(t, x, 1)
+        cutoff = t - self.seconds
+        while self._items[0][0] <= cutoff:
+            old_t, old_x = self._items.popleft()
+            self._accumulate(old_t, old_x, -1)
+            self._evicted += 1
+        if self._evicted >= len(self._items):
+            self._rebuild()
+
+    def mean(self):
+        return self._x / self.n if self.n else math.nan
+
+    def std(self):
+        if self.n < 2:
+            return 0.0
+        mean = self._x / self.n
+        return math.sqrt(max(0.0, self._xx / self.n - mean * mean))
+
+    def slope(self):
+        """Least-squares change per second (0 until two distinct times)."""
+        denominator = self.n * self._tt - self._t * self._t
+        if self.n < 2 or denominator <= 0:
+            return 0.0
+        return (self.n * self._tx - self._t * self._x) / denominator
+
+    def _accumulate(self, t, x, sign):
+        t -= self._base
+        self.n += sign
+        self._x += sign * x
+        self._xx += sign * x * x
+        self._t += sign * t
+        self._tt += sign * t * t
+        self._tx += sign * t * x
+
+    def _rebuild(self):
+        self._base = self._items[0][0]
+        self._evicted = 0
+        self.n = 0
+        self._x = self._xx = self._t = self._tt = self._tx = 0.0
+        for t, x in self._items:
+            self._accumulate(t, x, 1)
+
+class _Ema:
+    """Exponential moving average for irregular sampling: a gap of dt weighs the new value 1 - exp(-dt / tau)."""
+    __slots__ = ('tau', 'value', 'time')
+
+    def __init__(self, seconds):
+        self.tau = seconds
+        self.value = None
+        self.time = None
+
+    def update(self, t, x):
+        if self.value is None:
+            self.value = x
+        elif t > self.time:
+            self.value += (1 - math.exp((self.time - t) / self.tau)) * (x - self.value)
+        self.time = t
+
+class FeatureState:
+    """
+    One device's FEATURE_COLUMNS, updated in O(1) per reading. Readings
+    without a usable soil value (SOIL_UNAVAILABLE) or with a failed DHT read
+    leave the affected features on their last values instead of skewing them.
+    A watering is a fused soil reading FEATURE_WATERING_DROP_COUNTS below the
+    5-minute mean (higher readings are drier), so it is found the same way in
+    live data and in replayed history.
+    """
+    def __init__(self, watering_drop=config.FEATURE_WATERING_DROP_COUNTS,
+                 watering_cap_hours=config.FEATURE_WATERING_CAP_HOURS):
+        self.watering_drop = watering_drop
+        self.watering_cap_hours = watering_cap_hours
+        seconds = [minutes * 60 for minutes in FEATURE_HORIZONS_MINUTES]
+        self._windows = [RollingWindow(s) for s in seconds]
+        self._soil_emas = [_Ema(s) for s in seconds]
+        self._temp_emas = [_Ema(s) for s in seconds]
+        self._hum_emas = [_Ema(s) for s in seconds]
+        self.soil = None
+        self.temperature = None
+        self.humidity = None
+        self.last_watering = None
+
+    def update(self, row):
+        """
+        Fold in one reading (a row in READING_COLUMNS order). Returns the
+        features in FEATURE_COLUMNS order, or None until a usable soil and
+        DHT reading have been seen.
+        """
+        t = row[_TIMESTAMP]
+        soil = row[_SOIL]
+        flags = row[_FLAGS]
+        if not _missing(soil) and (_missing(flags) or not int(flags) & SOIL_UNAVAILABLE):
+            shortest = self._windows[0]
+            if (shortest.n and shortest.mean() - soil >= self.watering_drop
+                    and (self.last_watering is None or t - self.last_watering >= shortest.seconds)):
+                self.last_watering = t
+            for window, ema in zip(self._windows, self._soil_emas):
+                window.add(t, soil)
+                ema.update(t, soil)
+            self.soil = soil
+
+        temp = row[_TEMP]
+        hum = row[_HUM]
+        if not (_missing(temp) or _missing(hum) or (temp == 0 and hum == 0)):
+            for temp_ema, hum_ema in zip(self._temp_emas, self._hum_emas):
+                temp_ema.update(t, temp)
+                hum_ema.update(t, hum)
+            self.temperature = temp
+            self.humidity = hum
+
+        if self.soil is None or self.temperature is None:
+            return None
+        return self._features(t)
+
+    def _features(self, t):
+        features = [self.soil, self.temperature, self.humidity]
+        for window, soil_ema, temp_ema, hum_ema in zip(self._windows, self._soil_emas, self._temp_emas,
+                                                       self._hum_emas):
+            features += [soil_ema.value, window.mean(), window.std(), window.slope() * 3600,
+                         temp_ema.value, hum_ema.value]
+
+        if self.last_watering is None:
+            features.append(self.watering_cap_hours)
+        else:
+            features.append(min(max(0.0, (t - self.last_watering) / 3600), self.watering_cap_hours))
+
+        # Day/night phase as a point on the circle, so 23:59 and 00:00 are neighbours
+        local = time.localtime(t)
+        angle = 2 * math.pi * (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec) / 86400
+        features += [math.sin(angle), math.cos(angle)]
+        return tuple(features)
+
+class FeatureStore:
+    """
+    Live FeatureStates of every device. The ReadingWriter feeds it every
+    reading (before the deadband) and stores the returned rows in the
+    features table in the same transaction, once per FEATURE_INTERVAL_SECONDS;
+    ModelTrainer trains on those rows and Predictor asks latest() for the
+    same values, so both see identical features and neither recomputes
+    history. Not thread-safe for updates: only the writer thread calls
+    update(); latest() may be called from anywhere.
+    """
+    def __init__(self, db_manager=None, interval=config.FEATURE_INTERVAL_SECONDS):
+        self.db_manager = db_manager
+        self.interval = interval
+        self._states = {}
+        self._latest = {}
+        self._saved = {}
+
+    def update(self, device_id, row):
+        """Fold in one reading; returns the feature row to store (timestamp first) when one is due, else None."""
+        state = self._states.get(device_id)
+        if state is None:
+            state = self._states[device_id] = self._restore(device_id, row[_TIMESTAMP])
+        features = state.update(row)
+        if features is None:
+            return None
+        t = row[_TIMESTAMP]
+        self._latest[device_id] = (t, features)
+        saved = self._saved.get(device_id)
+        if saved is not None and 0 <= t - saved < self.interval:
+            return None
+        self._saved[device_id] = t
+        return (t,) + features
+
+    def latest(self, device_id=config.DEFAULT_DEVICE_ID):
+        """(timestamp, features in FEATURE_COLUMNS order) from the device's newest reading, or None."""
+        return self._latest.get(device_id)
+
+    def backfill(self, device_id=config.DEFAULT_DEVICE_ID, chunk_seconds=24 * 60 * 60):
+        """
+        Compute feature rows for the sensor_data history older than the
+        device's first stored feature row (e.g. recorded before the feature
+        store existed, or imported), replaying it through a fresh FeatureState
+        on the same 5-second grid the live readings arrive on. One transaction
+        per chunk_seconds of history. Returns the number of rows stored.
+        """
+        first_reading, last_reading = self.db_manager.get_time_range('sensor_data', device_id)
+        first_feature, _ = self.db_manager.get_time_range('features', device_id)
+        if first_reading is None:
+            return 0
+        end = first_feature if first_feature is not None else last_reading + 1
+        state = FeatureState()
+        saved = None
+        total = 0
+        start = first_reading
+        while start < end:
+            stop = min(start + chunk_seconds, end)
+            rows = []
+            for row in self.db_manager.get_step_series(start, stop, device_id=device_id).tolist():
+                if _missing(row[_SOIL]):
+                    # The board was offline: no reading would have arrived
+                    continue
+                features = state.update(row)
+                if features is not None and (saved is None or row[_TIMESTAMP] - saved >= self.interval):
+                    saved = row[_TIMESTAMP]
+                    rows.append((saved,) + features)
+            self.db_manager.insert_features(rows, device_id=device_id)
+            total += len(rows)
+            start = stop
+        logger.info(f"Backfilled {total} feature rows for {device_id}")
+        return total
+
+    def _restore(self, device_id, now):
+        """
+        A state warmed up on the stored readings of the longest horizon before
+        `now` (after a restart). With DB_DEADBAND those are held values, so
+        features match an uninterrupted state only to within the deadband
+        tolerances until the longest horizon has passed.
+        """
+        state = FeatureState()
+        if self.db_manager is None:
+            return state
+        try:
+            start = now - max(FEATURE_HORIZONS_MINUTES) * 60
+            for row in self.db_manager.get_step_series(start, now, device_id=device_id).tolist():
+                state.update(row)
+            # The last watering may be older than the replayed window
+            latest = self.db_manager.get_latest_features(device_id)
+            if latest is not None and state.last_watering is None:
+                hours = latest[FEATURE_COLUMNS.index('hours_since_watering') + 1]
+                if hours is not None and hours < state.watering_cap_hours:
+                    state.last_watering = latest[0] - hours * 3600
+        except sqlite3.Error as e:
+            logger.warning(f"Could not restore features for {device_id}, starting fresh: {e}")
+        return state
@@ -1,163 +1,372 @@
+import asyncio
+import binascii
 import serial
+import serial_asyncio
 import json
+import struct
 import time
 import logging
-import threading
 from . import config
+from .persistence import ReadingWriter
+from .ring_buffer import Reading
+from .validation import ReadingValidator
+from .commands import CommandChannel
+from .events import EventBus, ReadingReceived, ButtonPressed, WateringTriggered, CommandAcked, DeviceStatus, ConnectionChanged
 
 logger = logging.getLogger(__name__)
 
+# Binary telemetry frame (see smart_plant_sensors.ino):
+# sync (A5 5A) | version | payload length | payload | CRC16-CCITT, little-endian,
+# over version, length and payload.
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<2sBB')
+# millis, soil1, soil2, soil3, soil_avg, temp (0.1 C), hum (0.1 %), flags
+FRAME_PAYLOAD = struct.Struct('<IHHHHhHB')
+FRAME_CRC = struct.Struct('<H')
+# temp / hum values the firmware sends for a failed DHT read (NaN); decoded as None, like JSON null
+FRAME_TEMP_MISSING = -32768
+FRAME_HUM_MISSING = 0xFFFF
+# Flag bits, lowest first; the names match the JSON keys
+FRAME_FLAGS = ('water_level', 'fan_status', 'heater_status', 'button_pressed', 'watering_triggered')
+
+def frame_crc(data):
+    """CRC16-CCITT (poly 0x1021, init 0xFFFF), as computed by the firmware."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def encode_frame(data):
+    """Build a binary frame from a reading dict with the JSON keys."""
+    flags = 0
+    for bit, name in enumerate(FRAME_FLAGS):
+        if data.get(name):
+            flags |= 1 << bit
+    payload = FRAME_PAYLOAD.pack(
+        data.get('timestamp', 0) & 0xFFFFFFFF,
+        data['soil1'], data['soil2'], data['soil3'], data['soil_avg'],
+        FRAME_TEMP_MISSING if data['temp'] is None else round(data['temp'] * 10),
+        FRAME_HUM_MISSING if data['hum'] is None else round(data['hum'] * 10), flags
+    )
+    body = bytes((FRAME_VERSION, len(payload))) + payload
+    return FRAME_SYNC + body + FRAME_CRC.pack(frame_crc(body))
+
+def decode_frame(frame):
+    """
+    Decode one complete frame (sync bytes included).
+    Returns (reading dict with the JSON keys, None) or (None, error message).
+    """
+    _, version, length = FRAME_HEADER.unpack_from(frame)
+    (crc,) = FRAME_CRC.unpack_from(frame, FRAME_HEADER.size + length)
+    if crc != frame_crc(frame[2:FRAME_HEADER.size + length]):
+        return None, "CRC mismatch"
+    if version != FRAME_VERSION or length != FRAME_PAYLOAD.size:
+        return None, f"unsupported frame version {version} / length {length}"
+    millis, soil1, soil2, soil3, soil_avg, temp10, hum10, flags = FRAME_PAYLOAD.unpack_from(frame, FRAME_HEADER.size)
+    data = {
+        'timestamp': millis, 'soil1': soil1, 'soil2': soil2, 'soil3': soil3, 'soil_avg': soil_avg,
+        'temp': None if temp10 == FRAME_TEMP_MISSING else temp10 / 10,
+        'hum': None if hum10 == FRAME_HUM_MISSING else hum10 / 10,
+    }
+    for bit, name in enumerate(FRAME_FLAGS):
+        data[name] = (flags >> bit) & 1
+    return data, None
+
+class SerialStreamProtocol(asyncio.Protocol):
+    """
+    Splits incoming bytes into text lines and binary frames and hands each one
+    to DataIngestion as soon as it is complete. Text from the firmware is ASCII,
+    so the 0xA5 sync byte never occurs inside a line.
+    """
+    def __init__(self, ingestion):
+        self.ingestion = ingestion
+        self.buffer = bytearray()
+        # Resolved when the port closes or fails
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.ingestion.connection_made(transport)
+
+    def data_received(self, data):
+        self.ingestion.bytes_received += len(data)
+        buffer = self.buffer
+        buffer.extend(data)
+        while buffer:
+            if buffer[0] == FRAME_SYNC[0]:
+                if len(buffer) < FRAME_HEADER.size:
+                    break
+                if buffer[1] != FRAME_SYNC[1]:
+                    # Lone sync byte (noise): skip it
+                    del buffer[0]
+                    continue
+                size = FRAME_HEADER.size + buffer[3] + FRAME_CRC.size
+                if len(buffer) < size:
+                    break
+                data, error = decode_frame(bytes(buffer[:size]))
+                if error:
+                    # Resync on the next sync pattern after this one
+                    del buffer[:len(FRAME_SYNC)]
+                    self.ingestion.frame_error(error)
+                else:
+                    del buffer[:size]
+                    self.ingestion.handle_frame(data)
+                continue
+
+            # Text runs up to the newline, or up to a frame that interrupted it
+            end = buffer.find(b'\n')
+            sync = buffer.find(FRAME_SYNC[:1])
+            if sync >= 0 and (end < 0 or sync < end):
+                # Usually the tail of a corrupted frame
+                logger.debug(f"Skipping {sync} bytes before a frame from {self.ingestion.port}")
+                del buffer[:sync]
+                continue
+            if end < 0:
+                if len(buffer) > config.SERIAL_MAX_LINE_BYTES:
+                    logger.warning(f"Dropping {len(buffer)} bytes without a newline from {self.ingestion.port}")
+                    buffer.clear()
+                break
+            line = buffer[:end].decode('utf-8', errors='replace').strip()
+            del buffer[:end + 1]
+            if line:
+                self.ingestion.handle_line(line)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
 class DataIngestion:
-    def __init__(self, db_manager):
+    """
+    Event-driven serial reader for one Arduino. start_listening() runs an asyncio
+    loop in the calling thread: the serial transport wakes it only when bytes
+    arrive, so there is no polling delay and no CPU use while idle.
+    Lost or missing ports are retried with exponential backoff.
+    Readings arrive as JSON lines or, once negotiated with PROTO_BIN, as
+    CRC-checked binary frames. Readings, button presses, ACK:/STATUS: lines and
+    connection changes are published on `events`.
+    """
+    def __init__(self, db_manager, recent_readings=None, device_id=config.DEFAULT_DEVICE_ID, port=config.SERIAL_PORT,
+                 writer=None, event_bus=None):
         self.db_manager = db_manager
-        self.serial_connection = None
+        # The plant this Arduino belongs to, and the serial port it is on
+        self.device_id = device_id
+        self.port = port
+        # Optional ReadingRingBuffer kept current as readings arrive
+        self.recent_readings = recent_readings
+        # Shared with the other readers when given
+        self.events = event_bus if event_bus is not None else EventBus()
+        # Acknowledged commands (settings sync, bot actions)
+        self.commands = CommandChannel(self)
+        # Soil probe checks and fusion; every reading gets quality flags
+        self.validator = ReadingValidator(device_id)
         self.running = False
-        self._write_lock = threading.Lock()
-    
-    def connect_serial(self):
-        """Attempt to connect to the serial port."""
-        try:
-            self.serial_connection = serial.Serial(
-                config.SERIAL_PORT, 
-                config.BAUD_RATE, 
-                timeout=1
-            )
-            logger.info(f"Connected to {config.SERIAL_PORT}")
-            return True
-        except serial.SerialException as e:
-            logger.error(f"Failed to connect to serial port: {e}")
-            return False
+        self.loop = None
+        self._transport = None
+        self._stop_event = None
+        # Telemetry format negotiation (per connection)
+        self.binary_frames = False
+        self._proto_attempts = 0
+        self._proto_requested_at = 0.0
+        self.frames_received = 0
+        self.frames_corrupted = 0
+        # Throughput counters (see IngestionSupervisor.stats)
+        self.readings_received = 0
+        self.bytes_received = 0
+        # Persistence stage: readings are queued here and committed on the writer's thread.
+        # A writer passed in is shared with other readers and managed by its owner.
+        self._owns_writer = writer is None
+        self.writer = ReadingWriter(db_manager, events=self.events) if writer is None else writer
 
     def start_listening(self):
-        """Main loop to read from serial and save to DB."""
+        """Read from serial and save to DB until stop(). Blocks; run it in its own thread."""
+        asyncio.run(self.run())
+
+    async def run(self):
+        """Connect, read until the port goes away, reconnect with backoff."""
         self.running = True
-        logger.info("Started listening for sensor data thread...")
-        
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        logger.info(f"Started listening for sensor data ({self.device_id})...")
+        if self._owns_writer:
+            self.writer.start()
+
+        delay = config.SERIAL_RECONNECT_MIN_SECONDS
         while self.running:
-            # 1. Ensure serial is connected
-            if not self.serial_connection or not self.serial_connection.is_open:
-                logger.info(f"Attempting to connect to serial port {config.SERIAL_PORT}...")
-                if self.connect_serial():
-                    logger.info("Successfully connected/reconnected to serial.")
-                else:
-                    logger.error(f"Failed to connect to {config.SERIAL_PORT}. Retrying in 5 seconds...")
-                    time.sleep(5)
-                    continue
+            logger.info(f"Attempting to connect to serial port {self.port}...")
+            try:
+                transport, protocol = await serial_asyncio.create_serial_connection(
+                    self.loop, lambda: SerialStreamProtocol(self), self.port, baudrate=config.BAUD_RATE
+                )
+            except (serial.SerialException, OSError) as e:
+                logger.error(f"Failed to connect to {self.port}: {e}. Retrying in {delay:.1f} seconds...")
+                await self._wait_for_stop(delay)
+                delay = min(delay * 2, config.SERIAL_RECONNECT_MAX_SECONDS)
+                continue
 
-            # 2. Read data
+            logger.info(f"Connected to {self.port} ({self.device_id})")
+            delay = config.SERIAL_RECONNECT_MIN_SECONDS
+            stop_wait = asyncio.ensure_future(self._stop_event.wait())
             try:
-                if self.serial_connection.in_waiting > 0:
-                    line = self.serial_connection.readline().decode('utf-8', errors='replace').strip()
-                    if line:
-                        logger.debug(f"Raw serial data: {line}")
-                        
-                        # Handle Command ACKs
-                        if line.startswith("ACK:") or line.startswith("STATUS:"):
-                            logger.info(f">>> Arduino Feedback: {line}")
-                            continue
-
-                        try:
-                            data = json.loads(line)
-                            logger.debug(f"JSON parsed: {data}")
-                            
-                            soil1 = data.get('soil1', 0)
-                            soil2 = data.get('soil2', 0)
-                            soil3 = data.get('soil3', 0)
-                            soil_avg = data.get('soil_avg', 0)
-                            temp = data.get('temp', 0)
-                            hum = data.get('hum', 0)
-                            water_level = data.get('water_level', 0)
-                            fan_status = data.get('fan_status', 0)
-                            heater_status = data.get('heater_status', 0)
-                            button_pressed = data.get('button_pressed', 0)
-                            watering_triggered = data.get('watering_triggered', 0)
-                            
-                            if soil1 is not None and temp is not None:
-                                self.db_manager.insert_sensor_data(
-                                    soil1, soil2, soil3, soil_avg, 
-                                    temp, hum, 0, water_level, 
-                                    fan_status, heater_status
-                                )
-                                logger.debug(f"Saved reading: T={temp}, S1={soil1}")
-                                
-                                # Trigger button callback if button was pressed
-                                if button_pressed == 1 and hasattr(self, 'on_button_pressed_callback'):
-                                    logger.info("AI Button press detected! Triggering callback.")
-                                    self.on_button_pressed_callback()
-                                
-                                # Trigger watering callback
-                                if watering_triggered == 1 and hasattr(self, 'on_watering_triggered_callback'):
-                                    logger.info("Watering trigger detected! Triggering callback.")
-                                    self.on_watering_triggered_callback()
-                        except json.JSONDecodeError:
-                            if not (line.startswith("ACK:") or line.startswith("STATUS:")):
-                                logger.warning(f"Received malformed JSON-like data: {line}")
-            except serial.SerialException as e:
-                logger.error(f"Serial error: {e}. Attempting reconnect...")
-                try:
-                    self.serial_connection.close()
-                except:
-                    pass
-                time.sleep(5)
-                # Next iteration will handle reconnection
-            except Exception as e:
-                logger.error(f"Unexpected error in ingestion loop: {e}")
-            
-            time.sleep(config.DATA_READ_INTERVAL_SECONDS)
+                await asyncio.wait([protocol.closed, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_wait.cancel()
+                self._transport = None
+                transport.close()
+                self.events.publish(ConnectionChanged(self.device_id, self.port, False))
+            if self.running:
+                error = protocol.closed.result() if protocol.closed.done() else None
+                logger.error(f"Serial connection to {self.port} lost ({error}). Reconnecting...")
 
-    def write_command(self, command):
-        """Writes a command string to the serial port."""
-        with self._write_lock:
-            if self.serial_connection and self.serial_connection.is_open:
-                try:
-                    # Encode string to bytes and add newline
-                    self.serial_connection.write(f"{command}\n".encode('utf-8'))
-                    self.serial_connection.flush() # Ensure it's sent
-                    logger.info(f"Sent command to Arduino: {command}")
-                    return True
-                except Exception as e:
-                    logger.error(f"Failed to write command '{command}': {e}")
-                    return False
-            else:
-                logger.warning(f"Serial connection to {config.SERIAL_PORT} not open. Cannot send command: {command}")
-                return False
+    async def _wait_for_stop(self, timeout):
+        """Sleep for timeout seconds, waking early if stop() is called."""
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def connected(self):
+        return self._transport is not None and not self._transport.is_closing()
+
+    def connection_made(self, transport):
+        """A (re)connected Arduino always starts in JSON mode."""
+        self._transport = transport
+        self.binary_frames = False
+        self._proto_attempts = 0
+        self.events.publish(ConnectionChanged(self.device_id, self.port, True))
+        self._request_binary_frames()
+
+    def _request_binary_frames(self):
+        if not config.SERIAL_BINARY_FRAMES or self._proto_attempts >= config.SERIAL_PROTOCOL_MAX_ATTEMPTS:
+            return
+        self._proto_attempts += 1
+        self._proto_requested_at = time.monotonic()
+        self.write_command("PROTO_BIN")
+
+    def handle_line(self, line):
+        """Process one line from the Arduino: a JSON reading or command feedback."""
+        logger.debug(f"Raw serial data: {line}")
+
+        if line == "ACK:PROTO:BIN" or line == "ACK:PROTO:JSON":
+            self.binary_frames = line.endswith("BIN")
+            logger.info(f"Telemetry format on {self.port}: {'binary frames' if self.binary_frames else 'JSON'}")
+
+        # Handle Command ACKs
+        if line.startswith("ACK:"):
+            logger.info(f">>> Arduino Feedback: {line}")
+            name, _, value = line[4:].partition(':')
+            self.events.publish(CommandAcked(self.device_id, name, value))
+            return
+        if line.startswith("STATUS:"):
+            logger.info(f">>> Arduino Feedback: {line}")
+            self.events.publish(DeviceStatus(self.device_id, line[7:]))
+            return
 
-    def send_settings_to_arduino(self, settings):
-        """Send all relevant settings to Arduino."""
         try:
-            # Send threshold settings
-            self.write_command(f"SET_SOIL_THRESH:{settings.get('soil_threshold', 340)}")
-            time.sleep(0.1)
-            self.write_command(f"SET_FAN_TEMP:{settings.get('fan_temp_threshold', 28.0)}")
-            time.sleep(0.1)
-            self.write_command(f"SET_HEATER_TEMP:{settings.get('heater_temp_threshold', 20.0)}")
-            time.sleep(0.1)
-            
-            # Send automation flags
-            if settings.get('auto_water_enabled') == '1':
-                self.write_command("AUTO_WATER_ON")
-            else:
-                self.write_command("AUTO_WATER_OFF")
-            time.sleep(0.1)
-            
-            if settings.get('auto_fan_enabled') == '1':
-                self.write_command("AUTO_FAN_ON")
-            else:
-                self.write_command("AUTO_FAN_OFF")
-            time.sleep(0.1)
-            
-            if settings.get('auto_heater_enabled') == '1':
-                self.write_command("AUTO_HEATER_ON")
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"Received malformed JSON-like data: {line}")
+            return
+        logger.debug(f"JSON parsed: {data}")
+
+        # Still JSON: the request was lost (e.g. sent while the Arduino was resetting) or is unsupported
+        if not self.binary_frames and config.SERIAL_BINARY_FRAMES \
+                and time.monotonic() - self._proto_requested_at >= config.SERIAL_PROTOCOL_RETRY_SECONDS:
+            if self._proto_attempts >= config.SERIAL_PROTOCOL_MAX_ATTEMPTS:
+                if self._proto_attempts == config.SERIAL_PROTOCOL_MAX_ATTEMPTS:
+                    logger.info(f"Arduino on {self.port} does not answer PROTO_BIN; staying on JSON")
+                    self._proto_attempts += 1
             else:
-                self.write_command("AUTO_HEATER_OFF")
-            
-            logger.info("Settings synced to Arduino")
-            return True
+                self._request_binary_frames()
+
+        try:
+            self._handle_reading(data)
+        except Exception as e:
+            logger.error(f"Unexpected error handling reading: {e}")
+
+    def handle_frame(self, data):
+        """Process one decoded binary frame."""
+        self.frames_received += 1
+        try:
+            self._handle_reading(data)
         except Exception as e:
-            logger.error(f"Failed to send settings to Arduino: {e}")
+            logger.error(f"Unexpected error handling reading: {e}")
+
+    def frame_error(self, error):
+        self.frames_corrupted += 1
+        logger.warning(f"Corrupted telemetry frame from {self.port} ({error}), resyncing")
+
+    def _handle_reading(self, data):
+        soil1 = data.get('soil1', 0)
+        soil2 = data.get('soil2', 0)
+        soil3 = data.get('soil3', 0)
+        soil_avg = data.get('soil_avg', 0)
+        temp = data.get('temp', 0)
+        hum = data.get('hum', 0)
+        water_level = data.get('water_level', 0)
+        fan_status = data.get('fan_status', 0)
+        heater_status = data.get('heater_status', 0)
+        button_pressed = data.get('button_pressed', 0)
+        watering_triggered = data.get('watering_triggered', 0)
+
+        if soil1 is None or temp is None:
+            return
+
+        timestamp = time.time()
+        self.readings_received += 1
+        # The Arduino's plain mean is replaced by the fusion of the probes that look healthy
+        soil_avg, quality_flags = self.validator.validate((soil1, soil2, soil3), soil_avg, temp, hum)
+        reading = Reading((
+            timestamp, soil1, soil2, soil3, soil_avg,
+            temp, hum, 0, water_level, fan_status, heater_status, quality_flags
+        ))
+        if self.recent_readings is not None:
+            self.recent_readings.append(reading)
+
+        # Events go out before the reading is queued for the database
+        if button_pressed == 1:
+            logger.info("AI Button press detected!")
+            self.events.publish(ButtonPressed(self.device_id, reading))
+
+        if watering_triggered == 1:
+            logger.info("Watering trigger detected!")
+            self.events.publish(WateringTriggered(self.device_id, reading))
+
+        self.events.publish(ReadingReceived(self.device_id, reading))
+
+        self.writer.insert_sensor_data(
+            soil1, soil2, soil3, soil_avg,
+            temp, hum, 0, water_level,
+            fan_status, heater_status,
+            timestamp=timestamp,
+            device_id=self.device_id,
+            quality_flags=quality_flags
+        )
+
+    def write_command(self, command):
+        """Queue a command string for the serial port (safe to call from any thread)."""
+        transport = self._transport
+        if transport is None or transport.is_closing():
+            logger.warning(f"Serial connection to {self.port} not open. Cannot send command: {command}")
+            return False
+        try:
+            # The transport belongs to the reader loop; writes from other threads are handed over to it
+            self.loop.call_soon_threadsafe(transport.write, f"{command}\n".encode('utf-8'))
+            logger.info(f"Sent command to Arduino: {command}")
+            return True
+        except RuntimeError as e:
+            logger.error(f"Failed to write command '{command}': {e}")
             return False
 
+    def send_settings_to_arduino(self, settings):
+        """Send all relevant settings to Arduino without blocking. Returns a Future that resolves to True once acknowledged."""
+        return self.commands.sync_settings(settings)
+
     def stop(self):
         self.running = False
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
+        if self.loop is not None and self._stop_event is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                # Loop already finished
+                pass
+        if self._owns_writer:
+            # Guaranteed flush so nothing queued or inside the durability window is lost
+            self.writer.stop()
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import time
+import logging
+from . import config
+from .database import READING_COLUMN_NAMES, INSERT_PREDICTION_SQL, write_readings
+
+logger = logging.getLogger(__name__)
+
+# Where each current sensor_data column comes from in older schemas, in order of
+# preference. The first candidate present in the legacy table is used; columns
+# with no candidate are imported as NULL (for quality_flags: never validated).
+# (plant_data.db / plant_data_v2.db had a single soil probe and an LM35, which
+# maps onto probe 1 and the average.)
+_COLUMN_SOURCES = {
+    'timestamp': ('timestamp',),
+    'soil_moisture_1': ('soil_moisture_1', 'soil_moisture'),
+    'soil_moisture_2': ('soil_moisture_2',),
+    'soil_moisture_3': ('soil_moisture_3',),
+    'soil_moisture_avg': ('soil_moisture_avg', 'soil_moisture'),
+    'temperature': ('temperature', 'temperature_lm35'),
+    'humidity': ('humidity',),
+    'light_intensity': ('light_intensity',),
+    'water_level': ('water_level',),
+    'fan_status': ('fan_status',),
+    'heater_status': ('heater_status',),
+    'quality_flags': ('quality_flags',),
+}
+
+_PREDICTION_COLUMNS = ('timestamp', 'prediction', 'explanation')
+
+def _insert_readings(conn, device_id, rows):
+    write_readings(conn, device_id, rows)
+
+def _insert_predictions(conn, device_id, rows):
+    conn.executemany(INSERT_PREDICTION_SQL, [(device_id,) + tuple(row) for row in rows])
+
+def _table_columns(src, table):
+    return {row[1] for row in src.execute(f'PRAGMA table_info({table})')}
+
+def import_legacy_database(db_manager, path, batch_size=config.LEGACY_IMPORT_BATCH_SIZE,
+                           device_id=config.DEFAULT_DEVICE_ID):
+    """
+    Stream sensor_data and predictions from an older database file into the
+    current schema as device_id's data, batch_size rows per transaction. Progress is recorded per
+    source table in legacy_imports, so re-running resumes where it stopped and
+    never imports a row twice. Returns the rows imported per table.
+    """
+    source = os.path.realpath(path)
+    if source == os.path.realpath(db_manager.db_path):
+        raise ValueError("Cannot import the live database into itself")
+
+    db_manager.register_device(device_id)
+    src = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    try:
+        tables = {row[0] for row in src.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        imported = {}
+
+        if 'sensor_data' in tables:
+            columns = _table_columns(src, 'sensor_data')
+            if 'timestamp' in columns:
+                expressions = []
+                for name in READING_COLUMN_NAMES:
+                    found = [c for c in _COLUMN_SOURCES[name] if c in columns]
+                    expressions.append(found[0] if found else 'NULL')
+                imported['sensor_data'] = _copy_table(
+                    db_manager, src, source, 'sensor_data', expressions, _insert_readings, batch_size, device_id)
+
+        if 'predictions' in tables and set(_PREDICTION_COLUMNS) <= _table_columns(src, 'predictions'):
+            imported['predictions'] = _copy_table(
+                db_manager, src, source, 'predictions', _PREDICTION_COLUMNS, _insert_predictions, batch_size, device_id)
+
+        if not imported:
+            logger.warning(f"No importable tables in {source}")
+        return imported
+    finally:
+        src.close()
+
+def _copy_table(db_manager, src, source, table, expressions, insert, batch_size, device_id):
+    conn = db_manager._get_connection()
+    row = conn.execute('''
+        SELECT last_source_id, rows_imported FROM legacy_imports
+        WHERE source = ? AND source_table = ?
+    ''', (source, table)).fetchone()
+    last_id, total = (row[0], row[1]) if row else (0, 0)
+
+    cursor = src.execute(f'''
+        SELECT id, {', '.join(expressions)}
+        FROM {table}
+        WHERE id > ? AND timestamp IS NOT NULL
+        ORDER BY id ASC
+    ''', (last_id,))
+
+    imported = 0
+    started = time.perf_counter()
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        rows = [r[1:] for r in batch]
+        # Rows and the progress marker commit together, so a crash can't duplicate a batch
+        with conn:
+            insert(conn, device_id, rows)
+            conn.execute('''
+                INSERT OR REPLACE INTO legacy_imports (source, source_table, last_source_id, rows_imported, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (source, table, last_id, total + imported + len(rows), time.time()))
+        imported += len(rows)
+
+    elapsed = time.perf_counter() - started
+    if imported:
+        logger.info(f"Imported {imported} {table} rows from {source} in {elapsed:.1f}s "
+                    f"({imported / max(elapsed, 1e-9):.0f} rows/s)")
+    return imported
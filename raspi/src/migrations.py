@@ -0,0 +1,243 @@
+import time
+import logging
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Ordered schema migrations: (version, description, function(cursor)).
+# Append new steps with the next version number; never edit an applied one.
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register a schema migration step."""
+    def register(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+def get_schema_version(conn):
+    """Highest applied migration (0 for a fresh or unversioned file)."""
+    row = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone()
+    if not row:
+        return 0
+    return conn.execute('SELECT coalesce(max(version), 0) FROM schema_version').fetchone()[0]
+
+def apply_migrations(conn):
+    """Run every pending migration, each in its own transaction. Returns the schema version."""
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at REAL
+            )
+        ''')
+    current = get_schema_version(conn)
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Applying schema migration {version}: {description}")
+        # Explicit BEGIN: sqlite3 would otherwise autocommit DDL statement by statement
+        conn.execute('BEGIN')
+        try:
+            func(conn.cursor())
+            conn.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                         (version, description, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+# Versions 1-3 use IF NOT EXISTS because databases created before versioning
+# already contain some of these objects.
+
+# sensor_data reading columns before quality_flags (version 6); the covering
+# indexes of versions 2 and 5 are built on exactly these
+_READING_COLUMNS_V1 = (
+    'timestamp, soil_moisture_1, soil_moisture_2, soil_moisture_3, soil_moisture_avg, '
+    'temperature, humidity, light_intensity, water_level, fan_status, heater_status'
+)
+
+@migration(1, "Base tables: sensor_data, predictions, user_settings")
+def _base_tables(cursor):
+    # Sensor data table with 3 soil sensors
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL,
+            soil_moisture_1 INTEGER,
+            soil_moisture_2 INTEGER,
+            soil_moisture_3 INTEGER,
+            soil_moisture_avg INTEGER,
+            temperature REAL,
+            humidity REAL,
+            light_intensity INTEGER,
+            water_level INTEGER,
+            fan_status INTEGER,
+            heater_status INTEGER
+        )
+    ''')
+
+    # Predictions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL,
+            prediction TEXT,
+            explanation TEXT
+        )
+    ''')
+
+    # Settings table for user preferences
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            setting_name TEXT UNIQUE,
+            setting_value TEXT,
+            last_updated REAL
+        )
+    ''')
+
+@migration(2, "Timestamp indexes (covering index for the reading queries)")
+def _timestamp_indexes(cursor):
+    # Covering index for the reading queries: timestamp leads so ORDER BY
+    # timestamp DESC LIMIT n and time-range scans walk the index, and every
+    # selected column is included so get_latest_reading never visits the table.
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_sensor_data_timestamp_covering
+        ON sensor_data ({_READING_COLUMNS_V1})
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_predictions_timestamp
+        ON predictions (timestamp)
+    ''')
+
+@migration(3, "Minute / hour / day rollup tables")
+def _rollup_tables(cursor):
+    # Per-bucket min / max / sum for every sensor column,
+    # maintained incrementally by insert_sensor_data_many().
+    value_cols = ', '.join(f'{c}_min REAL, {c}_max REAL, {c}_sum REAL' for c in database.ROLLUP_COLUMNS)
+    for table, _ in database.ROLLUP_RESOLUTIONS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket INTEGER PRIMARY KEY,
+                samples INTEGER NOT NULL,
+                {value_cols}
+            )
+        ''')
+    # Filled by migration 5, which rebuilds these tables per device
+
+@migration(4, "Progress of bulk imports from legacy database files")
+def _legacy_imports(cursor):
+    cursor.execute('''
+        CREATE TABLE legacy_imports (
+            source TEXT NOT NULL,
+            source_table TEXT NOT NULL,
+            last_source_id INTEGER NOT NULL,
+            rows_imported INTEGER NOT NULL,
+            updated_at REAL,
+            PRIMARY KEY (source, source_table)
+        )
+    ''')
+
+@migration(5, "Device identity on readings, predictions, settings and rollups")
+def _devices(cursor):
+    cursor.execute('''
+        CREATE TABLE devices (
+            device_id TEXT PRIMARY KEY,
+            port TEXT,
+            created_at REAL
+        )
+    ''')
+    # Existing rows belong to the original single plant
+    cursor.execute("ALTER TABLE sensor_data ADD COLUMN device_id TEXT NOT NULL DEFAULT 'default'")
+    cursor.execute("ALTER TABLE predictions ADD COLUMN device_id TEXT NOT NULL DEFAULT 'default'")
+    cursor.execute('INSERT INTO devices (device_id, created_at) SELECT DISTINCT device_id, ? FROM sensor_data',
+                   (time.time(),))
+
+    # Per-plant queries lead with device_id; retention still scans by timestamp
+    cursor.execute('DROP INDEX IF EXISTS idx_sensor_data_timestamp_covering')
+    cursor.execute(f'''
+        CREATE INDEX idx_sensor_data_device_covering
+        ON sensor_data (device_id, {_READING_COLUMNS_V1})
+    ''')
+    cursor.execute('CREATE INDEX idx_sensor_data_timestamp ON sensor_data (timestamp)')
+    cursor.execute('CREATE INDEX idx_predictions_device ON predictions (device_id, timestamp)')
+
+    # Settings are keyed by (device_id, setting_name); device_id '' holds the global values
+    cursor.execute('''
+        CREATE TABLE user_settings_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL DEFAULT '',
+            setting_name TEXT NOT NULL,
+            setting_value TEXT,
+            last_updated REAL,
+            UNIQUE (device_id, setting_name)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO user_settings_new (device_id, setting_name, setting_value, last_updated)
+        SELECT '', setting_name, setting_value, last_updated FROM user_settings
+    ''')
+    cursor.execute('DROP TABLE user_settings')
+    cursor.execute('ALTER TABLE user_settings_new RENAME TO user_settings')
+
+    # Rollups are kept per device: rebuild them keyed by (device_id, bucket)
+    value_cols = ', '.join(f'{c}_min REAL, {c}_max REAL, {c}_sum REAL' for c in database.ROLLUP_COLUMNS)
+    for table, width in database.ROLLUP_RESOLUTIONS:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+        cursor.execute(f'''
+            CREATE TABLE {table} (
+                device_id TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                {value_cols},
+                PRIMARY KEY (device_id, bucket)
+            )
+        ''')
+        # For the retention job, which prunes by age across all devices
+        cursor.execute(f'CREATE INDEX idx_{table}_bucket ON {table} (bucket)')
+        database.backfill_rollup(cursor, table, width)
+
+@migration(6, "Validation flags on readings")
+def _quality_flags(cursor):
+    # Bits from src/validation.py; NULL on rows recorded before validation
+    cursor.execute('ALTER TABLE sensor_data ADD COLUMN quality_flags INTEGER')
+    # The covering index must include the new column
+    cursor.execute('DROP INDEX idx_sensor_data_device_covering')
+    cursor.execute(f'''
+        CREATE INDEX idx_sensor_data_device_covering
+        ON sensor_data (device_id, {_READING_COLUMNS_V1}, quality_flags)
+    ''')
+
+@migration(7, "Feature store")
+def _features(cursor):
+    # Rows of src/features.py, one per device every FEATURE_INTERVAL_SECONDS; training reads these
+    value_cols = ', '.join(f'{c} REAL' for c in database.FEATURE_COLUMNS)
+    cursor.execute(f'''
+        CREATE TABLE features (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            {value_cols}
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_features_device ON features (device_id, timestamp)')
+    # For the retention job, which prunes by age across all devices
+    cursor.execute('CREATE INDEX idx_features_timestamp ON features (timestamp)')
+
+@migration(8, "Non-NULL value counts in the rollup tables")
+def _rollup_counts(cursor):
+    # Means divide by these rather than by samples, so NULL values (failed DHT
+    # reads) do not pull them toward 0. Existing buckets only tell whether a
+    # column had any value (min is NULL otherwise); assume all of them had.
+    for table, _ in database.ROLLUP_RESOLUTIONS:
+        for c in database.ROLLUP_COLUMNS:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {c}_count INTEGER')
+        counts = ', '.join(f'{c}_count = CASE WHEN {c}_min IS NULL THEN 0 ELSE samples END'
+                           for c in database.ROLLUP_COLUMNS)
+        cursor.execute(f'UPDATE {table} SET {counts}')
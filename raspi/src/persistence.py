@@ -0,0 +1,266 @@
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from . import config
+from .database import SensorWriteBuffer, READING_COLUMN_NAMES
+from .events import FeaturesUpdated
+from .features import FeatureStore
+from .ring_buffer import Reading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class Deadband:
+    """
+    Change-only filter for one or more devices' readings. A reading is kept
+    when any value differs from the device's last kept reading by more than
+    its tolerance (0 = any change; a value appearing or disappearing always
+    counts), or when `heartbeat` seconds have passed since it. Comparing with
+    the last kept reading, not the previous one, means slow drift is stored
+    once it adds up to the tolerance, so a step series rebuilt from the kept
+    rows is never off by more than that.
+    """
+    def __init__(self, tolerances=config.DB_DEADBAND, heartbeat=config.DB_DEADBAND_HEARTBEAT_SECONDS):
+        unknown = set(tolerances) - set(READING_COLUMN_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown sensor columns in deadband: {sorted(unknown)}")
+        self.heartbeat = heartbeat
+        # One tolerance per value column, in row order (timestamp excluded)
+        self._tolerances = [tolerances.get(name, 0) for name in READING_COLUMN_NAMES[1:]]
+        self._last = {}
+        self.kept = 0
+        self.suppressed = 0
+
+    def keep(self, device_id, row):
+        """Whether to store this reading (a row in READING_COLUMNS order)."""
+        last = self._last.get(device_id)
+        if last is None or not 0 <= row[0] - last[0] < self.heartbeat or self._moved(last, row):
+            self._last[device_id] = row
+            self.kept += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def _moved(self, last, row):
+        for tolerance, old, new in zip(self._tolerances, last[1:], row[1:]):
+            if old is None or new is None:
+                if (old is None) != (new is None):
+                    return True
+            elif abs(new - old) > tolerance:
+                return True
+        return False
+
+class ReadingWriter:
+    """
+    Persistence stage of ingestion: serial readers hand readings over through
+    a bounded queue and a writer thread commits them, so reading the port
+    never waits on the SD card. Whatever piled up while a write ran goes into
+    the next transaction. When the queue is full the reading is dropped (and
+    counted) rather than stalling the reader; the ring buffer and event bus
+    have already seen it.
+
+    Exposes the same insert_sensor_data() signature as DatabaseManager and can
+    be shared by several readers. With DB_WRITE_BUFFER_ENABLED the rows go
+    through a SensorWriteBuffer and its durability window. With
+    DB_DEADBAND_ENABLED only readings that changed reach sensor_data (every
+    reading still counts in the rollups). Every reading also updates the
+    FeatureStore (`features`), whose rows are written in the same transaction;
+    with an `events` bus, FeaturesUpdated is published once the store has seen
+    a device's newest reading, so consumers never read features a reading behind.
+    """
+    def __init__(self, db_manager, maxsize=config.INGESTION_QUEUE_SIZE, batch_size=config.INGESTION_WRITE_BATCH,
+                 write_buffer=None, deadband=None, features=None, events=None):
+        self.db_manager = db_manager
+        self.events = events
+        self.features = FeatureStore(db_manager) if features is None else features
+        self.batch_size = batch_size
+        if write_buffer is None and config.DB_WRITE_BUFFER_ENABLED:
+            write_buffer = SensorWriteBuffer(db_manager)
+        self.write_buffer = write_buffer
+        if deadband is None and config.DB_DEADBAND_ENABLED:
+            deadband = Deadband()
+        self.deadband = deadband
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.running = False
+        # Metrics (see stats())
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._last_drop_log = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        if self.write_buffer is not None:
+            self.write_buffer.start()
+        self._start_thread()
+
+    def _start_thread(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='reading-writer')
+        self._thread.start()
+
+    def _ensure_thread(self):
+        """Restart the writer thread if it died, so nothing is queued into a dead thread."""
+        if self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if not self._thread.is_alive():
+                logger.error("Reading writer thread died; restarting it")
+                self._start_thread()
+
+    def stop(self, timeout=10):
+        """
+        Write out everything queued, then stop. Returns the number of readings
+        lost while stopping (failed writes, or still queued after `timeout`).
+        """
+        if not self.running:
+            return 0
+        self._ensure_thread()
+        dropped = self.dropped
+        self.running = False
+        # Blocks only if the queue is full, which a draining writer clears
+        self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+        lost = self.dropped - dropped
+        if self._thread.is_alive():
+            unwritten = self._queue.qsize()
+            logger.error(f"Reading writer did not finish within {timeout} s; {unwritten} readings left unwritten")
+            lost += unwritten
+        if self.write_buffer is not None:
+            self.write_buffer.stop()
+        if lost:
+            logger.error(f"{lost} readings were lost while stopping the reading writer")
+        return lost
+
+    def insert_sensor_data(self, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status,
+                           timestamp=None, device_id=config.DEFAULT_DEVICE_ID, quality_flags=None):
+        """Queue a reading for the writer thread; never blocks. Returns False if it was dropped."""
+        if timestamp is None:
+            timestamp = time.time()
+        item = (time.monotonic(), device_id,
+                (timestamp, soil1, soil2, soil3, soil_avg, temp, hum, light, water_level, fan_status, heater_status,
+                 quality_flags))
+        if not self.running:
+            # Not started (e.g. a one-off script): write straight through
+            return self._write([item])
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            now = time.monotonic()
+            if now - self._last_drop_log >= 10:
+                self._last_drop_log = now
+                logger.warning(f"Ingestion queue full ({self._queue.maxsize}); {self.dropped} readings dropped so far")
+            return False
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Queue depth, drops and how far the database lags behind the serial ports."""
+        return {
+            'depth': self._queue.qsize(),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'suppressed': self.deadband.suppressed if self.deadband is not None else 0,
+            'batches': self.batches,
+            'last_lag_ms': self.last_lag * 1000,
+            'max_lag_ms': self.max_lag * 1000,
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            items = [item]
+            # Everything that arrived meanwhile joins this transaction
+            while len(items) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                items.append(item)
+            try:
+                self._write(items)
+            except Exception:
+                # A bad batch must not stop the writer: drop it and carry on
+                self.dropped += len(items)
+                logger.exception(f"Dropped a batch of {len(items)} readings after an unexpected error")
+
+    def _write(self, items):
+        """Store one batch, retrying while running. Returns False if it was dropped (counted in `dropped`)."""
+        batches = {}
+        unstored = {}
+        features = {}
+        newest = {}
+        for _, device_id, row in items:
+            # Features see every reading, whatever the deadband stores
+            feature_row = self.features.update(device_id, row)
+            if feature_row is not None:
+                features.setdefault(device_id, []).append(feature_row)
+            newest[device_id] = row
+            stored = self.deadband is None or self.deadband.keep(device_id, row)
+            (batches if stored else unstored).setdefault(device_id, []).append(row)
+        if self.events is not None:
+            # Before the write: consumers need the features, not the commit
+            for device_id, row in newest.items():
+                latest = self.features.latest(device_id)
+                if latest is not None and latest[0] == row[0]:
+                    self.events.publish(FeaturesUpdated(device_id, Reading(row), latest[1]))
+        attempts = 0
+        while True:
+            try:
+                if self.write_buffer is not None:
+                    for stored, rows_by_device in ((True, batches), (False, unstored)):
+                        for device_id, rows in rows_by_device.items():
+                            for row in rows:
+                                self.write_buffer.insert_sensor_data(*row[1:11], timestamp=row[0], device_id=device_id,
+                                                                     quality_flags=row[11], stored=stored)
+                    for device_id, rows in features.items():
+                        for row in rows:
+                            self.write_buffer.insert_features(row, device_id=device_id)
+                else:
+                    self.db_manager.insert_sensor_batches(batches, unstored, features)
+                break
+            except sqlite3.Error as e:
+                attempts += 1
+                if not self.running and attempts >= config.INGESTION_STOP_WRITE_ATTEMPTS:
+                    # Stopping: a few more tries, then give up so shutdown cannot hang
+                    self.dropped += len(items)
+                    logger.error(f"Dropped {len(items)} readings after {attempts} failed writes while stopping: {e}")
+                    return False
+                # Keep the rows; new readings queue up (and eventually drop) meanwhile
+                logger.error(f"Failed to write {len(items)} readings, retrying: {e}")
+                time.sleep(1)
+
+        lag = time.monotonic() - items[0][0]
+        self.last_lag = lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+        self.written += len(items)
+        self.batches += 1
+        logger.debug(f"Saved {len(items)} readings (lag {lag * 1000:.1f} ms)")
+        return True
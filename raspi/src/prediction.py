@@ -1,35 +1,60 @@
 import joblib
 import os
 import logging
+import threading
+import time
+import numpy as np
 from . import config
+from .preprocessing import FEATURE_COLUMNS
 
 logger = logging.getLogger(__name__)
 
 class Predictor:
-    def __init__(self, preprocessor, explainability_module):
+    def __init__(self, preprocessor, explainability_module, feature_store=None):
         self.preprocessor = preprocessor
         self.explainer = explainability_module
+        # Live features (FeatureStore), the same values the model was trained on
+        self.feature_store = feature_store
+        # Model input and class probabilities, preallocated and reused by every prediction.
+        # float32 like sklearn's trees; the lock covers callers on different threads (scheduler, bot)
+        self._row = np.empty((1, len(FEATURE_COLUMNS)), dtype=np.float32)
+        self._proba = None
+        self._lock = threading.Lock()
+        # Devices currently served by the rule-based fallback, so it is logged once per switch
+        self._fallback_devices = set()
         self.model = None
         self.load_model()
 
     def load_model(self):
         if os.path.exists(config.MODEL_PATH):
             try:
-                self.model = joblib.load(config.MODEL_PATH)
+                model = joblib.load(config.MODEL_PATH)
+                if list(getattr(model, 'feature_names_in_', [])) != FEATURE_COLUMNS:
+                    # Trained on an older feature set; wait for the next training run
+                    logger.warning("Model was trained on different features. Predictions will be unavailable "
+                                   "until it is retrained.")
+                    return
+                with self._lock:
+                    self.model = model
+                    self._proba = np.zeros((1, len(model.classes_)))
                 logger.info("Model loaded successfully.")
             except Exception as e:
                 logger.error(f"Error loading model: {e}")
         else:
             logger.warning("Model file not found. Predictions will be unavailable until training occurs.")
 
-    def predict(self, recent_data):
+    def predict(self, recent_data, device_id=config.DEFAULT_DEVICE_ID):
         """
-        Make a prediction based on recent data.
+        Make a prediction for a device from its live features.
+        recent_data: the device's recent readings, for the rule-based fallback.
         Returns: (prediction_label, explanation_text)
         """
-        if not self.model:
+        live = self.feature_store.latest(device_id) if self.feature_store is not None else None
+        if not self.model or live is None:
             # Fallback for Demo / Cold Start
-            logger.warning("Model not ready. Using rule-based fallback for demo.")
+            if device_id not in self._fallback_devices:
+                self._fallback_devices.add(device_id)
+                logger.warning(f"Model not ready. Using rule-based fallback for demo ({device_id}).")
             # Get latest reading
             latest = recent_data[-1]
             soil_avg = latest['soil_moisture_avg']
@@ -45,16 +70,67 @@ class Predictor:
             
             return prediction_label, explanation
 
-        features = self.preprocessor.prepare_single_prediction(recent_data)
-        
+        if device_id in self._fallback_devices:
+            self._fallback_devices.discard(device_id)
+            logger.info(f"Model ready; predictions for {device_id} come from the model again.")
+
         try:
-            prediction_idx = self.model.predict(features)[0]
-            prediction_label = "Stress (Needs Water)" if prediction_idx == 1 else "Healthy"
-            
-            # Generate explanation
-            explanation = self.explainer.explain_decision(self.model, features, prediction_label)
-            
+            with self._lock:
+                features = self.preprocessor.build_single_features(live[1], self._row)
+                prediction_idx = self._predict_row(features)
+                prediction_label = "Stress (Needs Water)" if prediction_idx == 1 else "Healthy"
+
+                # Generate explanation
+                explanation = self.explainer.explain_decision(self.model, features, prediction_label, FEATURE_COLUMNS)
+
             return prediction_label, explanation
         except Exception as e:
             logger.error(f"Prediction error: {e}")
             return None, str(e)
+
+    def _predict_row(self, row):
+        """
+        model.predict() for one preallocated float32 row, without pandas,
+        sklearn's input validation or its thread pool: the mean of the trees'
+        class probabilities, as RandomForestClassifier computes it. Models
+        without trees go through their own predict().
+        """
+        estimators = getattr(self.model, 'estimators_', None)
+        if estimators is None:
+            return self.model.predict(self.preprocessor.prepare_single_prediction(row[0]))[0]
+        proba = self._proba
+        proba.fill(0)
+        for tree in estimators:
+            proba += tree.predict_proba(row, check_input=False)
+        return self.model.classes_[proba.argmax()]
+
+class LabelDebouncer:
+    """
+    Hysteresis for per-reading labels: a new label is reported once it came
+    `confirmations` times in a row and no sooner than `hold_seconds` after the
+    device's last reported change, so noise around the model's boundary does
+    not store (and alert) a flip on every reading.
+    """
+    def __init__(self, confirmations=config.PREDICTION_CHANGE_CONFIRMATIONS,
+                 hold_seconds=config.PREDICTION_CHANGE_HOLD_SECONDS):
+        self.confirmations = confirmations
+        self.hold_seconds = hold_seconds
+        self._reported = {}
+        self._candidates = {}
+
+    def update(self, device_id, label, now=None):
+        """Fold in one label for a device; returns True when it is a change to report."""
+        if now is None:
+            now = time.monotonic()
+        reported = self._reported.get(device_id)
+        if reported is not None and label == reported[0]:
+            self._candidates.pop(device_id, None)
+            return False
+        candidate, count = self._candidates.get(device_id, (None, 0))
+        count = count + 1 if label == candidate else 1
+        self._candidates[device_id] = (label, count)
+        if count < self.confirmations or (reported is not None and now - reported[1] < self.hold_seconds):
+            return False
+        self._reported[device_id] = (label, now)
+        del self._candidates[device_id]
+        return True
@@ -1,80 +1,55 @@
 import pandas as pd
 import numpy as np
+from . import config
+from .database import FEATURE_COLUMNS
+
+# Model inputs, in column order: the feature store's (src/features.py)
+FEATURE_COLUMNS = list(FEATURE_COLUMNS)
+_SOIL = FEATURE_COLUMNS.index('soil_moisture')
 
 class DataPreprocessor:
     def __init__(self):
         pass
 
-    def prepare_dataset(self, raw_data):
+    def prepare_dataset(self, feature_rows):
         """
-        Convert raw DB tuples into a DataFrame with features.
-        raw_data: list of tuples (timestamp, soil, temp, hum, light, temp_lm35)
+        Turn stored feature rows into model inputs and stress labels.
+        feature_rows: float64 array (rows, 1 + FEATURE_COLUMNS), timestamp
+        first, as iter_feature_chunks() yields. The features were computed
+        once, as the readings arrived; nothing is recomputed here.
+        Returns (X DataFrame with FEATURE_COLUMNS, y Series: 1 = dry soil).
         """
-        if not raw_data:
-            return pd.DataFrame(), pd.Series()
-
-        df = pd.DataFrame(raw_data, columns=['timestamp', 'soil_moisture', 'temperature', 'humidity', 'light_intensity', 'temperature_lm35'])
-        
-        # Merge temperatures for robustness (average) or use primary
-        df['avg_temp'] = df[['temperature', 'temperature_lm35']].mean(axis=1)
+        data = np.asarray(feature_rows, dtype=np.float64)
+        if data.size == 0:
+            return pd.DataFrame(columns=FEATURE_COLUMNS), pd.Series(dtype=np.int64)
+        if data.ndim != 2 or data.shape[1] != 1 + len(FEATURE_COLUMNS):
+            raise ValueError(f"Expected rows of timestamp + {len(FEATURE_COLUMNS)} features, got shape {data.shape}")
 
-        # Feature Engineering: Rate of change (slope)
-        df = df.sort_values('timestamp')
-        
-        df['time_diff'] = df['timestamp'].diff()
-        df['soil_diff'] = df['soil_moisture'].diff()
-        
-        df['soil_slope'] = df.apply(
-            lambda row: row['soil_diff'] / row['time_diff'] if row['time_diff'] > 0 else 0, axis=1
-        )
-        
-        df = df.dropna()
+        features = data[:, 1:]
+        # Rows missing a value (NULL in the table) are unusable
+        features = features[~np.isnan(features).any(axis=1)]
 
-        threshold = 400 
-        df['is_stressed'] = (df['soil_moisture'] < threshold).astype(int)
+        # Higher readings are drier soil
+        y = (features[:, _SOIL] > config.MOISTURE_THRESHOLD_LOW).astype(np.int64)
+        return pd.DataFrame(features, columns=FEATURE_COLUMNS), pd.Series(y)
 
-        # Features to use for training
-        # Added light and avg_temp
-        feature_cols = ['soil_moisture', 'avg_temp', 'humidity', 'light_intensity', 'soil_slope']
-        X = df[feature_cols]
-        y = df['is_stressed']
-        
-        return X, y
+    def prepare_single_prediction(self, features):
+        """
+        Model input for one prediction, as a one-row DataFrame.
+        features: values in FEATURE_COLUMNS order, as FeatureStore.latest() serves them.
+        """
+        return pd.DataFrame([features], columns=FEATURE_COLUMNS)
 
-    def prepare_single_prediction(self, recent_data):
+    def build_single_features(self, features, out=None):
         """
-        Prepare features for a single prediction based on recent history.
-        recent_data: list of tuples (timestamp, soil, temp, hum, light, temp_lm35)
+        NumPy-only model input for one prediction: `features` (as for
+        prepare_single_prediction) copied into `out`, a preallocated
+        (1, len(FEATURE_COLUMNS)) array reused between calls, so a prediction
+        per reading allocates nothing. Returns out.
         """
-        if len(recent_data) < 2:
-            last_point = recent_data[-1]
-            avg_temp = (last_point[2] + last_point[5]) / 2
-            return pd.DataFrame([{
-                'soil_moisture': last_point[1], 
-                'avg_temp': avg_temp, 
-                'humidity': last_point[3],
-                'light_intensity': last_point[4],
-                'soil_slope': 0
-            }])
-            
-        df = pd.DataFrame(recent_data, columns=['timestamp', 'soil_moisture', 'temperature', 'humidity', 'light_intensity', 'temperature_lm35'])
-        df['avg_temp'] = df[['temperature', 'temperature_lm35']].mean(axis=1)
-        df = df.sort_values('timestamp')
-        
-        last_row = df.iloc[-1]
-        prev_row = df.iloc[-2]
-        
-        time_diff = last_row['timestamp'] - prev_row['timestamp']
-        soil_diff = last_row['soil_moisture'] - prev_row['soil_moisture']
-        
-        slope = (soil_diff / time_diff) if time_diff > 0 else 0
-        
-        features = pd.DataFrame([{
-            'soil_moisture': last_row['soil_moisture'],
-            'avg_temp': last_row['avg_temp'],
-            'humidity': last_row['humidity'],
-            'light_intensity': last_row['light_intensity'],
-            'soil_slope': slope
-        }])
-        
-        return features
+        if out is None:
+            out = np.empty((1, len(FEATURE_COLUMNS)))
+        if len(features) != len(FEATURE_COLUMNS):
+            raise ValueError(f"Expected {len(FEATURE_COLUMNS)} features, got {len(features)}")
+        out[0] = features
+        return out
@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+from . import config
+from .database import READING_COLUMN_NAMES
+
+# Columns stored as REAL in sensor_data; everything else is an INTEGER
+_FLOAT_COLUMNS = {'timestamp', 'temperature', 'humidity'}
+_CASTS = tuple(float if name in _FLOAT_COLUMNS else int for name in READING_COLUMN_NAMES)
+_INDEX = {name: i for i, name in enumerate(READING_COLUMN_NAMES)}
+
+class Reading(tuple):
+    """A reading that, like sqlite3.Row, supports both row[0] and row['temperature']."""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, _INDEX[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(READING_COLUMN_NAMES)
+
+class ReadingRingBuffer:
+    """
+    Thread-safe, array-backed buffer of one device's most recent readings.
+    DataIngestion appends every reading as it arrives; the automation loop,
+    voice loop, predictor and bot read from here with the same
+    get_latest_reading() / get_recent_data() calls DatabaseManager offers,
+    so hot-path reads never touch SQLite.
+    """
+    def __init__(self, capacity=config.RING_BUFFER_CAPACITY, fallback=None, device_id=config.DEFAULT_DEVICE_ID):
+        self.capacity = capacity
+        self.device_id = device_id
+        # Optional DatabaseManager: preloads the buffer and serves limits beyond capacity
+        self.fallback = fallback
+        self._data = np.full((capacity, len(READING_COLUMN_NAMES)), np.nan, dtype=np.float64)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        if fallback is not None:
+            for row in fallback.get_recent_data(limit=capacity, device_id=device_id):
+                self.append(tuple(row))
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        """Add a reading given in READING_COLUMNS order (timestamp first)."""
+        values = [np.nan if v is None else v for v in row]
+        with self._lock:
+            self._data[self._next] = values
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def _to_reading(self, values):
+        # NaN marks a missing value (NaN != NaN)
+        return Reading(None if v != v else cast(v) for cast, v in zip(_CASTS, values.tolist()))
+
+    def get_latest_reading(self):
+        """The newest reading, or None when empty."""
+        with self._lock:
+            if self._count == 0:
+                return None
+            values = self._data[self._next - 1].copy()
+        return self._to_reading(values)
+
+    def get_recent_data(self, limit=1000):
+        """Up to limit newest readings, oldest first (same order as the database)."""
+        if limit > self.capacity and self.fallback is not None:
+            return self.fallback.get_recent_data(limit=limit, device_id=self.device_id)
+        with self._lock:
+            n = min(limit, self._count)
+            # Positions of the n newest rows, oldest first, wrapping around the array
+            idx = (self._next - n + np.arange(n)) % self.capacity
+            values = self._data[idx]
+        return [self._to_reading(row) for row in values]
@@ -0,0 +1,462 @@
+import os
+import pty
+import tty
+import math
+import json
+import time
+import errno
+import random
+import select
+import sqlite3
+import tempfile
+import threading
+import logging
+from .ingestion import encode_frame
+
+logger = logging.getLogger(__name__)
+
+# Same defaults as smart_plant_sensors.ino
+FIRMWARE_INTERVAL_SECONDS = 5
+WATERING_REST_SECONDS = 60
+
+class SyntheticPlant:
+    """
+    Generates plausible readings: soil dries out over time and gets wetter
+    when watered, temperature and humidity follow a daily cycle, and the fan
+    and heater pull the temperature back. Time runs `speed` times faster.
+    """
+    def __init__(self, seed=None, speed=1.0, interval=FIRMWARE_INTERVAL_SECONDS, soil=320,
+                 drying_per_hour=6.0, tank_waterings=50):
+        self.random = random.Random(seed)
+        self.speed = speed
+        self.interval = interval
+        self.soil = soil
+        self.drying_per_hour = drying_per_hour
+        self.tank_waterings = tank_waterings
+        self.clock = self.random.uniform(0, 86400)
+
+    def next_reading(self, board):
+        """(seconds to wait, reading dict) for the next regular reading."""
+        step = self.interval * self.speed
+        self.clock += step
+        self.soil = min(1023, self.soil + self.drying_per_hour * step / 3600)
+
+        day = math.sin((self.clock % 86400) / 86400 * 2 * math.pi - math.pi / 2)
+        temp = 23 + 5 * day + self.random.gauss(0, 0.2)
+        if board.fan_status:
+            temp -= 2
+        if board.heater_status:
+            temp += 2
+        hum = 55 - 10 * day + self.random.gauss(0, 1)
+
+        probes = [max(0, min(1023, round(self.soil + self.random.gauss(0, 8)))) for _ in range(3)]
+        reading = {
+            'soil1': probes[0], 'soil2': probes[1], 'soil3': probes[2],
+            'soil_avg': sum(probes) // 3,
+            'temp': round(temp, 1), 'hum': round(max(0, min(100, hum)), 1),
+            'water_level': 1 if self.tank_waterings > 0 else 0,
+        }
+        return self.interval, reading
+
+    def water(self, seconds):
+        if self.tank_waterings <= 0:
+            return False
+        self.tank_waterings -= 1
+        self.soil = max(150, self.soil - 30 * seconds)
+        return True
+
+class ReplaySource:
+    """
+    Replays recorded sensor_data rows, keeping their original spacing divided
+    by `speed` (or a fixed `rate` in readings per second). Loops when `loop` is set.
+    """
+    COLUMNS = ('timestamp', 'soil_moisture_1', 'soil_moisture_2', 'soil_moisture_3', 'soil_moisture_avg',
+               'temperature', 'humidity', 'water_level')
+
+    def __init__(self, db_path, device_id=None, speed=60.0, rate=None, start=None, loop=False,
+                 max_gap_seconds=60):
+        self.db_path = db_path
+        self.device_id = device_id
+        self.speed = speed
+        self.rate = rate
+        self.start = start
+        self.loop = loop
+        self.max_gap_seconds = max_gap_seconds
+        self._rows = None
+        self._last_timestamp = None
+
+    def _open(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(sensor_data)')]
+        where, params = [], []
+        if self.device_id is not None and 'device_id' in columns:
+            where.append('device_id = ?')
+            params.append(self.device_id)
+        if self.start is not None:
+            where.append('timestamp >= ?')
+            params.append(self.start)
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM sensor_data"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        # Streamed: the cursor stays open on its own connection
+        self._rows = conn.execute(sql + ' ORDER BY timestamp', params)
+        self._last_timestamp = None
+
+    def next_reading(self, board):
+        if self._rows is None:
+            self._open()
+        row = self._rows.fetchone()
+        if row is None:
+            if not self.loop:
+                return None
+            self._open()
+            row = self._rows.fetchone()
+            if row is None:
+                return None
+
+        timestamp, soil1, soil2, soil3, soil_avg, temp, hum, water_level = row
+        if self.rate:
+            delay = 1.0 / self.rate
+        elif self._last_timestamp is None:
+            delay = 0
+        else:
+            # Outages in the recording would otherwise stall the replay
+            delay = min(max(timestamp - self._last_timestamp, 0), self.max_gap_seconds) / self.speed
+        self._last_timestamp = timestamp
+        reading = {
+            'soil1': soil1 or 0, 'soil2': soil2 or 0, 'soil3': soil3 or 0, 'soil_avg': soil_avg or 0,
+            'temp': temp or 0, 'hum': hum or 0, 'water_level': water_level or 0,
+        }
+        return delay, reading
+
+    def water(self, seconds):
+        return True
+
+class VirtualArduino:
+    """
+    A pseudo-terminal that speaks the smart_plant_sensors.ino protocol: JSON
+    readings (or binary frames after PROTO_BIN), ACK:/STATUS: lines, W<n> /
+    SET_* / SET_ALL / AUTO_* / TEST_* commands and the fan / heater / watering automation.
+
+    `port` is a symlink to the current pty so disconnect faults can re-create
+    it, like a board being unplugged and plugged back in.
+
+    faults: probabilities per reading for 'drop', 'corrupt', 'truncate',
+    'garbage' and 'sensor_fail' (DHT read failure, sent as 0 like the firmware),
+    per command for 'command_loss', plus 'disconnect_every' in seconds.
+    """
+    def __init__(self, source=None, port=None, faults=None, seed=None, rate=None):
+        self.source = source or SyntheticPlant(seed=seed)
+        self.faults = faults or {}
+        self.random = random.Random(seed)
+        # Fixed readings per second, overriding the source's own spacing
+        self.rate = rate
+        if port is None:
+            port = os.path.join(tempfile.mkdtemp(prefix='virtual-arduino-'), 'tty')
+        self.port = port
+
+        # Firmware state
+        self.binary_mode = False
+        # False emulates firmware from before SET_ALL
+        self.set_all = True
+        self.soil_threshold = 340
+        self.fan_temp_threshold = 28.0
+        self.heater_temp_threshold = 20.0
+        self.auto_water = True
+        self.auto_fan = True
+        self.auto_heater = True
+        self.fan_status = 0
+        self.heater_status = 0
+        self._last_auto_watering = None
+        self._pending_flags = {}
+        self._last_reading = None
+
+        self.stats = {
+            'readings_sent': 0, 'bytes_sent': 0, 'dropped': 0, 'corrupted': 0, 'truncated': 0,
+            'garbage': 0, 'sensor_failures': 0, 'disconnects': 0, 'overflows': 0,
+            'commands': 0, 'commands_lost': 0, 'waterings': 0,
+        }
+        # (monotonic time, command) for every command received
+        self.command_log = []
+
+        self._master = None
+        self._slave = None
+        self._started = time.monotonic()
+        self._inbox = b''
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.finished = threading.Event()
+
+    def start(self):
+        self._open_pty()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"virtual-arduino {self.port}")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._close_pty()
+        try:
+            os.unlink(self.port)
+        except OSError:
+            pass
+
+    def press_ai_button(self):
+        """Send a reading with button_pressed set right away, as the firmware does."""
+        self._push_now({'button_pressed': 1})
+
+    def press_water_button(self):
+        """Manual watering button: reading with watering_triggered, then 3 s of watering."""
+        self._push_now({'watering_triggered': 1})
+        self._water(3)
+
+    # ---------- pty ----------
+
+    def _open_pty(self):
+        master, slave = pty.openpty()
+        # No echo or line editing, like a real serial line
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        tmp_link = self.port + '.new'
+        try:
+            os.unlink(tmp_link)
+        except OSError:
+            pass
+        os.symlink(os.ttyname(slave), tmp_link)
+        os.replace(tmp_link, self.port)
+        with self._lock:
+            self._master, self._slave = master, slave
+            self._inbox = b''
+            # A reset board starts again in JSON mode
+            self.binary_mode = False
+        logger.debug(f"Virtual Arduino on {self.port} -> {os.ttyname(slave)}")
+
+    def _close_pty(self):
+        with self._lock:
+            for fd in (self._master, self._slave):
+                if fd is not None:
+                    os.close(fd)
+            self._master = self._slave = None
+
+    def _write(self, data):
+        with self._lock:
+            if self._master is None:
+                return False
+            try:
+                os.write(self._master, data)
+            except BlockingIOError:
+                # Nobody is reading: a real board's bytes are lost too
+                self.stats['overflows'] += 1
+                return False
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+                return False
+        self.stats['bytes_sent'] += len(data)
+        return True
+
+    def _write_line(self, text):
+        self._write(text.encode('utf-8') + b'\r\n')
+
+    # ---------- main loop ----------
+
+    def _run(self):
+        next_reading_at = time.monotonic()
+        next_disconnect_at = self._next_disconnect()
+        pending = None
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if next_disconnect_at is not None and now >= next_disconnect_at:
+                self._disconnect()
+                next_disconnect_at = self._next_disconnect()
+
+            if pending is None:
+                pending = self.source.next_reading(self)
+                if pending is None:
+                    logger.info(f"Virtual Arduino on {self.port}: replay finished")
+                    self.finished.set()
+                    break
+                delay = 1.0 / self.rate if self.rate else pending[0]
+                next_reading_at += delay
+
+            if now >= next_reading_at:
+                self._automation(pending[1])
+                self._send_reading(pending[1])
+                pending = None
+                continue
+
+            self._poll_commands(min(next_reading_at - now, 0.05))
+
+    def _next_disconnect(self):
+        every = self.faults.get('disconnect_every')
+        return time.monotonic() + every if every else None
+
+    def _disconnect(self):
+        self.stats['disconnects'] += 1
+        logger.info(f"Virtual Arduino on {self.port}: simulating disconnect")
+        self._close_pty()
+        time.sleep(0.2)
+        self._open_pty()
+
+    def _poll_commands(self, timeout):
+        master = self._master
+        if master is None:
+            time.sleep(timeout)
+            return
+        try:
+            readable, _, _ = select.select([master], [], [], max(timeout, 0))
+            if not readable:
+                return
+            data = os.read(master, 4096)
+        except (OSError, ValueError):
+            # EIO while no one has the port open, or the pty was swapped
+            time.sleep(timeout)
+            return
+        self._inbox += data
+        while b'\n' in self._inbox:
+            line, self._inbox = self._inbox.split(b'\n', 1)
+            command = line.decode('utf-8', errors='replace').strip()
+            if command and self._chance('command_loss'):
+                self.stats['commands_lost'] += 1
+            elif command:
+                self._handle_command(command)
+
+    # ---------- firmware behaviour ----------
+
+    def _handle_command(self, command):
+        self.stats['commands'] += 1
+        self.command_log.append((time.monotonic(), command))
+        try:
+            if command.startswith('W'):
+                duration = int(command[1:] or 0)
+                if duration <= 0:
+                    duration = 3
+                self._water(min(duration, 10))
+            elif command.startswith('SET_ALL:') and self.set_all:
+                fields = command[8:].split(',')
+                if len(fields) == 6:
+                    self.soil_threshold = int(float(fields[0]))
+                    self.fan_temp_threshold = float(fields[1])
+                    self.heater_temp_threshold = float(fields[2])
+                    self.auto_water, self.auto_fan, self.auto_heater = (int(f) == 1 for f in fields[3:])
+                    self._write_line(
+                        f"ACK:ALL:{self.soil_threshold},{self.fan_temp_threshold:.2f},{self.heater_temp_threshold:.2f},"
+                        f"{int(self.auto_water)},{int(self.auto_fan)},{int(self.auto_heater)}"
+                    )
+            elif command.startswith('SET_SOIL_THRESH:'):
+                self.soil_threshold = int(float(command[16:]))
+                self._write_line(f"ACK:SOIL_THRESH:{self.soil_threshold}")
+            elif command.startswith('SET_FAN_TEMP:'):
+                self.fan_temp_threshold = float(command[13:])
+                self._write_line(f"ACK:FAN_TEMP:{self.fan_temp_threshold:.2f}")
+            elif command.startswith('SET_HEATER_TEMP:'):
+                self.heater_temp_threshold = float(command[16:])
+                self._write_line(f"ACK:HEATER_TEMP:{self.heater_temp_threshold:.2f}")
+            elif command.startswith('AUTO_') and command.rsplit('_', 1)[-1] in ('ON', 'OFF'):
+                name, state = command[5:].rsplit('_', 1)
+                attr = {'WATER': 'auto_water', 'FAN': 'auto_fan', 'HEATER': 'auto_heater'}[name]
+                setattr(self, attr, state == 'ON')
+                self._write_line(f"ACK:AUTO_{name}:{int(state == 'ON')}")
+            elif command == 'PROTO_BIN':
+                self._write_line('ACK:PROTO:BIN')
+                self.binary_mode = True
+            elif command == 'PROTO_JSON':
+                self.binary_mode = False
+                self._write_line('ACK:PROTO:JSON')
+            elif command in ('TEST_FAN_ON', 'TEST_FAN_OFF'):
+                self._set_fan(command.endswith('_ON'))
+                self._write_line(f"ACK:FAN_TEST:{int(command.endswith('_ON'))}")
+            elif command in ('TEST_HEATER_ON', 'TEST_HEATER_OFF'):
+                self._set_heater(command.endswith('_ON'))
+                self._write_line(f"ACK:HEATER_TEST:{int(command.endswith('_ON'))}")
+            else:
+                # The firmware ignores unknown commands
+                logger.debug(f"Virtual Arduino on {self.port}: ignored command {command}")
+        except (KeyError, ValueError):
+            logger.debug(f"Virtual Arduino on {self.port}: malformed command {command}")
+
+    def _water(self, seconds):
+        if self.source.water(seconds):
+            self.stats['waterings'] += 1
+
+    def _set_fan(self, state):
+        if self.fan_status != int(state):
+            self.fan_status = int(state)
+            self._write_line('STATUS:FAN_ON' if state else 'STATUS:FAN_OFF')
+
+    def _set_heater(self, state):
+        if self.heater_status != int(state):
+            self.heater_status = int(state)
+            self._write_line('STATUS:HEATER_ON' if state else 'STATUS:HEATER_OFF')
+
+    def _automation(self, reading):
+        temp = reading['temp']
+        if self.auto_fan and temp >= self.fan_temp_threshold:
+            self._set_fan(True)
+            self._set_heater(False)
+        elif self.auto_heater and temp <= self.heater_temp_threshold:
+            self._set_heater(True)
+            self._set_fan(False)
+        else:
+            self._set_fan(False)
+            self._set_heater(False)
+
+        now = time.monotonic()
+        rested = self._last_auto_watering is None or now - self._last_auto_watering >= WATERING_REST_SECONDS
+        if self.auto_water and reading['water_level'] == 1 and rested and reading['soil_avg'] > self.soil_threshold:
+            self._water(5)
+            self._last_auto_watering = now
+
+    def _millis(self):
+        return int((time.monotonic() - self._started) * 1000) & 0xFFFFFFFF
+
+    def _push_now(self, flags):
+        with self._lock:
+            self._pending_flags.update(flags)
+        # Button readings repeat the newest values, like sendData() inside loop()
+        if self._last_reading is not None:
+            self._send_reading(self._last_reading, faults=False)
+
+    def _send_reading(self, reading, faults=True):
+        self._last_reading = dict(reading)
+        data = dict(reading)
+        if faults and self._chance('sensor_fail'):
+            self.stats['sensor_failures'] += 1
+            data['temp'] = 0
+            data['hum'] = 0
+        with self._lock:
+            flags, self._pending_flags = self._pending_flags, {}
+        data.update({
+            'timestamp': self._millis(),
+            'fan_status': self.fan_status,
+            'heater_status': self.heater_status,
+            'button_pressed': flags.get('button_pressed', 0),
+            'watering_triggered': flags.get('watering_triggered', 0),
+        })
+        payload = encode_frame(data) if self.binary_mode else json.dumps(data).encode('utf-8') + b'\r\n'
+
+        if faults:
+            if self._chance('drop'):
+                self.stats['dropped'] += 1
+                return
+            if self._chance('garbage'):
+                self.stats['garbage'] += 1
+                self._write(bytes(self.random.randrange(256) for _ in range(self.random.randint(1, 32))))
+            if self._chance('corrupt'):
+                self.stats['corrupted'] += 1
+                payload = bytearray(payload)
+                payload[self.random.randrange(2, len(payload) - 2)] ^= 1 << self.random.randrange(8)
+                payload = bytes(payload)
+            elif self._chance('truncate'):
+                self.stats['truncated'] += 1
+                payload = payload[:self.random.randint(1, len(payload) - 1)]
+
+        if self._write(payload):
+            self.stats['readings_sent'] += 1
+
+    def _chance(self, fault):
+        probability = self.faults.get(fault, 0)
+        return probability > 0 and self.random.random() < probability
@@ -0,0 +1,147 @@
+import json
+import os
+import logging
+import numpy as np
+from . import config
+from .database import READING_COLUMN_NAMES
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_DTYPE = np.float64
+
+def export_snapshots(db_manager, snapshot_dir=config.SNAPSHOT_DIR):
+    """Bring every device's snapshot up to date (run before retention prunes raw rows). Returns rows appended."""
+    return sum(ColumnarSnapshot(snapshot_dir, device_id=device_id).export_incremental(db_manager)
+               for device_id in db_manager.get_device_ids())
+
+class ColumnarSnapshot:
+    """
+    Append-only columnar copy of one device's sensor_data for training, analysis
+    and backfills. Rows are stored in insertion (id) order and survive raw-data
+    retention. Each column is a raw float64 file in snapshot_dir/<device_id>; manifest.json records the
+    row count and the last exported sensor_data id (the export watermark).
+    Columns are opened as read-only NumPy memmaps, so loading is zero-copy and
+    never touches the live database.
+    """
+    def __init__(self, snapshot_dir=config.SNAPSHOT_DIR, columns=READING_COLUMN_NAMES, device_id=config.DEFAULT_DEVICE_ID):
+        self.device_id = device_id
+        self.snapshot_dir = os.path.join(snapshot_dir, device_id)
+        self.columns = tuple(columns)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _column_path(self, column):
+        return os.path.join(self.snapshot_dir, f"{column}.f8")
+
+    def _read_manifest(self):
+        path = os.path.join(self.snapshot_dir, MANIFEST_NAME)
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+                columns = tuple(manifest['columns'])
+                rows = int(manifest['rows'])
+                int(manifest['last_id'])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Snapshot manifest unreadable ({e}); rebuilding snapshot from scratch.")
+            else:
+                if columns == self.columns:
+                    return manifest
+                if self._has_rows(set(columns) & set(self.columns), rows):
+                    return self._migrate_columns(manifest, columns)
+                logger.warning("Snapshot column files are incomplete; rebuilding snapshot from scratch.")
+        return {'columns': list(self.columns), 'rows': 0, 'last_id': 0}
+
+    def _has_rows(self, columns, rows):
+        size = rows * np.dtype(SNAPSHOT_DTYPE).itemsize
+        return all(os.path.exists(self._column_path(c)) and os.path.getsize(self._column_path(c)) >= size
+                   for c in columns)
+
+    def _migrate_columns(self, manifest, old_columns):
+        """
+        Adopt a new column list in place: the snapshot outlives raw retention,
+        so its history cannot be re-exported. Added columns are NaN for the rows
+        already exported; dropped columns' files are left alone.
+        """
+        rows = manifest['rows']
+        added = [c for c in self.columns if c not in old_columns]
+        nan_chunk = np.full(min(rows, config.TRAINING_CHUNK_SIZE), np.nan, dtype=SNAPSHOT_DTYPE).tobytes()
+        item_size = np.dtype(SNAPSHOT_DTYPE).itemsize
+        for column in added:
+            with open(self._column_path(column), 'wb') as f:
+                remaining = rows
+                while remaining > 0:
+                    count = min(remaining, config.TRAINING_CHUNK_SIZE)
+                    f.write(nan_chunk[:count * item_size])
+                    remaining -= count
+        self.manifest = {'columns': list(self.columns), 'rows': rows, 'last_id': manifest['last_id']}
+        self._write_manifest()
+        logger.info(f"Snapshot for {self.device_id} migrated to new columns (added {added}), {rows} rows kept")
+        return self.manifest
+
+    def _write_manifest(self):
+        # Write-then-rename so a crash never leaves a half-written manifest
+        path = os.path.join(self.snapshot_dir, MANIFEST_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, path)
+
+    @property
+    def row_count(self):
+        return self.manifest['rows']
+
+    def export_incremental(self, db_manager, chunk_size=config.TRAINING_CHUNK_SIZE):
+        """Append sensor_data rows added since the last export. Returns rows appended."""
+        last_id = self.manifest['last_id']
+        until_id = db_manager.get_max_row_id()
+        if until_id <= last_id:
+            return 0
+
+        # Drop anything appended after the manifest was last written (interrupted export)
+        item_size = np.dtype(SNAPSHOT_DTYPE).itemsize
+        for column in self.columns:
+            path = self._column_path(column)
+            with open(path, 'ab') as f:
+                f.truncate(self.manifest['rows'] * item_size)
+
+        appended = 0
+        files = {column: open(self._column_path(column), 'ab') for column in self.columns}
+        try:
+            for chunk in db_manager.iter_data_chunks(chunk_size=chunk_size, columns=self.columns,
+                                                     as_numpy=True, after_id=last_id, until_id=until_id,
+                                                     device_id=self.device_id):
+                for i, column in enumerate(self.columns):
+                    files[column].write(np.ascontiguousarray(chunk[:, i]).tobytes())
+                appended += len(chunk)
+        finally:
+            for f in files.values():
+                f.close()
+
+        self.manifest['rows'] += appended
+        self.manifest['last_id'] = until_id
+        self._write_manifest()
+        logger.info(f"Snapshot export appended {appended} rows for {self.device_id} ({self.row_count} total)")
+        return appended
+
+    def load_columns(self, columns=None):
+        """Read-only memmaps of the requested columns, keyed by name."""
+        columns = tuple(columns) if columns else self.columns
+        rows = self.row_count
+        loaded = {}
+        for column in columns:
+            if column not in self.columns:
+                raise ValueError(f"Column not in snapshot: {column}")
+            if rows == 0:
+                loaded[column] = np.empty(0, dtype=SNAPSHOT_DTYPE)
+            else:
+                loaded[column] = np.memmap(self._column_path(column), dtype=SNAPSHOT_DTYPE, mode='r', shape=(rows,))
+        return loaded
+
+    def iter_chunks(self, chunk_size=config.TRAINING_CHUNK_SIZE, columns=None):
+        """Yield (rows, columns) float64 arrays, the same shape iter_data_chunks(as_numpy=True) yields."""
+        loaded = self.load_columns(columns)
+        arrays = list(loaded.values())
+        for start in range(0, self.row_count, chunk_size):
+            yield np.column_stack([a[start:start + chunk_size] for a in arrays])
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import threading
+import time
+import logging
+from serial.tools import list_ports
+from . import config
+from .persistence import ReadingWriter
+from .events import EventBus
+from .ingestion import DataIngestion
+from .ring_buffer import ReadingRingBuffer
+
+logger = logging.getLogger(__name__)
+
+def discovered_device_id(port_info):
+    """Stable id for a board found by discovery: its USB serial number, else its port name."""
+    if port_info.serial_number:
+        return f"usb-{port_info.serial_number}"
+    return f"usb-{os.path.basename(port_info.device)}"
+
+class IngestionSupervisor:
+    """
+    Runs one DataIngestion reader per Arduino, all as tasks on a single asyncio
+    loop in one background thread. Each reader tags its readings with the
+    board's device_id; write_command() routes to the right board, and stats()
+    reports per-port throughput. With discovery on, newly plugged-in Arduinos
+    are adopted automatically. Every reader publishes on the shared `events` bus.
+    """
+    def __init__(self, db_manager, discover=config.SERIAL_DISCOVERY_ENABLED, event_bus=None):
+        self.db_manager = db_manager
+        self.discover = discover
+        self.events = event_bus if event_bus is not None else EventBus()
+        self.ingestors = {}
+        # Called with the DataIngestion of every board adopted by discovery
+        self.on_device_added = None
+        # One persistence stage (queue + writer thread) shared by every board
+        self.writer = ReadingWriter(db_manager, events=self.events)
+        self.loop = None
+        self._thread = None
+        self._tasks = {}
+        self._stopping = None
+        self._lock = threading.Lock()
+        self._stats_at = time.monotonic()
+        self._stats_counts = {}
+
+    def add_device(self, device_id, port, recent_readings=None):
+        """
+        Create the reader for one board; it starts with the supervisor (or right away if running).
+        Writes to SQLite: call it from a thread other than the ingestion loop.
+        """
+        with self._lock:
+            if device_id in self.ingestors:
+                raise ValueError(f"Device {device_id} already added")
+            self.db_manager.register_device(device_id, port)
+            if recent_readings is None:
+                recent_readings = ReadingRingBuffer(fallback=self.db_manager, device_id=device_id)
+            ingestor = DataIngestion(self.db_manager, recent_readings, device_id=device_id, port=port,
+                                     writer=self.writer, event_bus=self.events)
+            self.ingestors[device_id] = ingestor
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._start_reader, ingestor)
+        return ingestor
+
+    def get_ingestor(self, device_id):
+        return self.ingestors.get(device_id)
+
+    def write_command(self, device_id, command):
+        """Send a command to one board."""
+        ingestor = self.ingestors.get(device_id)
+        if ingestor is None:
+            logger.warning(f"Unknown device {device_id}. Cannot send command: {command}")
+            return False
+        return ingestor.write_command(command)
+
+    def start(self):
+        """Start every reader on the supervisor's thread."""
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name='ingestion', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop every reader and flush buffered readings. Returns the readings lost while flushing."""
+        if self.loop is not None and self._stopping is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._stopping.set)
+            except RuntimeError:
+                # Loop already finished
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        return self.writer.stop()
+
+    async def _run(self):
+        self._stopping = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.writer.start()
+        with self._lock:
+            for ingestor in self.ingestors.values():
+                self._start_reader(ingestor)
+
+        background = [asyncio.create_task(self._report_loop())]
+        if self.discover:
+            background.append(asyncio.create_task(self._discovery_loop()))
+        logger.info(f"Ingestion supervisor running {len(self.ingestors)} reader(s)")
+
+        await self._stopping.wait()
+        for task in background:
+            task.cancel()
+        for ingestor in list(self.ingestors.values()):
+            ingestor.stop()
+        await asyncio.gather(*self._tasks.values(), *background, return_exceptions=True)
+
+    def _start_reader(self, ingestor):
+        if ingestor.device_id not in self._tasks:
+            self._tasks[ingestor.device_id] = self.loop.create_task(ingestor.run())
+
+    def stats(self):
+        """Per-board counters, with rates measured since the previous call."""
+        now = time.monotonic()
+        elapsed = max(now - self._stats_at, 1e-9)
+        self._stats_at = now
+        report = {}
+        for device_id, ingestor in list(self.ingestors.items()):
+            readings, received = self._stats_counts.get(device_id, (0, 0))
+            report[device_id] = {
+                'port': ingestor.port,
+                'connected': ingestor.connected,
+                'binary_frames': ingestor.binary_frames,
+                'readings': ingestor.readings_received,
+                'readings_per_min': (ingestor.readings_received - readings) * 60 / elapsed,
+                'bytes_per_sec': (ingestor.bytes_received - received) / elapsed,
+                'frames_corrupted': ingestor.frames_corrupted,
+            }
+            self._stats_counts[device_id] = (ingestor.readings_received, ingestor.bytes_received)
+        return report
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(config.INGESTION_STATS_INTERVAL_SECONDS)
+            for device_id, s in self.stats().items():
+                logger.info(
+                    f"{device_id} on {s['port']}: {'connected' if s['connected'] else 'disconnected'}, "
+                    f"{s['readings_per_min']:.1f} readings/min, {s['bytes_per_sec']:.0f} B/s, "
+                    f"{'binary' if s['binary_frames'] else 'JSON'}, {s['frames_corrupted']} corrupted frames"
+                )
+            w = self.writer.stats()
+            logger.info(
+                f"Reading writer: queue {w['depth']} (max {w['max_depth']}), {w['written']} written in "
+                f"{w['batches']} transactions, {w['dropped']} dropped, {w['suppressed']} not stored (deadband), lag {w['last_lag_ms']:.1f} ms "
+                f"(max {w['max_lag_ms']:.1f} ms)"
+            )
+
+    async def _discovery_loop(self):
+        while True:
+            try:
+                # comports() reads sysfs and adopting registers devices in SQLite; keep both off the loop
+                ports = await self.loop.run_in_executor(None, list_ports.comports)
+                await self.loop.run_in_executor(None, self._adopt_ports, ports)
+            except Exception as e:
+                logger.error(f"Serial port discovery failed: {e}")
+            await asyncio.sleep(config.SERIAL_DISCOVERY_INTERVAL_SECONDS)
+
+    def _adopt_ports(self, ports):
+        """
+        Start readers for Arduinos not managed yet; follow known boards to a new port.
+        Runs in an executor thread: register_device writes to SQLite, which would
+        stall every reader if run on the loop.
+        """
+        in_use = {os.path.realpath(ingestor.port) for ingestor in self.ingestors.values()}
+        for info in ports:
+            if info.vid not in config.SERIAL_DISCOVERY_USB_VIDS or os.path.realpath(info.device) in in_use:
+                continue
+            device_id = discovered_device_id(info)
+            known = self.ingestors.get(device_id)
+            if known is not None:
+                if not known.connected:
+                    logger.info(f"{device_id} moved from {known.port} to {info.device}")
+                    # The reader's next reconnect attempt uses the new port
+                    known.port = info.device
+                    self.db_manager.register_device(device_id, info.device)
+                continue
+
+            logger.info(f"Discovered Arduino {device_id} on {info.device}")
+            ingestor = self.add_device(device_id, info.device)
+            if self.on_device_added is not None:
+                try:
+                    self.on_device_added(ingestor)
+                except Exception as e:
+                    logger.error(f"Failed to set up discovered device {device_id}: {e}")
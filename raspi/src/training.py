@@ -1,9 +1,13 @@
 import joblib
 import logging
+import os
+import numpy as np
+import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
 from . import config
+from .preprocessing import FEATURE_COLUMNS
 
 logger = logging.getLogger(__name__)
 
@@ -12,34 +16,151 @@ class ModelTrainer:
         self.db_manager = db_manager
         self.preprocessor = preprocessor
 
-    def train_model(self):
+    def train_model(self, full=False):
+        """
+        Update the model with the feature rows stored since its training
+        watermark: TRAINING_INCREMENTAL_TREES new trees fitted on just those
+        rows join the forest (warm start), so a run costs the same however
+        long the history grows. A full retrain on all of history happens when
+        full=True, or when there is no usable model to build on.
+        Returns True when a model was saved.
+        """
+        model = None if full else self._load_model()
+        if model is None:
+            return self._train_full()
+        return self._train_incremental(model)
+
+    def _train_full(self):
         """Fetch data, process it, train model, save it."""
-        logger.info("Starting model training job...")
-        raw_data = self.db_manager.get_all_data()
-        
-        if len(raw_data) < 50:
-            logger.warning("Not enough data to train model (need > 50 samples). Skipping.")
-            return False
+        logger.info("Starting full model training job...")
+        # Rows stored from here on are left for the next incremental run
+        watermark = self.db_manager.get_max_feature_id()
+        X, y = self._load_training_set(until_id=watermark)
 
-        X, y = self.preprocessor.prepare_dataset(raw_data)
-        
         if len(X) == 0:
             logger.warning("Preprocessing returned empty dataset.")
             return False
 
+        if len(X) < 50:
+            logger.warning("Not enough data to train model (need > 50 samples). Skipping.")
+            return False
+
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
+
         # Train
-        clf = RandomForestClassifier(n_estimators=50, max_depth=5)
+        clf = RandomForestClassifier(n_estimators=config.TRAINING_TREES, max_depth=5)
         clf.fit(X_train, y_train)
-        
+
         # Evaluate
         preds = clf.predict(X_test)
         acc = accuracy_score(y_test, preds)
         logger.info(f"Model trained with accuracy: {acc:.2f}")
-        
-        # Save
-        joblib.dump(clf, config.MODEL_PATH)
-        logger.info(f"Model saved to {config.MODEL_PATH}")
+
+        self._save_model(clf, watermark)
+        return True
+
+    def _train_incremental(self, model):
+        """Add trees fitted on the rows after the model's watermark; keep the model if there are too few."""
+        logger.info(f"Starting incremental model training job (after feature row {model.training_watermark_})...")
+        watermark = self.db_manager.get_max_feature_id()
+        X, y = self._load_training_set(after_id=model.training_watermark_, until_id=watermark)
+
+        if len(X) < config.TRAINING_MIN_NEW_SAMPLES:
+            logger.info(f"Only {len(X)} new samples since the last training. Keeping the model.")
+            return False
+        if set(np.unique(y)) != set(model.classes_):
+            # New trees must output the same classes as the old ones; the rows stay
+            # after the watermark until a later run also sees the missing class
+            logger.info(f"New samples cover classes {np.unique(y).tolist()} of {model.classes_.tolist()}. "
+                        f"Keeping the model.")
+            return False
+
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        before = accuracy_score(y_test, model.predict(X_test))
+
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + config.TRAINING_INCREMENTAL_TREES)
+        model.fit(X_train, y_train)
+        excess = len(model.estimators_) - config.TRAINING_MAX_TREES
+        if excess > 0:
+            # The oldest trees (oldest data) go first
+            del model.estimators_[:excess]
+            model.set_params(n_estimators=len(model.estimators_))
+
+        acc = accuracy_score(y_test, model.predict(X_test))
+        logger.info(f"Model updated with {len(X)} new samples ({len(model.estimators_)} trees); "
+                    f"accuracy on new data {before:.2f} -> {acc:.2f}")
+        self._save_model(model, watermark)
         return True
+
+    def _load_model(self):
+        """The saved model to build on, or None when a full retrain is needed."""
+        if not os.path.exists(config.MODEL_PATH):
+            return None
+        try:
+            model = joblib.load(config.MODEL_PATH)
+        except Exception as e:
+            logger.warning(f"Could not load the saved model, retraining from scratch: {e}")
+            return None
+        if (not isinstance(model, RandomForestClassifier) or not hasattr(model, 'training_watermark_')
+                or list(getattr(model, 'feature_names_in_', [])) != FEATURE_COLUMNS):
+            logger.info("Saved model predates incremental training or the current features, retraining from scratch.")
+            return None
+        return model
+
+    def _save_model(self, model, watermark):
+        # The watermark travels with the model, so the two can never disagree
+        model.training_watermark_ = watermark
+        joblib.dump(model, config.MODEL_PATH)
+        logger.info(f"Model saved to {config.MODEL_PATH} (trained through feature row {watermark})")
+
+    def _load_training_set(self, after_id=None, until_id=None):
+        """
+        Stream the feature store's rows in chunks and keep a uniform random sample
+        (reservoir) of at most TRAINING_MAX_SAMPLES, so memory stays bounded however
+        long the history grows. after_id / until_id: features row id range.
+        """
+        capacity = config.TRAINING_MAX_SAMPLES
+        rng = np.random.default_rng()
+        X_res = y_res = None
+        feature_cols = None
+        seen = 0
+
+        for device_id, chunk in self._iter_history(after_id, until_id):
+            X, y = self.preprocessor.prepare_dataset(chunk)
+            if len(X) == 0:
+                continue
+
+            if X_res is None:
+                feature_cols = list(X.columns)
+                X_res = np.empty((capacity, len(feature_cols)), dtype=np.float64)
+                y_res = np.empty(capacity, dtype=np.int64)
+
+            X_chunk = X.to_numpy(dtype=np.float64)
+            y_chunk = y.to_numpy()
+            index = seen + np.arange(len(X_chunk))
+            seen += len(X_chunk)
+
+            # Fill the reservoir first, then replace entries with probability capacity / index
+            fill = index < capacity
+            X_res[index[fill]] = X_chunk[fill]
+            y_res[index[fill]] = y_chunk[fill]
+            slots = rng.integers(0, index[~fill] + 1) if (~fill).any() else np.empty(0, dtype=np.int64)
+            keep = slots < capacity
+            X_res[slots[keep]] = X_chunk[~fill][keep]
+            y_res[slots[keep]] = y_chunk[~fill][keep]
+
+        if X_res is None:
+            return pd.DataFrame(), pd.Series(dtype=np.int64)
+
+        size = min(seen, capacity)
+        logger.info(f"Training set: {size} samples drawn from {seen} rows of history")
+        return pd.DataFrame(X_res[:size], columns=feature_cols), pd.Series(y_res[:size])
+
+    def _iter_history(self, after_id=None, until_id=None):
+        """(device_id, float64 chunk of feature rows) pairs, one device at a time."""
+        for device_id in self.db_manager.get_device_ids():
+            for chunk in self.db_manager.iter_feature_chunks(chunk_size=config.TRAINING_CHUNK_SIZE,
+                                                             device_id=device_id, after_id=after_id,
+                                                             until_id=until_id):
+                yield device_id, chunk
@@ -0,0 +1,172 @@
+import logging
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# quality_flags bits stored with every reading (NULL: recorded before validation existed).
+# Each soil probe has three bits, probe 1 lowest: SOIL_OUT_OF_RANGE << (3 * (probe - 1)), etc.
+SOIL_OUT_OF_RANGE = 1  # Outside SOIL_PROBE_MIN..SOIL_PROBE_MAX: disconnected or shorted
+SOIL_STUCK = 2         # Same value for SOIL_STUCK_READINGS readings in a row
+SOIL_SPIKE = 4         # Jumped away from the other probes
+SOIL_UNAVAILABLE = 1 << 9  # No usable probe; soil_moisture_avg is the Arduino's plain mean
+DHT_FAILED = 1 << 10       # Temperature and humidity both 0: the firmware's failed DHT read
+
+_PROBE_FAULTS = ((SOIL_OUT_OF_RANGE, 'out of range'), (SOIL_STUCK, 'stuck'), (SOIL_SPIKE, 'spiking'))
+
+def probe_flag(fault, probe):
+    """The quality_flags bit of one fault on soil probe 1, 2 or 3."""
+    return fault << (3 * (probe - 1))
+
+def describe_flags(flags):
+    """Human-readable problems in a quality_flags value, e.g. ['soil probe 2 stuck']."""
+    if not flags:
+        return []
+    problems = []
+    for probe in (1, 2, 3):
+        for fault, name in _PROBE_FAULTS:
+            if flags & probe_flag(fault, probe):
+                problems.append(f"soil probe {probe} {name}")
+    if flags & SOIL_UNAVAILABLE:
+        problems.append("no usable soil probe")
+    if flags & DHT_FAILED:
+        problems.append("DHT read failed")
+    return problems
+
+class _ProbeState:
+    __slots__ = ('last', 'repeats', 'level', 'noise', 'samples', 'jumps', 'usable')
+
+    def __init__(self):
+        self.last = None
+        self.repeats = 0
+        # Expected value (follows the shared moves, smooths the probe's own) and EWMA of the squared disagreement
+        self.level = None
+        self.noise = 0.0
+        self.samples = 0
+        # Consecutive readings flagged as spikes
+        self.jumps = 0
+        self.usable = False
+
+class ReadingValidator:
+    """
+    Streaming validation and fusion of one Arduino's three soil probes.
+
+    Per probe it keeps only a few running values, so each reading costs O(1):
+    - out of range: at or beyond the ADC rails (0 / 1023 is a loose or
+      shorted probe),
+    - stuck: the exact same value SOIL_STUCK_READINGS times in a row (a live
+      probe always jitters by a count or two),
+    - spike: the probe's step away from its level disagrees with the step
+      the probes took together (median of three; with two, the smaller step)
+      by more than SOIL_SPIKE_SIGMAS noise deviations and SOIL_SPIKE_MIN_COUNTS.
+      Watering moves every probe together and is not a spike. A spike that
+      lasts SOIL_SPIKE_ACCEPT_READINGS becomes the probe's new level.
+
+    soil_moisture_avg is the median of the usable probes (the mean of two,
+    or the one left), so one bad probe cannot drag it.
+    """
+    def __init__(self, device_id=config.DEFAULT_DEVICE_ID, low=config.SOIL_PROBE_MIN, high=config.SOIL_PROBE_MAX,
+                 stuck_readings=config.SOIL_STUCK_READINGS, window=config.SOIL_VALIDATION_WINDOW,
+                 spike_sigmas=config.SOIL_SPIKE_SIGMAS, spike_min=config.SOIL_SPIKE_MIN_COUNTS,
+                 spike_accept=config.SOIL_SPIKE_ACCEPT_READINGS):
+        self.device_id = device_id
+        self.low = low
+        self.high = high
+        self.stuck_readings = stuck_readings
+        self.alpha = 2 / (window + 1)
+        self.warmup = min(window, 10)
+        self.spike_sigmas = spike_sigmas
+        self.spike_min = spike_min
+        self.spike_accept = spike_accept
+        self._probes = [_ProbeState() for _ in range(3)]
+        self._reported = 0
+
+    def validate(self, soil, soil_avg, temp, hum):
+        """
+        Check one reading. soil: the three probe values; soil_avg: the
+        Arduino's mean (kept only when no probe is usable).
+        Returns (fused soil_moisture_avg, quality_flags).
+        """
+        flags = 0
+        plausible = []
+        for i, (state, value) in enumerate(zip(self._probes, soil)):
+            if value is None or not self.low <= value <= self.high:
+                flags |= SOIL_OUT_OF_RANGE << (3 * i)
+                state.usable = False
+                state.last = value
+                continue
+            if value == state.last:
+                state.repeats += 1
+            else:
+                state.repeats = 1
+                state.last = value
+            if state.repeats >= self.stuck_readings:
+                flags |= SOIL_STUCK << (3 * i)
+                state.usable = False
+                continue
+            if not state.usable:
+                # (Re)starting: there is no level to compare against yet
+                state.level = value
+                state.jumps = 0
+                state.usable = True
+            plausible.append(i)
+
+        # How far each probe moved from its level, against how far the others moved
+        steps = [soil[i] - self._probes[i].level for i in plausible]
+        if len(steps) >= 3:
+            common = sorted(steps)[len(steps) // 2]
+        elif len(steps) == 2:
+            common = steps[0] if abs(steps[0]) <= abs(steps[1]) else steps[1]
+        else:
+            common = 0
+
+        usable = []
+        for i, step in zip(plausible, steps):
+            state = self._probes[i]
+            error = step - common
+            threshold = max(self.spike_min, self.spike_sigmas * state.noise ** 0.5)
+            if state.samples >= self.warmup and abs(error) > threshold:
+                state.jumps += 1
+                if state.jumps < self.spike_accept:
+                    flags |= SOIL_SPIKE << (3 * i)
+                    # Keep following the others so the probe fits back in when the spike ends
+                    state.level += common
+                    continue
+                # Not a spike after all: the probe settled at a new level
+                state.level = soil[i]
+                state.jumps = 0
+                usable.append(soil[i])
+                continue
+            state.jumps = 0
+            # Moves shared by all probes are followed at once; the probe's own share is smoothed
+            state.level += common + self.alpha * error
+            state.noise += self.alpha * (error * error - state.noise)
+            state.samples += 1
+            usable.append(soil[i])
+
+        if len(usable) == 3:
+            fused = sorted(usable)[1]
+        elif len(usable) == 2:
+            fused = (usable[0] + usable[1]) // 2
+        elif usable:
+            fused = usable[0]
+        else:
+            fused = soil_avg
+            flags |= SOIL_UNAVAILABLE
+
+        if temp == 0 and hum == 0:
+            flags |= DHT_FAILED
+
+        if flags != self._reported:
+            self._report(flags)
+        return fused, flags
+
+    def _report(self, flags):
+        # Log only changes, not every reading; spikes are too short-lived to report one by one
+        spikes = sum(probe_flag(SOIL_SPIKE, probe) for probe in (1, 2, 3))
+        if (flags & ~spikes) != (self._reported & ~spikes):
+            problems = describe_flags(flags & ~spikes)
+            if problems:
+                logger.warning(f"Sensor problems on {self.device_id}: {', '.join(problems)}")
+            else:
+                logger.info(f"Sensors on {self.device_id} back to normal")
+        self._reported = flags
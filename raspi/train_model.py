@@ -0,0 +1,29 @@
+import argparse
+import logging
+import os
+import sys
+
+# Add the project root to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import config
+from src.database import DatabaseManager
+from src.preprocessing import DataPreprocessor
+from src.training import ModelTrainer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train the stress model now: incrementally on the feature rows since the last run, or from scratch.")
+    parser.add_argument('--full', action='store_true', help="Retrain on all of history instead of updating the model")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager()
+    trainer = ModelTrainer(db_manager, DataPreprocessor())
+    saved = trainer.train_model(full=args.full)
+    print(f"Model {'saved to ' + config.MODEL_PATH if saved else 'unchanged'}")
+    db_manager.close()
+
+if __name__ == "__main__":
+    main()